@@ -1,9 +1,32 @@
 """
 Agent package for handling various AI planning and orchestration tasks.
+
+The agents are loaded on first attribute access, so importing a light
+submodule (e.g. agent.tools.geosorting) doesn't pull in the planners and
+their OpenAI/Google client libraries.
 """
 
-from .orchestrator import OrchestratorAgent, TaskType
-from .daily_planner import AntyAIPlanner
-from .activity_planner import AntyAIActivityPlanner
+from importlib import import_module
+
+from dotenv import load_dotenv
+
+# The only load_dotenv() call: it runs before any submodule reads its settings.
+load_dotenv()
+
+_LAZY_ATTRIBUTES = {
+    'OrchestratorAgent': '.orchestrator',
+    'TaskType': '.orchestrator',
+    'AntyAIPlanner': '.daily_planner',
+    'AntyAIActivityPlanner': '.activity_planner',
+}
+
+__all__ = ['OrchestratorAgent', 'TaskType', 'AntyAIPlanner', 'AntyAIActivityPlanner']
+
 
-__all__ = ['OrchestratorAgent', 'TaskType', 'AntyAIPlanner', 'AntyAIActivityPlanner'] 
\ No newline at end of file
+def __getattr__(name):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
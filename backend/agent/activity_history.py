@@ -1,63 +1,260 @@
+import hashlib
 import json
 import os
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
+
+from .visited_places import VisitedIndex
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where only threads of one process are serialised
+    fcntl = None
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+# Compaction is checked every COMPACT_EVERY appends and trims the log to the
+# newest MAX_ENTRIES entries (dropping any torn or unparseable lines).
+COMPACT_EVERY = 500
+MAX_ENTRIES = 1000
+
+_TAIL_BLOCK_SIZE = 8192
+
+_SAFE_USER_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Histories of the most recent users are kept loaded, visited index included
+RECENT_HISTORIES = 1024
+
 
 class ActivityHistory:
-    def __init__(self):
-        self.history_file = os.path.join(os.path.dirname(__file__), '..', 'data', 'activity_history.json')
+    """Activity history stored as an append-only JSON-lines log.
+
+    Each entry is one line, so adding an activity is a single append and the
+    most recent entries are read by seeking backwards from the end of the file
+    instead of parsing the whole history.
+
+    Appends and compaction hold an flock on a `.lock` file next to the log, so
+    the workers of a multi-process server don't lose each other's entries.
+    """
+
+    def __init__(self, history_file: Optional[str] = None, max_entries: int = MAX_ENTRIES,
+                 user_id: Optional[str] = None):
+        """
+        Args:
+            history_file (str, optional): Explicit log path, mostly for tests and tools.
+            max_entries (int): Number of entries kept by compaction.
+            user_id (str, optional): Shard the history per user under data/activity_history/.
+                Without it the shared data/activity_history.jsonl log is used.
+        """
+        if history_file is None:
+            if user_id is None:
+                history_file = os.path.join(DATA_DIR, 'activity_history.jsonl')
+            else:
+                history_file = os.path.join(DATA_DIR, 'activity_history', f"{_shard_name(user_id)}.jsonl")
+        self.history_file = history_file
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._appends_since_compaction = 0
+        self._visited = None
+        # Identity of the log file and the bytes of it the visited index has seen
+        self._visited_inode = None
+        self._visited_offset = 0
         self._ensure_history_file_exists()
 
+    @contextmanager
+    def _exclusive(self):
+        """Hold the log for writing, against other threads and other worker processes."""
+        with self._lock:
+            # Lock a separate file: compaction replaces the log, and with it a lock on the log itself.
+            with open(self.history_file + '.lock', 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                yield
+
     def _ensure_history_file_exists(self):
-        """Ensure the history file exists and has the correct structure."""
-        if not os.path.exists(self.history_file):
-            with open(self.history_file, 'w') as f:
-                json.dump({
-                    "activities": [],
-                    "last_updated": datetime.now().isoformat()
-                }, f, indent=2)
+        """Ensure the log exists, importing the legacy JSON history on first run."""
+        if os.path.exists(self.history_file):
+            return
+        os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
+        with self._exclusive():
+            # Another worker may have created it while we waited for the lock.
+            if not os.path.exists(self.history_file):
+                self._migrate_legacy_history()
+
+    def _migrate_legacy_history(self):
+        legacy_file = os.path.splitext(self.history_file)[0] + '.json'
+        entries = []
+        if os.path.exists(legacy_file):
+            try:
+                with open(legacy_file, 'r') as f:
+                    entries = json.load(f).get("activities", [])
+            except Exception as e:
+                print(f"Error migrating legacy activity history: {e}")
+        self._write_entries(entries)
+
+    def _write_entries(self, entries: List[Dict[str, Any]]) -> None:
+        """Atomically replace the log with the given entries."""
+        tmp_file = self.history_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.history_file)
 
     def add_activity(self, activity: Dict[str, Any], details: Dict[str, Any]) -> None:
         """Add a new activity to the history."""
+        activity_entry = {
+            "activity": activity,
+            "details": details,
+            "timestamp": datetime.now().isoformat()
+        }
+        line = (json.dumps(activity_entry, ensure_ascii=False) + '\n').encode('utf-8')
+
         try:
-            with open(self.history_file, 'r') as f:
-                data = json.load(f)
+            with self._exclusive():
+                with open(self.history_file, 'a+b') as f:
+                    if f.seek(0, os.SEEK_END) > 0:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b'\n':
+                            # Don't glue the new entry onto a torn last line.
+                            line = b'\n' + line
+                    f.write(line)
+                self._appends_since_compaction += 1
+                should_compact = self._appends_since_compaction >= COMPACT_EVERY
+        except Exception as e:
+            print(f"Error adding activity to history: {e}")
+            raise
 
-            # Add timestamp to the activity
-            activity_entry = {
-                "activity": activity,
-                "details": details,
-                "timestamp": datetime.now().isoformat()
-            }
+        if should_compact:
+            self.compact()
 
-            data["activities"].append(activity_entry)
-            data["last_updated"] = datetime.now().isoformat()
+    def compact(self) -> None:
+        """Rewrite the log keeping only the newest `max_entries` valid entries."""
+        with self._exclusive():
+            entries = self._read_all()
+            self._write_entries(entries[-self.max_entries:])
+            self._appends_since_compaction = 0
 
-            with open(self.history_file, 'w') as f:
-                json.dump(data, f, indent=2)
+    def _read_all(self) -> List[Dict[str, Any]]:
+        entries = []
+        with open(self.history_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                entry = self._parse_line(line)
+                if entry is not None:
+                    entries.append(entry)
+        return entries
 
-        except Exception as e:
-            print(f"Error adding activity to history: {e}")
-            raise
+    @staticmethod
+    def _parse_line(line) -> Optional[Dict[str, Any]]:
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            # A torn write from a crashed process; compaction drops it.
+            return None
+
+    def _tail_lines(self, count: int) -> List[bytes]:
+        """Return up to `count` last lines of the log without reading all of it."""
+        with open(self.history_file, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            buffer = b''
+            # One extra newline is needed because the last line is newline-terminated.
+            while position > 0 and buffer.count(b'\n') <= count:
+                read_size = min(_TAIL_BLOCK_SIZE, position)
+                position -= read_size
+                f.seek(position)
+                buffer = f.read(read_size) + buffer
+        lines = buffer.splitlines()
+        if position > 0:
+            # The first line may have been cut in half by the block boundary.
+            lines = lines[1:]
+        return lines[-count:]
 
     def get_recent_activities(self, limit: int = 5) -> List[Dict[str, Any]]:
         """Get the most recent activities."""
+        if limit <= 0:
+            return []
         try:
-            with open(self.history_file, 'r') as f:
-                data = json.load(f)
-            
-            # Return the most recent activities, limited by the specified number
-            return data["activities"][-limit:]
+            # Over-read a little so skipped torn lines don't shrink the result.
+            entries = [e for e in map(self._parse_line, self._tail_lines(limit + 2)) if e is not None]
+            return entries[-limit:]
         except Exception as e:
             print(f"Error getting recent activities: {e}")
             return []
 
+    def visited_index(self) -> VisitedIndex:
+        """Visited places and categories of this history.
+
+        Built on first use, then caught up with the entries appended since, by
+        this worker or any other. A compacted log is indexed afresh.
+        """
+        with self._lock:
+            try:
+                self._update_visited()
+            except Exception as e:
+                print(f"Error updating visited index: {e}")
+                if self._visited is None:
+                    self._visited = VisitedIndex()
+            return self._visited
+
+    def _update_visited(self) -> None:
+        with open(self.history_file, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if self._visited is None or stat.st_ino != self._visited_inode or stat.st_size < self._visited_offset:
+                self._visited = VisitedIndex()
+                self._visited_inode = stat.st_ino
+                self._visited_offset = 0
+            f.seek(self._visited_offset)
+            new_bytes = f.read()
+        # Leave a line that is still being written for the next update.
+        complete = new_bytes.rfind(b'\n') + 1
+        for line in new_bytes[:complete].splitlines():
+            entry = self._parse_line(line)
+            if entry is not None:
+                self._visited.add(entry)
+        self._visited_offset += complete
+
     def get_activity_history(self) -> List[Dict[str, Any]]:
         """Get the complete activity history."""
         try:
-            with open(self.history_file, 'r') as f:
-                data = json.load(f)
-            return data["activities"]
+            return self._read_all()
         except Exception as e:
             print(f"Error getting activity history: {e}")
-            return [] 
\ No newline at end of file
+            return []
+
+
+def _shard_name(user_id: str) -> str:
+    """File-system safe shard name for a user id."""
+    if _SAFE_USER_ID.match(user_id):
+        return user_id
+    return hashlib.sha1(user_id.encode('utf-8')).hexdigest()
+
+
+# Every live history by user, so there is never a second instance with its own lock;
+# the recent ones are also held here so they outlive the request that loaded them.
+_histories = weakref.WeakValueDictionary()
+_recent_histories = OrderedDict()
+_histories_lock = threading.Lock()
+
+
+def history_for_user(user_id: Optional[str] = None) -> ActivityHistory:
+    """Return the shared ActivityHistory for the user, so appends go through one lock."""
+    with _histories_lock:
+        history = _histories.get(user_id)
+        if history is None:
+            history = _histories[user_id] = ActivityHistory(user_id=user_id)
+        _recent_histories[user_id] = history
+        _recent_histories.move_to_end(user_id)
+        if len(_recent_histories) > RECENT_HISTORIES:
+            # Still in use elsewhere it stays in _histories and is handed out again
+            _recent_histories.popitem(last=False)
+        return history
@@ -1,19 +1,20 @@
-from typing import Dict, List, Any
-from openai import AsyncOpenAI
+from typing import Dict, List, Any, Optional, Tuple
+from collections import OrderedDict
 
 from datetime import datetime
+import asyncio
 import os
-from dotenv import load_dotenv
-from .tools.weather import get_weather
+from .tools.weather import CITY_LOCATION, get_weather, get_weather_category
 import json
-from .tools.geosorting import main
-from .activity_history import ActivityHistory
-# Load environment variables
-load_dotenv()
-
-# Constants
-latitude = 51.2194  # Example latitude for Antwerp
-longitude = 4.4024  # Example longitude for Antwerp
+from .tools import geohash
+from .tools.geosorting import DEFAULT_LOCATION, GEOHASH_PRECISION, dataset_version, filter_visited, main
+from .activity_history import history_for_user
+from .visited_places import VisitedIndex
+from .singleflight import SingleFlight, fingerprint
+from .metrics import timed
+from .admission import OPENAI, Overloaded
+from .llm_policy import CallPolicy, InvalidResponse, tool_call_arguments
+from . import model_router
 
 AGENT_PROMPT = """
 You are an AI assistant specialized in creating plan for an activity based.
@@ -61,20 +62,77 @@ def load_amenities() -> List[str]:
         return json.load(f)
 
 AMENITIES = load_amenities()
-    
-    
-    
+
+# "two_call" selects the dataset and plans in separate completions; "fused" does both in one
+ACTIVITY_PLANNER_MODE = os.getenv('ACTIVITY_PLANNER_MODE', 'two_call')
+FUSED_CANDIDATES_PER_CATEGORY = 5
+# Nearest places kept per category before the user's visited places are filtered out
+FUSED_CANDIDATE_POOL = 3 * FUSED_CANDIDATES_PER_CATEGORY
+# Geohash cells whose candidate pools are kept
+MAX_CANDIDATE_CELLS = 256
+
+PLAN_ACTIVITY_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "plan_activity",
+        "description": "Plan the activity at one of the candidate places.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "category": {"type": "string", "enum": AMENITIES, "description": "Category of the chosen place"},
+                "location_id": {"type": "string", "description": "id of the chosen place from the map dataset"},
+                "activity_name": {"type": "string"},
+                "activity_description": {"type": "string"},
+                "text_to_speech": {"type": "string", "description": "Text to Speech description of the activity"}
+            },
+            "required": ["category", "location_id", "activity_name", "activity_description", "text_to_speech"]
+        }
+    }
+}
+
+DATASET_SELECTION_SCHEMA = {
+    "type": "object",
+    "properties": {"dataset": {"type": "string", "enum": AMENITIES}},
+    "required": ["dataset"],
+}
+ACTIVITY_PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "activity_name": {"type": "string"},
+        "activity_description": {"type": "string"},
+        "text_to_speech": {"type": "string"},
+        "location_id": {"type": ["string", "integer"]},
+    },
+    "required": ["activity_name", "activity_description", "text_to_speech", "location_id"],
+}
+
+DATASET_SELECTION_POLICY = CallPolicy("dataset_selection_llm", DATASET_SELECTION_SCHEMA,
+                                      deadline=float(os.getenv('DATASET_SELECTION_DEADLINE_SECONDS', 15)),
+                                      limiter=OPENAI, route=model_router.CATEGORY_SELECTION)
+GENERATION_POLICY = CallPolicy("generation_llm", ACTIVITY_PLAN_SCHEMA, limiter=OPENAI,
+                               route=model_router.ACTIVITY_PLAN)
+FUSED_PLANNING_POLICY = CallPolicy("fused_planning_llm", PLAN_ACTIVITY_TOOL["function"]["parameters"],
+                                   extract=tool_call_arguments, limiter=OPENAI,
+                                   route=model_router.ACTIVITY_PLAN)
+
+
+# Concurrent requests planning the same activity for the same user share one plan
+ACTIVITY_PLAN_FLIGHT = SingleFlight("activity_planner")
+
 
 class AntyAIActivityPlanner:
     def __init__(self):
         """Initialize the Anty AI agent with OpenAI configuration."""
+        from openai import AsyncOpenAI  # deferred, importing openai takes about a second
+
         self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self.weather = get_weather(latitude, longitude)
         self.amenities = AMENITIES
         self.system_prompt = AGENT_PROMPT
         self.current_time = datetime.now().strftime('%H:%M')
         self.antwerp_map_dataset = load_antwerp_map_dataset()
-        self.activity_history = ActivityHistory()
+        # (geohash cell, place filter, weather, dataset version) -> candidate pool per category,
+        # least recently used first
+        self._category_candidates = OrderedDict()
     
     async def select_dataset_to_use(self, activity_description: str):
         prompt = f"""
@@ -89,81 +147,222 @@ class AntyAIActivityPlanner:
         }}
         """
         
-        response = await self.client.chat.completions.create(
-            model="gpt-4-1106-preview",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=1000,
-            response_format={ "type": "json_object" }
-        )
-        return json.loads(response.choices[0].message.content)
+        model, max_tokens = model_router.CATEGORY_SELECTION.choose()
+        with timed("dataset_selection_llm"):
+            return await DATASET_SELECTION_POLICY.run(
+                lambda messages: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=max_tokens,
+                    response_format={ "type": "json_object" }
+                ),
+                [{"role": "user", "content": prompt}],
+                model=model
+            )
     
-    async def generate_recommendations(self, activity_description: str) -> List[Dict]:
-        """Generate personalized recommendations based on user preferences."""
+    def category_candidates(self, visited: Optional[VisitedIndex] = None,
+                            user_location: Optional[Tuple[float, float]] = None,
+                            place_filter: Optional[str] = None,
+                            weather_category: Optional[str] = None) -> Dict[str, List[Dict]]:
+        """Nearest few places of every category for fused planning.
         
-        try:
-            # Get the dataset selection
-            dataset_result = await self.select_dataset_to_use(activity_description)
-            print("Selected dataset:", dataset_result)
-            
-            # Update the map dataset based on the selected dataset
-            self.antwerp_map_dataset = main(dataset_result['dataset'])
-            print("Updated map dataset:", self.antwerp_map_dataset)
-            
-            # Get recent activities
-            recent_activities = self.activity_history.get_recent_activities(5)
-            
-            # Construct the user prompt
-            user_prompt = f"""
+        The nearest FUSED_CANDIDATE_POOL places per category are computed once per
+        geohash cell and place filter, from the cell centre; the user's recently
+        visited places are filtered out of that pool.
+        """
+        location = user_location or DEFAULT_LOCATION
+        cell, centre, _ = geohash.encode(location[0], location[1], GEOHASH_PRECISION)
+        key = (cell, place_filter, weather_category, dataset_version())
+        pools = self._category_candidates.get(key)
+        if pools is not None:
+            self._category_candidates.move_to_end(key)
+        else:
+            pools = {}
+            for category in self.amenities:
+                pools[category] = [
+                    {
+                        "id": str(place['id']),
+                        "name": place['name'],
+                        "distance_km": place['distance_km'],
+                        "opening_hours": place['opening_hours'],
+                    }
+                    for place in main(category, user_location=centre, limit=FUSED_CANDIDATE_POOL,
+                                      place_filter=place_filter, weather_category=weather_category)
+                ]
+            self._category_candidates[key] = pools
+            while len(self._category_candidates) > MAX_CANDIDATE_CELLS:
+                self._category_candidates.popitem(last=False)
+        if visited is None:
+            return {category: places[:FUSED_CANDIDATES_PER_CATEGORY]
+                    for category, places in pools.items()}
+        return {
+            category: [
+                {key: value for key, value in place.items() if key != 'visited_weight'}
+                for place in filter_visited([dict(p) for p in places], visited)[:FUSED_CANDIDATES_PER_CATEGORY]
+            ]
+            for category, places in pools.items()
+        }
+    
+    def _user_prompt(self, activity_description: str, map_dataset, visited: VisitedIndex, weather: Dict) -> str:
+        # Places visited lately are already filtered out of the map dataset;
+        # only the categories they went for a lot are worth a line in the prompt.
+        frequent = visited.frequent_categories()
+        recent_line = f"Frequently visited lately: {', '.join(frequent)}\n" if frequent else ""
+        return f"""
             these are the user preferences:
 
             Activity description: {activity_description}
             Current time: {self.current_time}
-            Current weather: {self.weather}
-            Antwerp map dataset: {self.antwerp_map_dataset}
-            
-            Recent activities:
-            {json.dumps(recent_activities, indent=2)}
-            
-            Please consider the user's recent activities when making recommendations.
-            Try to suggest something different from what they've done recently.
-            
+            Current weather: {weather}
+            Antwerp map dataset: {map_dataset}
+            {recent_line}"""
+    
+    async def _plan_two_call(self, activity_description: str, visited: VisitedIndex, weather: Dict,
+                             user_location: Optional[Tuple[float, float]] = None,
+                             place_filter: Optional[str] = None) -> Dict:
+        """Pick the dataset with one completion, then plan the activity with a second one."""
+        # Get the dataset selection
+        dataset_result = await self.select_dataset_to_use(activity_description)
+        print("Selected dataset:", dataset_result)
+        
+        # Update the map dataset based on the selected dataset
+        map_dataset = main(dataset_result['dataset'], visited=visited, user_location=user_location,
+                           place_filter=place_filter, weather_category=get_weather_category(weather))
+        print("Updated map dataset:", map_dataset)
+        
+        # Construct the user prompt
+        user_prompt = self._user_prompt(activity_description, map_dataset, visited, weather) + """
             # [OUTPUT FORMAT]
             You MUST return the following JSON format:
 
-            {{
+            {
                 "activity_name": "Activity Name",
                 "activity_description": "Location Description",
                 "text_to_speech": "Text to Speech description of the activity",
                 "location_id": "Location ID"
-            }}
+            }
 
             # [EXAMPLE]
-            {{
+            {
                 "activity_name": "breakfast",
                 "activity_description": "",
                 "text_to_speech": "Good morning! Anty here! It's 9:30 AM, and I know you've got classes this morning — but how about we start the day with something warm? I've found a cozy café nearby: ToiToiToi where you can grab breakfast before heading in.",
                 "location_id": "1234567890"
-            }}
+            }
             """
 
-            response = await self.client.chat.completions.create(
-                model="gpt-4-1106-preview",
-                messages=[
+        model, max_tokens = model_router.ACTIVITY_PLAN.choose()
+        with timed("generation_llm"):
+            result = await GENERATION_POLICY.run(
+                lambda messages: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=max_tokens,
+                    response_format={ "type": "json_object" }
+                ),
+                [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                model=model
+            )
+        
+        result["category"] = dataset_result['dataset']
+        return result
+    
+    async def _plan_fused(self, activity_description: str, visited: VisitedIndex, weather: Dict,
+                          user_location: Optional[Tuple[float, float]] = None,
+                          place_filter: Optional[str] = None) -> Dict:
+        """Pick the category and the place and plan the activity in a single completion."""
+        candidates = self.category_candidates(visited, user_location, place_filter, get_weather_category(weather))
+        user_prompt = self._user_prompt(activity_description, json.dumps(candidates), visited, weather) + """
+            The map dataset lists the nearest places of every category.
+            Pick the category that fits the activity best and one of its places,
+            then call plan_activity with your plan.
+            """
+        
+        model, max_tokens = model_router.ACTIVITY_PLAN.choose()
+        with timed("fused_planning_llm"):
+            result = await FUSED_PLANNING_POLICY.run(
+                lambda messages: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=max_tokens,
+                    tools=[PLAN_ACTIVITY_TOOL],
+                    tool_choice={"type": "function", "function": {"name": "plan_activity"}}
+                ),
+                [
                     {"role": "system", "content": self.system_prompt},
                     {"role": "user", "content": user_prompt}
                 ],
-                temperature=0.7,
-                max_tokens=1000,
-                response_format={ "type": "json_object" }
+                model=model
             )
+        
+        category = result.get("category")
+        if category not in candidates:
+            raise ValueError(f"Fused planning picked an unknown category: {category}")
+        place_ids = [place["id"] for place in candidates[category]]
+        if place_ids and str(result.get("location_id")) not in place_ids:
+            # The model invented an id; fall back to the nearest place of its category.
+            result["location_id"] = place_ids[0]
+        return result
+    
+    async def generate_recommendations(self, activity_description: str, user_id: Optional[str] = None,
+                                       mode: Optional[str] = None,
+                                       user_location: Optional[Tuple[float, float]] = None,
+                                       place_filter: Optional[str] = None,
+                                       weather: Optional[Dict] = None) -> Dict:
+        """Generate personalized recommendations based on user preferences.
+        
+        Args:
+            activity_description (str): The activity from the daily plan
+            user_id (str, optional): Whose activity history to take into account
+            mode (str, optional): "fused" for a single completion or "two_call" for
+                dataset selection followed by planning. Defaults to ACTIVITY_PLANNER_MODE.
+            user_location (tuple, optional): (lat, lon) places are ranked from.
+            place_filter (str, optional): Tag filter expression the places must match,
+                e.g. "wheelchair AND indoor_seating".
+            weather (dict, optional): Current weather (see tools.weather.get_weather);
+                fetched if not given.
+        
+        Identical concurrent calls share one planning run.
+        """
+        mode = mode or ACTIVITY_PLANNER_MODE
+        if weather is None:
+            weather = await asyncio.to_thread(get_weather, *CITY_LOCATION)
+        return await ACTIVITY_PLAN_FLIGHT.do_async(
+            fingerprint(activity_description, user_id, mode, user_location, place_filter, get_weather_category(weather)),
+            self._generate_recommendations, activity_description, user_id, mode, user_location, place_filter, weather
+        )
+    
+    async def _generate_recommendations(self, activity_description: str, user_id: Optional[str],
+                                        mode: str, user_location: Optional[Tuple[float, float]],
+                                        place_filter: Optional[str], weather: Dict) -> Dict:
+        try:
+            # Places and categories the user visited lately
+            with timed("history_read"):
+                visited = history_for_user(user_id).visited_index()
+            
+            if mode == "fused":
+                try:
+                    result = await self._plan_fused(activity_description, visited, weather, user_location, place_filter)
+                except (ValueError, InvalidResponse) as e:
+                    print(f"Fused planning failed, using two calls: {e}")
+                    result = await self._plan_two_call(activity_description, visited, weather, user_location,
+                                                       place_filter)
+            else:
+                result = await self._plan_two_call(activity_description, visited, weather, user_location, place_filter)
             
-            result = json.loads(response.choices[0].message.content)
             return {
                 "result": result,
                 "status": "success"
             }
             
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Error generating recommendations: {e}")
             return {
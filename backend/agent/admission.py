@@ -0,0 +1,240 @@
+"""
+Admission control for upstream APIs (OpenAI, ElevenLabs, OpenWeather).
+
+Each provider has a token bucket (sustained requests per second plus a
+burst), a cap on concurrent requests and a bounded wait queue. A call that
+cannot start right away waits in the queue; if the queue is full, or the
+expected wait is longer than the provider's maximum queue time, the call is
+shed at once with `Overloaded` so the API can answer 503 with Retry-After
+instead of piling up requests that would time out or trigger upstream 429s.
+The expected wait covers both the tokens the waiters ahead need and, when
+the concurrent slots are taken, the recent time calls hold a slot.
+
+Limits are read from the environment, e.g. OPENAI_RATE_PER_SECOND,
+OPENAI_BURST, OPENAI_MAX_CONCURRENCY, OPENAI_MAX_QUEUE, OPENAI_MAX_WAIT_SECONDS.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
+
+from .metrics import REGISTRY
+
+# Async waiters can't be woken by a thread condition, they re-check this often.
+_ASYNC_POLL_SECONDS = 0.025
+# Weight of the newest call in the moving average of slot hold times
+_HOLD_SMOOTHING = 0.2
+
+UPSTREAM_QUEUE_SECONDS = REGISTRY.histogram(
+    "daybyday_upstream_queue_seconds",
+    "Time calls waited for admission to an upstream API.",
+    labelnames=("provider",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+UPSTREAM_SHED = REGISTRY.counter(
+    "daybyday_upstream_shed_total",
+    "Calls rejected before reaching an upstream API, by reason (queue_full or deadline).",
+    labelnames=("provider", "reason"),
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "daybyday_upstream_in_flight",
+    "Calls currently running against an upstream API.",
+    labelnames=("provider",),
+)
+UPSTREAM_QUEUED = REGISTRY.gauge(
+    "daybyday_upstream_queued",
+    "Calls currently waiting for admission to an upstream API.",
+    labelnames=("provider",),
+)
+
+
+class Overloaded(Exception):
+    """An upstream call was shed because its provider is at capacity."""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} is overloaded, retry in {retry_after:.0f}s (rate limit)")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, provider: str, rate: float, burst: int, max_concurrency: int,
+                 max_queue: int, max_wait: float):
+        """
+        Args:
+            provider (str): Metric label, e.g. "openai".
+            rate (float): Sustained requests per second.
+            burst (int): Requests that may start back to back after an idle period.
+            max_concurrency (int): Requests running at the same time.
+            max_queue (int): Calls allowed to wait; more are shed.
+            max_wait (float): Longest a call may wait in the queue, in seconds.
+        """
+        self.provider = provider
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._waiting = 0
+        # Moving average of how long calls hold a slot, None until one finished
+        self._hold_seconds = None
+        self._condition = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _try_acquire(self) -> Optional[float]:
+        """Take a slot and a token; otherwise return how long until a token is due. Caller holds the lock."""
+        self._refill(time.monotonic())
+        if self._in_flight < self.max_concurrency and self._tokens >= 1:
+            self._tokens -= 1
+            self._in_flight += 1
+            UPSTREAM_IN_FLIGHT.set(self._in_flight, provider=self.provider)
+            return None
+        return max((1 - self._tokens) / self.rate, 0.0)
+
+    def _enqueue(self, max_wait: float) -> None:
+        """Register a waiter or shed the call. Caller holds the lock."""
+        if self._waiting >= self.max_queue:
+            UPSTREAM_SHED.inc(provider=self.provider, reason="queue_full")
+            raise Overloaded(self.provider, self._retry_after())
+        # Every waiter ahead needs a token and a slot too; don't queue a call that can't make it in time.
+        if self._expected_wait() > max_wait:
+            UPSTREAM_SHED.inc(provider=self.provider, reason="deadline")
+            raise Overloaded(self.provider, self._retry_after())
+        self._waiting += 1
+        UPSTREAM_QUEUED.set(self._waiting, provider=self.provider)
+
+    def _dequeue(self) -> None:
+        self._waiting -= 1
+        UPSTREAM_QUEUED.set(self._waiting, provider=self.provider)
+
+    def _expected_wait(self) -> float:
+        """Seconds until a call joining the queue now would be admitted. Caller holds the lock."""
+        position = self._waiting + 1
+        for_tokens = (position - self._tokens) / self.rate
+        # Slots that must free up first; the running calls finish at max_concurrency per hold time
+        for_slots = 0.0
+        busy = position - (self.max_concurrency - self._in_flight)
+        if busy > 0 and self._hold_seconds is not None:
+            for_slots = busy * self._hold_seconds / self.max_concurrency
+        return max(for_tokens, for_slots)
+
+    def _retry_after(self) -> float:
+        return max(1.0, self._expected_wait())
+
+    def _timed_out(self) -> Overloaded:
+        UPSTREAM_SHED.inc(provider=self.provider, reason="deadline")
+        return Overloaded(self.provider, self._retry_after())
+
+    def _release(self, held_since: float) -> None:
+        with self._condition:
+            held = time.monotonic() - held_since
+            self._hold_seconds = (held if self._hold_seconds is None
+                                  else self._hold_seconds + _HOLD_SMOOTHING * (held - self._hold_seconds))
+            self._in_flight -= 1
+            UPSTREAM_IN_FLIGHT.set(self._in_flight, provider=self.provider)
+            self._condition.notify()
+
+    @contextmanager
+    def admit(self, max_wait: Optional[float] = None) -> Iterator[None]:
+        """Hold a slot for the duration of a blocking upstream call.
+
+        Raises:
+            Overloaded: The call could not be admitted within max_wait seconds.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        with self._condition:
+            wait = self._try_acquire()
+            if wait is not None:
+                self._enqueue(max_wait)
+                try:
+                    while wait is not None:
+                        remaining = start + max_wait - time.monotonic()
+                        if remaining <= 0:
+                            raise self._timed_out()
+                        self._condition.wait(min(wait or remaining, remaining))
+                        wait = self._try_acquire()
+                finally:
+                    self._dequeue()
+        admitted = time.monotonic()
+        UPSTREAM_QUEUE_SECONDS.observe(admitted - start, provider=self.provider)
+        try:
+            yield
+        finally:
+            self._release(admitted)
+
+    @asynccontextmanager
+    async def try_admit_async(self) -> AsyncIterator[bool]:
+        """Hold a slot only if one is free right now, yielding whether it was.
+
+        Never waits, and a call that is not admitted is not counted as shed:
+        for optional requests such as hedges.
+        """
+        with self._condition:
+            admitted = self._try_acquire() is None
+        if not admitted:
+            yield False
+            return
+        admitted_at = time.monotonic()
+        try:
+            yield True
+        finally:
+            self._release(admitted_at)
+
+    @asynccontextmanager
+    async def admit_async(self, max_wait: Optional[float] = None) -> AsyncIterator[None]:
+        """Async version of admit(), waiting without blocking the event loop."""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        with self._condition:
+            wait = self._try_acquire()
+            if wait is not None:
+                self._enqueue(max_wait)
+        if wait is not None:
+            try:
+                while wait is not None:
+                    remaining = start + max_wait - time.monotonic()
+                    if remaining <= 0:
+                        with self._condition:
+                            raise self._timed_out()
+                    await asyncio.sleep(min(wait or _ASYNC_POLL_SECONDS, _ASYNC_POLL_SECONDS, remaining))
+                    with self._condition:
+                        wait = self._try_acquire()
+            finally:
+                with self._condition:
+                    self._dequeue()
+        admitted = time.monotonic()
+        UPSTREAM_QUEUE_SECONDS.observe(admitted - start, provider=self.provider)
+        try:
+            yield
+        finally:
+            self._release(admitted)
+
+
+def _from_env(provider: str, rate: float, burst: int, max_concurrency: int,
+              max_queue: int, max_wait: float) -> AdmissionController:
+    prefix = provider.upper()
+    return AdmissionController(
+        provider,
+        rate=float(os.getenv(f'{prefix}_RATE_PER_SECOND', rate)),
+        burst=int(os.getenv(f'{prefix}_BURST', burst)),
+        max_concurrency=int(os.getenv(f'{prefix}_MAX_CONCURRENCY', max_concurrency)),
+        max_queue=int(os.getenv(f'{prefix}_MAX_QUEUE', max_queue)),
+        max_wait=float(os.getenv(f'{prefix}_MAX_WAIT_SECONDS', max_wait)),
+    )
+
+
+# Defaults stay under the entry-level tiers: ~500 RPM for OpenAI, a few
+# concurrent requests for ElevenLabs, 60 calls/minute for OpenWeather.
+OPENAI = _from_env("openai", rate=8, burst=16, max_concurrency=16, max_queue=64, max_wait=10)
+ELEVENLABS = _from_env("elevenlabs", rate=2, burst=4, max_concurrency=3, max_queue=32, max_wait=15)
+OPENWEATHER = _from_env("openweather", rate=1, burst=10, max_concurrency=4, max_queue=32, max_wait=5)
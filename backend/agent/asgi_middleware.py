@@ -0,0 +1,209 @@
+"""
+ASGI middleware wrapped around the Flask app in app.py.
+
+- `StaticResponses` answers fixed endpoints (/api/health, /api/info) from
+  bytes and headers built once at startup, with an ETag and 304s, without
+  a trip through the WSGI thread pool.
+- `CompressionMiddleware` compresses text and JSON responses of at least
+  COMPRESS_MIN_BYTES with brotli (if the `brotli` package is installed) or
+  gzip, whichever the client accepts. Streamed bodies are compressed chunk
+  by chunk and flushed, so they keep streaming.
+"""
+
+import hashlib
+import json
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+from .metrics import REGISTRY
+
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 500))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+# Brotli quality 4-5 compresses better than gzip -6 at a similar CPU cost; 11 is for static assets
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 4))
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/javascript",
+                      "image/svg+xml", "text/")
+
+COMPRESSED_BYTES = REGISTRY.counter(
+    "daybyday_http_compressed_bytes_total",
+    "Response body bytes before (identity) and after compression, by encoding.",
+    labelnames=("encoding", "stage"),
+)
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+def _header(headers: Headers, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """Best encoding we support from an Accept-Encoding header, None for identity."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if final else self._brotli.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        """
+        Args:
+            app: The ASGI app to wrap.
+            minimum_size (int): Smaller bodies are sent uncompressed.
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = _header(scope.get("headers", []), b"accept-encoding")
+        encoding = _accepted_encoding(accept.decode("latin-1")) if accept else None
+        if encoding is None or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        buffered: List[bytes] = []
+        size = 0
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(body: bytes, more_body: bool):
+            data = compressor.compress(body, final=not more_body)
+            COMPRESSED_BYTES.inc(len(body), encoding=encoding, stage="identity")
+            COMPRESSED_BYTES.inc(len(data), encoding=encoding, stage="compressed")
+            if data or not more_body:
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        async def wrapped_send(message):
+            nonlocal start, size, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type = (_header(headers, b"content-type") or b"").decode("latin-1")
+                passthrough = (message["status"] != 200
+                               or _header(headers, b"content-encoding") is not None
+                               or not content_type.startswith(COMPRESSIBLE_TYPES))
+                if passthrough:
+                    await send(message)
+                else:
+                    start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                await send_compressed(body, more_body)
+                return
+            buffered.append(body)
+            size += len(body)
+            if size < self.minimum_size:
+                if not more_body:
+                    # Too small to be worth it
+                    await send(start)
+                    await send({"type": "http.response.body", "body": b"".join(buffered), "more_body": False})
+                return
+            compressor = _Compressor(encoding)
+            await send({**start, "headers": self._compressed_headers(start.get("headers", []), encoding)})
+            await send_compressed(b"".join(buffered), more_body)
+            buffered.clear()
+
+        await self.app(scope, receive, wrapped_send)
+
+    @staticmethod
+    def _compressed_headers(headers: Headers, encoding: str) -> Headers:
+        result = []
+        vary = None
+        for key, value in headers:
+            name = key.lower()
+            if name == b"content-length":
+                continue
+            if name == b"vary":
+                vary = value
+                continue
+            if name == b"etag" and not value.startswith(b"W/"):
+                # The compressed bytes differ from the identity ones, so the validator becomes weak
+                value = b"W/" + value
+            result.append((key, value))
+        result.append((b"content-encoding", encoding.encode()))
+        result.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+        return result
+
+
+class StaticResponses:
+    def __init__(self, app, routes: Dict[str, Dict], headers: Iterable[Tuple[str, str]] = (),
+                 max_age: int = 60):
+        """
+        Args:
+            app: The ASGI app to wrap.
+            routes (dict): Path -> JSON payload answered for GET and HEAD.
+            headers (iterable): Extra (name, value) headers, e.g. the CORS ones Flask would add.
+            max_age (int): Cache-Control max-age in seconds.
+        """
+        self.app = app
+        self._responses = {}
+        for path, payload in routes.items():
+            body = json.dumps(payload).encode("utf-8")
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            response_headers = [
+                (b"content-type", b"application/json"),
+                (b"etag", etag.encode()),
+                (b"cache-control", f"public, max-age={max_age}".encode()),
+            ] + [(name.lower().encode(), value.encode()) for name, value in headers]
+            self._responses[path] = (body, etag, response_headers)
+
+    async def __call__(self, scope, receive, send):
+        found = self._responses.get(scope.get("path")) if scope["type"] == "http" else None
+        if found is None or scope.get("method") not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        body, etag, headers = found
+        if_none_match = _header(scope.get("headers", []), b"if-none-match")
+        if if_none_match and (if_none_match.strip() == b"*" or etag.encode() in
+                              [tag.strip().removeprefix(b"W/") for tag in if_none_match.split(b",")]):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": headers + [(b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
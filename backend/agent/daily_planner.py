@@ -1,16 +1,33 @@
 from typing import Dict, List
-from openai import AsyncOpenAI
 
 from datetime import datetime
+import asyncio
 import os
-from dotenv import load_dotenv
-from .tools.weather import get_weather
+from .tools.weather import CITY_LOCATION, get_weather
 from .tools.calendar_integration import get_today_events
-latitude = 51.2194  # Example latitude for Antwerp
-longitude = 4.4025  # Example longitude for Antwerp
-
-load_dotenv()
-
+from .metrics import timed
+from .admission import OPENAI, Overloaded
+from .llm_policy import CallPolicy
+from . import model_router
+from .singleflight import SingleFlight, fingerprint
+
+DAILY_PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        period: {"type": "array", "items": {"type": "string"}}
+        for period in ("Morning", "Afternoon", "Evening")
+    },
+    "required": ["Morning", "Afternoon", "Evening"],
+}
+# The daily plan is the longest completion, give it more time than the activity calls.
+DAILY_PLAN_POLICY = CallPolicy("daily_plan_llm", DAILY_PLAN_SCHEMA,
+                               deadline=float(os.getenv('DAILY_PLAN_DEADLINE_SECONDS', 45)),
+                               limiter=OPENAI, route=model_router.DAILY_PLAN)
+# The details are free-form, any JSON object will do
+ACTIVITY_DETAILS_POLICY = CallPolicy("activity_details_llm", {"type": "object"},
+                                     limiter=OPENAI, route=model_router.ACTIVITY_DETAILS)
+# Concurrent requests with the same preferences share one plan generation
+DAILY_PLAN_FLIGHT = SingleFlight("daily_planner")
 
 AGENT_PROMPT = """
 You are an AI assistant specialized in creating personalized daily activity recommendations 
@@ -82,13 +99,25 @@ class AntyAIPlanner:
             raise ValueError("OpenAI API key not found in environment variables")
 
 
+        from openai import AsyncOpenAI  # deferred, importing openai takes about a second
+
         self.system_prompt = AGENT_PROMPT
         self.aclient = AsyncOpenAI(api_key=self.api_key)
-        self.weather = get_weather(latitude, longitude)
         self.events = get_today_events()
 
-    async def generate_recommendations(self, user_preferences: Dict) -> List[Dict]:
-        """Generate personalized recommendations based on user preferences."""
+    async def generate_recommendations(self, user_preferences: Dict) -> Dict:
+        """Generate personalized recommendations based on user preferences.
+        
+        Returns:
+            dict: The Morning/Afternoon/Evening plan, or an empty "recommendations"
+            list and the error if no valid plan came back in time.
+        """
+        return await DAILY_PLAN_FLIGHT.do_async(
+            fingerprint(user_preferences), self._generate_recommendations, user_preferences
+        )
+
+    async def _generate_recommendations(self, user_preferences: Dict) -> Dict:
+        weather = await asyncio.to_thread(get_weather, *CITY_LOCATION)
         
         # Format the schedule times for better readability
         schedule = user_preferences['schedule']
@@ -108,7 +137,7 @@ class AntyAIPlanner:
         Interests: {', '.join(user_preferences['interests'])}
         Preferred activity time: {user_preferences['preferredStartTime']} - {user_preferences['preferredEndTime']}
         Activity pace preference: {user_preferences['pace']}
-        Weather: {self.weather}
+        Weather: {weather}
         Events from the user's calendar: {self.events}
         # [OUTPUT FORMAT]
         You MUST return the following JSON format:
@@ -131,50 +160,61 @@ class AntyAIPlanner:
         }}
         """
 
+        model, max_tokens = model_router.DAILY_PLAN.choose()
         try:
-            response = await self.aclient.chat.completions.create(
-                model="gpt-4-1106-preview",
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000,
-                response_format={ "type": "json_object" }
-            )
-            
-            return response.choices[0].message.content
+            with timed("daily_plan_llm"):
+                return await DAILY_PLAN_POLICY.run(
+                    lambda messages: self.aclient.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=max_tokens,
+                        response_format={ "type": "json_object" }
+                    ),
+                    [
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    model=model
+                )
             
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Error generating recommendations: {e}")
-            return {"recommendations": []}
+            return {"recommendations": [], "error": str(e)}
 
     async def get_activity_details(self, activity_name: str) -> Dict:
-        """Get detailed information about a specific activity."""
+        """Get detailed information about a specific activity, {} if none could be generated."""
+        model, max_tokens = model_router.ACTIVITY_DETAILS.choose()
         try:
-            response = await self.aclient.chat.completions.create(
-                model="gpt-4-1106-preview",
-                messages=[
-                    {"role": "system", "content": "You are a knowledgeable guide about activities and locations in Antwerp."},
-                    {"role": "user", "content": f"Provide detailed information about {activity_name} in Antwerp, including:\n"
-                                              "1. Historical significance\n"
-                                              "2. What to expect\n"
-                                              "3. Tips for students\n"
-                                              "4. Nearby attractions\n"
-                                              "Format the response as a JSON object."}
-                ],
-                temperature=0.7,
-                max_tokens=500,
-                response_format={ "type": "json_object" }
-            )
-
-            return response.choices[0].message.content
-
+            with timed("activity_details_llm"):
+                return await ACTIVITY_DETAILS_POLICY.run(
+                    lambda messages: self.aclient.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=max_tokens,
+                        response_format={ "type": "json_object" }
+                    ),
+                    [
+                        {"role": "system", "content": "You are a knowledgeable guide about activities and locations in Antwerp."},
+                        {"role": "user", "content": f"Provide detailed information about {activity_name} in Antwerp, including:\n"
+                                                  "1. Historical significance\n"
+                                                  "2. What to expect\n"
+                                                  "3. Tips for students\n"
+                                                  "4. Nearby attractions\n"
+                                                  "Format the response as a JSON object."}
+                    ],
+                    model=model
+                )
+
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Error getting activity details: {e}")
             return {}
 
-
 if __name__ == "__main__":
     import asyncio
 
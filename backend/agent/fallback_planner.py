@@ -0,0 +1,223 @@
+"""
+Rule-based planner served when the LLM planners are slow or down.
+
+`RuleBasedPlanner` builds the same Morning/Afternoon/Evening daily plan and
+per-activity plan the LLM planners return, without any network call:
+
+- every day gets breakfast, lunch at the user's break and dinner;
+- each period gets a number of interest activities set by the pace, fewer
+  when work leaves little free time in it or it lies outside the preferred
+  activity window;
+- activities are drawn round-robin from the user's interests, and only if
+  the POI index has a place of their category within FALLBACK_RADIUS_M
+  (outdoor ones are skipped when it rains);
+- an activity plan goes to the nearest matching place, ranked the same way
+  as for the LLM planner (visited places, place filter, walking time).
+
+The output only depends on the preferences, the location, the weather and
+the datasets, so the same user gets the same plan again.
+"""
+
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .itinerary import activity_category
+from .metrics import REGISTRY, timed
+from .sessions import PERIODS
+from .tools.geosorting import DEFAULT_LOCATION, main
+from .tools.places import get_place_index
+
+# Only offer an activity if a place of its category is this close
+FALLBACK_RADIUS_M = float(os.getenv('FALLBACK_RADIUS_M', 2000))
+
+# Hours of the day the plan's periods cover
+PERIOD_HOURS = {"Morning": ("07:00", "12:00"), "Afternoon": ("12:00", "18:00"), "Evening": ("18:00", "23:00")}
+# Interest activities per free period
+PACE_SLOTS = {"relaxed": 1, "moderate": 2, "active": 3}
+# Free minutes a period needs for all of its pace slots, and for a single one
+FULL_PERIOD_MINUTES = 180
+MIN_FREE_MINUTES = 45
+# A break shorter than this gets a snack instead of a sit-down lunch
+MIN_LUNCH_MINUTES = 45
+DEFAULT_INTERESTS = ["food", "culture"]
+
+# (category or None if it needs no place, description, periods, outdoor);
+# descriptions name the category's keyword so itinerary.activity_category maps them back
+INTEREST_ACTIVITIES = {
+    "culture": [
+        ("arts_centre", "Visit a museum or gallery", ("Morning", "Afternoon"), False),
+        ("books", "Browse a book shop", ("Morning", "Afternoon"), False),
+        ("theatre", "See a show at the theatre", ("Evening",), False),
+    ],
+    "food": [
+        ("bakery", "Pick up something sweet at a bakery", ("Morning",), False),
+        ("chocolate", "Taste Belgian chocolate", ("Afternoon",), False),
+        ("ice_cream", "Grab an ice cream", ("Afternoon",), True),
+        ("wine_bar", "Share a glass of wine", ("Evening",), False),
+    ],
+    "nature": [
+        (None, "Walk along the Scheldt quays", ("Morning", "Afternoon"), True),
+        (None, "Relax in the Stadspark", ("Afternoon",), True),
+        (None, "Watch the sunset from the MAS rooftop", ("Evening",), True),
+    ],
+    "shopping": [
+        ("clothes", "Go shopping for clothes", ("Morning", "Afternoon"), False),
+        ("gift", "Look for a gift or souvenir", ("Afternoon",), False),
+        ("shoes", "Find a new pair of shoes", ("Afternoon",), False),
+    ],
+    "entertainment": [
+        ("cinema", "Watch a movie at the cinema", ("Afternoon", "Evening"), False),
+        ("events_venue", "Catch a concert", ("Evening",), False),
+        ("bar", "Have a drink at a bar", ("Evening",), False),
+    ],
+}
+
+FALLBACK_PLANS = REGISTRY.counter(
+    "daybyday_fallback_plans_total",
+    "Plans served by the rule-based planner instead of the LLM, by task type and reason.",
+    labelnames=("task_type", "reason"),
+)
+
+
+def _minutes(value: str) -> int:
+    moment = datetime.strptime(value, '%H:%M')
+    return moment.hour * 60 + moment.minute
+
+
+def _overlap(a: Tuple[int, int], b: Tuple[int, int]) -> int:
+    return max(0, min(a[1], b[1]) - max(a[0], b[0]))
+
+
+class RuleBasedPlanner:
+    def _available(self, category: Optional[str], location: Tuple[float, float]) -> bool:
+        if category is None:
+            return True
+        try:
+            places, _ = get_place_index().search(location, categories=[category],
+                                                 radius_m=FALLBACK_RADIUS_M, limit=1)
+        except ValueError:  # no dataset for the category
+            return False
+        return bool(places)
+
+    def _free_minutes(self, period: str, schedule: Dict) -> int:
+        window = tuple(_minutes(value) for value in PERIOD_HOURS[period])
+        try:
+            work = (_minutes(schedule['workStartTime']), _minutes(schedule['workEndTime']))
+        except (KeyError, TypeError, ValueError):
+            return window[1] - window[0]
+        return window[1] - window[0] - _overlap(window, work)
+
+    def _slots(self, period: str, user_preferences: Dict) -> int:
+        slots = PACE_SLOTS.get(user_preferences.get('pace'), PACE_SLOTS["moderate"])
+        free = self._free_minutes(period, user_preferences.get('schedule') or {})
+        try:
+            preferred = (_minutes(user_preferences['preferredStartTime']),
+                         _minutes(user_preferences['preferredEndTime']))
+            in_preferred = _overlap(tuple(_minutes(v) for v in PERIOD_HOURS[period]), preferred) > 0
+        except (KeyError, TypeError, ValueError):
+            in_preferred = True
+        if free < MIN_FREE_MINUTES:
+            return 0
+        if free < FULL_PERIOD_MINUTES or not in_preferred:
+            return 1
+        return slots
+
+    def _meals(self, schedule: Dict) -> Dict[str, List[str]]:
+        meals = {"Morning": ["Breakfast at a cafe"], "Afternoon": [], "Evening": ["Dinner at a restaurant"]}
+        try:
+            break_time = schedule['breakTime']
+            start = _minutes(break_time)
+            duration = int(schedule.get('breakDuration', 60))
+        except (KeyError, TypeError, ValueError):
+            meals["Afternoon"].append("Lunch at a restaurant")
+            return meals
+        lunch = (f"Lunch at a restaurant at {break_time}" if duration >= MIN_LUNCH_MINUTES
+                 else f"Grab a snack at {break_time}")
+        for period in PERIODS:
+            first, last = (_minutes(value) for value in PERIOD_HOURS[period])
+            if first <= start < last:
+                meals[period].append(lunch)
+                break
+        return meals
+
+    def daily_plan(self, user_preferences: Dict, user_location: Optional[Tuple[float, float]] = None,
+                   weather_category: Optional[str] = None) -> Dict[str, List[str]]:
+        """A Morning/Afternoon/Evening plan in the daily planner's format.
+
+        Args:
+            user_preferences (dict): The user's preferences; missing fields get defaults.
+            user_location (tuple, optional): (lat, lon) the places must be near, Groenplaats by default.
+            weather_category (str, optional): sunny/raining/cloudy; outdoor activities
+                are left out when it rains.
+
+        Returns:
+            dict: Activity descriptions per period.
+        """
+        with timed("fallback_daily_plan"):
+            location = tuple(user_location) if user_location else DEFAULT_LOCATION
+            interests = [i for i in user_preferences.get('interests') or [] if i in INTEREST_ACTIVITIES]
+            options = [INTEREST_ACTIVITIES[i] for i in interests or DEFAULT_INTERESTS]
+            plan = self._meals(user_preferences.get('schedule') or {})
+            used = set()
+            turn = 0
+            for period in PERIODS:
+                for _ in range(self._slots(period, user_preferences)):
+                    # Next interest in turn that still has an activity for this period
+                    for step in range(len(options)):
+                        activity = next((
+                            description for category, description, periods, outdoor in options[(turn + step) % len(options)]
+                            if period in periods and description not in used
+                            and not (outdoor and weather_category == 'raining')
+                            and self._available(category, location)
+                        ), None)
+                        if activity is not None:
+                            used.add(activity)
+                            plan[period].append(activity)
+                            turn += step + 1
+                            break
+            return plan
+
+    def activity_plan(self, activity_description: str, visited=None,
+                      user_location: Optional[Tuple[float, float]] = None,
+                      place_filter: Optional[str] = None, weather_category: Optional[str] = None) -> Dict:
+        """A plan for one activity in the activity planner's format, at the nearest matching place.
+
+        Args:
+            activity_description (str): The activity from the daily plan.
+            visited (VisitedIndex, optional): Recently visited places are ranked lower.
+            user_location (tuple, optional): (lat, lon) places are ranked from.
+            place_filter (str, optional): Tag filter expression the place must match.
+            weather_category (str, optional): sunny/raining/cloudy, for the filter's
+                weather conditions and the rainy-day rule.
+
+        Returns:
+            dict: {"result": plan, "status": "success"}; the plan has no location_id
+            when the activity needs no place or none matches.
+        """
+        with timed("fallback_activity_plan"):
+            category = activity_category(activity_description)
+            places = []
+            if category is not None:
+                places = main(category, visited=visited, user_location=user_location, limit=1,
+                              place_filter=place_filter, weather_category=weather_category)
+            speech = f"Anty here! Next up: {activity_description[0].lower()}{activity_description[1:]}."
+            result = {
+                "activity_name": activity_description,
+                "activity_description": activity_description,
+                "text_to_speech": speech,
+                "location_id": "",
+                "category": category,
+            }
+            if places:
+                place = places[0]
+                if 'walking_minutes' in place:
+                    away = f"about {round(place['walking_minutes'])} minutes on foot"
+                elif place['distance_km'] < 1:
+                    away = f"{round(place['distance_km'] * 1000)} m away"
+                else:
+                    away = f"{place['distance_km']:.1f} km away"
+                result["activity_description"] = f"{activity_description} at {place['name']}"
+                result["text_to_speech"] = f"{speech} I picked {place['name']}, {away}."
+                result["location_id"] = str(place['id'])
+            return {"result": result, "status": "success"}
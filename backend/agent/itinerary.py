@@ -0,0 +1,222 @@
+"""
+Multi-stop itinerary optimizer for a full daily plan.
+
+Every activity of the day that needs a place is mapped to a POI category,
+gets a handful of candidate places near where the previous activity may
+have been (the start for the first one), and one place per activity is
+chosen so that the total travel along the day (Morning -> Afternoon ->
+Evening, in plan order) is minimal. Candidates are filtered like the
+single-activity ranking: by the place filter and weather, and with recently
+visited places dropped or pushed down. Travel times between consecutive
+candidate sets come from a precomputed matrix (walking graph if built,
+straight line with a detour factor otherwise) and the choice is made
+exactly with dynamic programming over the ordered stops.
+"""
+
+import json
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .metrics import timed
+from .sessions import PERIODS
+from .tools.geosorting import DEFAULT_LOCATION, filter_visited, place_mask, rank_places
+from .tools.geo import haversine_m
+from .tools.walking_graph import WALKING_SPEED_M_PER_MIN, get_walking_graph
+
+DEFAULT_START = DEFAULT_LOCATION
+
+CANDIDATES_PER_STOP = 8
+# Streets are not straight; scale crow-flies distance when there is no walking graph.
+DETOUR_FACTOR = 1.3
+
+PERIOD_START = {"Morning": "09:00", "Afternoon": "13:00", "Evening": "18:00"}
+ACTIVITY_MINUTES = {"relaxed": 90, "moderate": 60, "active": 45}
+
+# Whole words (plurals allowed); the first matching entry wins, so more specific words come first.
+CATEGORY_KEYWORDS = [
+    (("ice cream", "gelato"), "ice_cream"),
+    (("wine",), "wine_bar"),
+    (("beer garden", "biergarten"), "biergarten"),
+    (("pub",), "pub"),
+    (("bar", "drink", "drinking", "beer", "cocktail"), "bar"),
+    (("breakfast", "coffee", "cafe", "café", "brunch"), "cafe"),
+    (("bakery", "pastry", "bread"), "bakery"),
+    (("chocolate",), "chocolate"),
+    (("tea",), "tea"),
+    (("lunch", "dinner", "eat", "restaurant", "food"), "restaurant"),
+    (("snack", "fries", "burger", "fast food"), "fast_food"),
+    (("coworking", "cowork"), "coworking_space"),
+    (("study", "studying", "library", "read", "reading"), "library"),
+    (("movie", "cinema", "film"), "cinema"),
+    (("theatre", "theater", "play", "show"), "theatre"),
+    (("concert", "event", "gig"), "events_venue"),
+    (("museum", "art", "gallery", "exhibition", "culture"), "arts_centre"),
+    (("book",), "books"),
+    (("shoe",), "shoes"),
+    (("gift", "souvenir"), "gift"),
+    (("shopping", "clothes", "fashion"), "clothes"),
+    (("grocery", "groceries", "supermarket"), "supermarket"),
+]
+
+
+def activity_category(activity: str) -> Optional[str]:
+    """POI category for an activity description, or None if it needs no place (gym, class, ...)."""
+    text = activity.lower()
+    for keywords, category in CATEGORY_KEYWORDS:
+        if any(re.search(r'\b' + re.escape(keyword) + r'(s|es)?\b', text) for keyword in keywords):
+            return category
+    return None
+
+
+def _place(loc: Dict) -> Dict:
+    try:
+        name = json.loads(loc.get('tags', '{}')).get('name', "Unnamed Location")
+    except Exception:
+        name = "Unnamed Location"
+    return {'id': loc.get('id'), 'name': name, 'lat': loc['lat'], 'lon': loc['lon']}
+
+
+def _candidates(category: str, anchors: Sequence[Tuple[float, float]], count: int,
+                mask: Optional[np.ndarray] = None, visited=None) -> List[Dict]:
+    """Up to `count` places of the category near any of the anchors.
+
+    Taken round-robin from the anchors' own nearest-first lists, so every
+    anchor keeps its closest places, however the others are spread out.
+    """
+    fetch = count
+    if visited is not None:
+        # Leave room for the visited places filter_visited may drop.
+        fetch += len(visited.location_weights())
+    rankings = []
+    for anchor in anchors:
+        ranked = rank_places(category, anchor, limit=fetch, mask=mask)
+        if visited is not None:
+            ranked = filter_visited(ranked, visited)
+        rankings.append(ranked)
+    chosen = {}
+    for rank in range(fetch):
+        for ranked in rankings:
+            if len(chosen) == count:
+                return list(chosen.values())
+            if rank < len(ranked):
+                chosen.setdefault(ranked[rank].get('id'), ranked[rank])
+    return list(chosen.values())
+
+
+def travel_matrix(origins: Sequence[Tuple[float, float]], destinations: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """Walking minutes from every origin to every destination."""
+    graph = get_walking_graph()
+    if graph is not None:
+        rows = []
+        for origin in origins:
+            rows.append(graph.walking_minutes(origin, destinations))
+    o = np.asarray(origins, dtype=float)
+    d = np.asarray(destinations, dtype=float)
+    metres = haversine_m(o[:, None, 0], o[:, None, 1], d[None, :, 0], d[None, :, 1])
+    estimate = metres * DETOUR_FACTOR / WALKING_SPEED_M_PER_MIN
+    if graph is not None:
+        # Off-network or too far for the graph search: fall back to the estimate.
+        walked = np.array([[np.nan if m is None else m for m in row] for row in rows], dtype=float)
+        return np.where(np.isnan(walked), estimate, walked)
+    return estimate
+
+
+def optimize_itinerary(daily_plan: Dict[str, List[str]], start: Tuple[float, float] = DEFAULT_START,
+                       pace: str = "moderate", date: Optional[datetime] = None,
+                       candidates_per_stop: int = CANDIDATES_PER_STOP, visited=None,
+                       place_filter: Optional[str] = None, weather_category: Optional[str] = None) -> Dict:
+    """Choose one place per activity minimising total travel over the day.
+
+    Args:
+        daily_plan (dict): Morning/Afternoon/Evening lists of activity descriptions.
+        start (tuple): (lat, lon) where the day starts.
+        pace (str): relaxed/moderate/active, sets the time spent per activity.
+        date (datetime, optional): Day the times are computed for, defaults to today.
+        candidates_per_stop (int): Places considered for each activity.
+        visited (VisitedIndex, optional): Recently visited places are left out or ranked lower.
+        place_filter (str, optional): Tag filter expression the places must match.
+        weather_category (str, optional): sunny/raining/cloudy, for the filter's
+            weather conditions and the rainy-day rule.
+
+    Returns:
+        dict: The ordered route (one entry per activity, with place and times when it
+        has one) and the total travel minutes.
+
+    Raises:
+        ValueError: If the filter expression is invalid.
+    """
+    with timed("itinerary_optimize"):
+        stops = []
+        for period in PERIODS:
+            for activity in daily_plan.get(period, []):
+                stops.append({'period': period, 'activity': activity, 'category': activity_category(activity)})
+
+        # Candidate sets per stop that needs a place, each drawn around the previous set
+        layers = []
+        anchors = [start]
+        for stop in stops:
+            if stop['category'] is None:
+                continue
+            try:
+                mask = place_mask(stop['category'], place_filter, weather_category)
+                locations = _candidates(stop['category'], anchors, candidates_per_stop, mask, visited)
+            except FileNotFoundError:
+                stop['category'] = None
+                continue
+            if locations:
+                candidates = [_place(loc) for loc in locations]
+                layers.append((stop, candidates))
+                anchors = [(c['lat'], c['lon']) for c in candidates]
+
+        # Viterbi over the ordered stops: cost[j] = best total minutes ending at candidate j
+        choice = []
+        if layers:
+            points = [(c['lat'], c['lon']) for c in layers[0][1]]
+            cost = travel_matrix([start], points)[0]
+            legs = [cost]
+            back = []
+            for _, candidates in layers[1:]:
+                next_points = [(c['lat'], c['lon']) for c in candidates]
+                matrix = travel_matrix(points, next_points)
+                total = cost[:, None] + matrix
+                back.append(np.argmin(total, axis=0))
+                legs.append(matrix)
+                cost = total.min(axis=0)
+                points = next_points
+            j = int(np.argmin(cost))
+            choice = [j]
+            for pointers in reversed(back):
+                j = int(pointers[j])
+                choice.append(j)
+            choice.reverse()
+
+        # Times along the route
+        day = (date or datetime.now()).replace(second=0, microsecond=0)
+        duration = timedelta(minutes=ACTIVITY_MINUTES.get(pace, ACTIVITY_MINUTES["moderate"]))
+        clock = None
+        total_travel = 0.0
+        placed = {id(stop): (i, candidates) for i, (stop, candidates) in enumerate(layers)}
+        previous = None
+        route = []
+        for stop in stops:
+            period_start = datetime.combine(day.date(), datetime.strptime(PERIOD_START[stop['period']], '%H:%M').time())
+            clock = max(clock or period_start, period_start)
+            entry = {'period': stop['period'], 'activity': stop['activity'], 'category': stop['category'], 'place': None}
+            if id(stop) in placed:
+                i, candidates = placed[id(stop)]
+                j = choice[i]
+                travel = float(legs[i][j] if i == 0 else legs[i][previous, j])
+                total_travel += travel
+                clock += timedelta(minutes=travel)
+                entry['place'] = candidates[j]
+                entry['travel_minutes'] = round(travel, 1)
+                previous = j
+            entry['arrive'] = clock.strftime('%H:%M')
+            clock += duration
+            entry['depart'] = clock.strftime('%H:%M')
+            route.append(entry)
+
+        return {'route': route, 'total_travel_minutes': round(total_travel, 1)}
@@ -0,0 +1,328 @@
+"""
+Call policy for the planner agents' LLM completions.
+
+Every completion made through a `CallPolicy` gets:
+- a deadline, after which the call fails instead of stalling the request;
+- a hedged duplicate request once the first one has been running longer than
+  the recent p95 latency of its stage, the first valid answer wins and the
+  other request is cancelled;
+- strict validation of the JSON answer against a schema, with a bounded
+  number of repair requests that show the model its invalid answer;
+- latency quantiles, hedge and outcome counters in /api/metrics;
+- with a `ModelRoute`, every request's latency and validity reported to the
+  task's route, which picks the model (see model_router).
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from .admission import AdmissionController
+from .metrics import REGISTRY
+
+if TYPE_CHECKING:
+    # model_router imports quantile from here
+    from .model_router import ModelRoute
+
+logger = logging.getLogger(__name__)
+
+LLM_DEADLINE_SECONDS = float(os.getenv('LLM_DEADLINE_SECONDS', 30))
+# Hedge after this quantile of the stage's recent attempt latencies...
+HEDGE_QUANTILE = 0.95
+# ...but never sooner than this, and use the default until enough attempts were seen.
+MIN_HEDGE_DELAY_SECONDS = 1.0
+DEFAULT_HEDGE_DELAY_SECONDS = float(os.getenv('LLM_HEDGE_DELAY_SECONDS', 8))
+MIN_LATENCY_SAMPLES = 20
+LATENCY_WINDOW = 200
+# Extra requests per call: hedges, and repairs after an invalid answer.
+MAX_HEDGES = int(os.getenv('LLM_MAX_HEDGES', 1))
+MAX_REPAIRS = 1
+
+REPAIR_PROMPT = (
+    "Your previous answer was not valid: {error}. "
+    "Answer again with only the JSON object, following the required format exactly."
+)
+
+LLM_ATTEMPT_SECONDS = REGISTRY.histogram(
+    "daybyday_llm_attempt_duration_seconds",
+    "Time of every completed LLM request, including hedges and repairs.",
+    labelnames=("stage",),
+)
+LLM_LATENCY_QUANTILES = REGISTRY.gauge(
+    "daybyday_llm_latency_seconds",
+    "Recent LLM request latency quantiles per stage.",
+    labelnames=("stage", "quantile"),
+)
+LLM_HEDGES = REGISTRY.counter(
+    "daybyday_llm_hedged_requests_total",
+    "Duplicate LLM requests sent because the first one was slow.",
+    labelnames=("stage",),
+)
+LLM_HEDGES_SKIPPED = REGISTRY.counter(
+    "daybyday_llm_hedges_skipped_total",
+    "Hedges not sent because the provider had no free slot.",
+    labelnames=("stage",),
+)
+LLM_OUTCOMES = REGISTRY.counter(
+    "daybyday_llm_calls_total",
+    "LLM calls by outcome: ok, hedge_won, repaired, invalid, timeout or error.",
+    labelnames=("stage", "outcome"),
+)
+
+
+class LLMCallError(Exception):
+    """The call produced no valid answer (deadline, upstream error or invalid JSON)."""
+
+
+class HedgeSkipped(LLMCallError):
+    """A hedge was not sent, the provider had no room for it."""
+
+
+class InvalidResponse(LLMCallError):
+    def __init__(self, message: str, content: str):
+        super().__init__(message)
+        self.content = content
+
+
+class LatencyTracker:
+    """Sliding window of recent request latencies per stage."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.setdefault(stage, deque(maxlen=self.window))
+            samples.append(seconds)
+            ordered = sorted(samples)
+        for q in ("0.5", "0.95", "0.99"):
+            LLM_LATENCY_QUANTILES.set(quantile(ordered, float(q)), stage=stage, quantile=q)
+
+    def quantile(self, stage: str, q: float) -> Optional[float]:
+        """The q-quantile of the stage's recent latencies, None until MIN_LATENCY_SAMPLES were seen."""
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None or len(samples) < MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(samples)
+        return quantile(ordered, q)
+
+
+def quantile(ordered: List[float], q: float) -> float:
+    """The q-quantile of sorted, non-empty samples (nearest rank)."""
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+LATENCIES = LatencyTracker()
+
+
+def validate(instance: Any, schema: Dict, path: str = "$") -> None:
+    """Check an instance against the subset of JSON Schema the planners use.
+
+    Supports type (a name or a list of names), enum, properties, required, additionalProperties (false),
+    items and minItems.
+
+    Raises:
+        ValueError: naming the first offending path.
+    """
+    expected = schema.get("type")
+    checks = {
+        "object": lambda v: isinstance(v, dict),
+        "array": lambda v: isinstance(v, list),
+        "string": lambda v: isinstance(v, str),
+        "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+        "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+        "boolean": lambda v: isinstance(v, bool),
+    }
+    types = [expected] if isinstance(expected, str) else expected or []
+    if types and not any(checks[t](instance) for t in types):
+        raise ValueError(f"{path} should be of type {' or '.join(types)}")
+    if "enum" in schema and instance not in schema["enum"]:
+        raise ValueError(f"{path} is not one of the allowed values")
+    if expected == "object":
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in instance:
+                raise ValueError(f"{path} is missing required key '{key}'")
+        for key, value in instance.items():
+            if key in properties:
+                validate(value, properties[key], f"{path}.{key}")
+            elif schema.get("additionalProperties") is False:
+                raise ValueError(f"{path} has unexpected key '{key}'")
+    elif expected == "array":
+        if len(instance) < schema.get("minItems", 0):
+            raise ValueError(f"{path} should have at least {schema['minItems']} items")
+        if "items" in schema:
+            for i, item in enumerate(instance):
+                validate(item, schema["items"], f"{path}[{i}]")
+
+
+def message_content(response) -> str:
+    """Answer text of a JSON-mode completion."""
+    return response.choices[0].message.content or ""
+
+
+def tool_call_arguments(response) -> str:
+    """Arguments of the first tool call of a completion."""
+    tool_calls = response.choices[0].message.tool_calls
+    if not tool_calls:
+        raise ValueError("the answer has no tool call")
+    return tool_calls[0].function.arguments
+
+
+class CallPolicy:
+    def __init__(self, stage: str, schema: Dict, deadline: float = LLM_DEADLINE_SECONDS,
+                 max_hedges: int = MAX_HEDGES, max_repairs: int = MAX_REPAIRS,
+                 extract: Callable[[Any], str] = message_content,
+                 latencies: LatencyTracker = LATENCIES,
+                 limiter: Optional[AdmissionController] = None,
+                 route: Optional['ModelRoute'] = None):
+        """
+        Args:
+            stage (str): Metric label of the calls, e.g. "daily_plan_llm".
+            schema (dict): JSON schema the parsed answer must satisfy.
+            deadline (float): Seconds the whole call (hedges and repairs included) may take.
+            max_hedges (int): Duplicate requests sent when the first one is slow.
+            max_repairs (int): Requests showing the model its invalid answer.
+            extract (callable): Gets the JSON text out of a completion.
+            latencies (LatencyTracker): Source of the hedge delay.
+            limiter (AdmissionController, optional): Admission of every request to the
+                provider. Hedges are only sent if they are admitted without waiting.
+            route (ModelRoute, optional): Model route of the task, told the latency and
+                validity of every request.
+        """
+        self.stage = stage
+        self.schema = schema
+        self.deadline = deadline
+        self.max_hedges = max_hedges
+        self.max_repairs = max_repairs
+        self.extract = extract
+        self.latencies = latencies
+        self.limiter = limiter
+        self.route = route
+
+    def hedge_delay(self) -> float:
+        p95 = self.latencies.quantile(self.stage, HEDGE_QUANTILE)
+        if p95 is None:
+            return DEFAULT_HEDGE_DELAY_SECONDS
+        return max(p95, MIN_HEDGE_DELAY_SECONDS)
+
+    async def run(self, create: Callable[[List[Dict]], Awaitable[Any]], messages: List[Dict],
+                  model: Optional[str] = None) -> Any:
+        """Make the call and return the validated, parsed answer.
+
+        Args:
+            create: Sends one completion request for the given messages.
+            messages: The chat messages of the first request.
+            model: The model create() uses, as chosen by the policy's route.
+
+        Raises:
+            LLMCallError: No valid answer before the deadline.
+        """
+        try:
+            return await asyncio.wait_for(self._run(create, messages, model), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            LLM_OUTCOMES.inc(stage=self.stage, outcome="timeout")
+            self._report(model, self.deadline, "timeout")
+            raise LLMCallError(f"{self.stage}: no valid answer within {self.deadline:g}s") from None
+        except InvalidResponse:
+            LLM_OUTCOMES.inc(stage=self.stage, outcome="invalid")
+            raise
+        except LLMCallError:
+            raise
+        except Exception:
+            LLM_OUTCOMES.inc(stage=self.stage, outcome="error")
+            raise
+
+    async def _run(self, create, messages: List[Dict], model: Optional[str] = None) -> Any:
+        for repair in range(self.max_repairs + 1):
+            try:
+                result, hedge_won = await self._hedged(create, messages, model)
+            except InvalidResponse as e:
+                if repair == self.max_repairs:
+                    raise
+                logger.info("%s: invalid answer (%s), asking for a repair", self.stage, e)
+                messages = messages + [
+                    {"role": "assistant", "content": e.content},
+                    {"role": "user", "content": REPAIR_PROMPT.format(error=e)},
+                ]
+                continue
+            outcome = "repaired" if repair else "hedge_won" if hedge_won else "ok"
+            LLM_OUTCOMES.inc(stage=self.stage, outcome=outcome)
+            return result
+
+    async def _hedged(self, create, messages: List[Dict], model: Optional[str] = None) -> Tuple[Any, bool]:
+        """First valid answer of the request and its hedges, and whether a hedge gave it."""
+        pending = {}
+        errors = []
+        delay = self.hedge_delay()
+        hedge_at = time.monotonic() + delay
+
+        def launch():
+            attempt = len(pending) + len(errors)
+            pending[asyncio.ensure_future(self._attempt(create, messages, model, hedge=attempt > 0))] = attempt
+
+        launch()
+        try:
+            while pending:
+                can_hedge = len(pending) + len(errors) <= self.max_hedges
+                timeout = max(hedge_at - time.monotonic(), 0) if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    hedge_at += delay
+                    continue
+                for task in done:
+                    attempt = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result(), attempt > 0
+                    errors.append(task.exception())
+            # Prefer an invalid answer, which can be repaired, over an upstream error.
+            raise next((e for e in errors if isinstance(e, InvalidResponse)), errors[-1])
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _attempt(self, create, messages: List[Dict], model: Optional[str] = None,
+                       hedge: bool = False) -> Any:
+        if self.limiter is None:
+            admission = contextlib.nullcontext(True)
+        elif hedge:
+            # A hedge is only worth sending if the provider has room for it right now.
+            admission = self.limiter.try_admit_async()
+        else:
+            admission = self.limiter.admit_async()
+        async with admission as admitted:
+            if hedge:
+                if not admitted:
+                    LLM_HEDGES_SKIPPED.inc(stage=self.stage)
+                    raise HedgeSkipped(f"{self.stage}: no free slot for a hedge")
+                LLM_HEDGES.inc(stage=self.stage)
+            start = time.perf_counter()
+            response = await create(messages)
+        elapsed = time.perf_counter() - start
+        LLM_ATTEMPT_SECONDS.observe(elapsed, stage=self.stage)
+        self.latencies.record(self.stage, elapsed)
+
+        content = ""
+        try:
+            content = self.extract(response)
+            parsed = json.loads(content)
+            validate(parsed, self.schema)
+        except ValueError as e:
+            self._report(model, elapsed, "invalid")
+            raise InvalidResponse(str(e), content) from e
+        self._report(model, elapsed, "valid")
+        return parsed
+
+    def _report(self, model: Optional[str], seconds: float, outcome: str) -> None:
+        if self.route is not None and model is not None:
+            self.route.record(model, seconds, outcome)
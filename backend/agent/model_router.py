@@ -0,0 +1,163 @@
+"""
+Per-task model routing for the planner agents' LLM completions.
+
+Each kind of completion has a `ModelRoute`. The kinds are category selection,
+daily plan, activity plan and activity details. A route holds a model tier, a
+max_tokens limit and a latency SLO. For every request it serves, it records
+the latency and whether the answer was valid, per model. When the p95 latency
+of the model in use goes over the SLO, the route degrades to the next faster
+tier, unless that tier's recent valid-answer rate is below MIN_VALID_RATE.
+After ROUTE_RECOVERY_SECONDS it steps back towards the configured tier.
+
+Tiers map to models through LLM_MODEL_QUALITY, LLM_MODEL_BALANCED and
+LLM_MODEL_FAST. Per-task settings are read from the environment, e.g.
+LLM_DAILY_PLAN_TIER, LLM_DAILY_PLAN_MAX_TOKENS and LLM_DAILY_PLAN_SLO_SECONDS.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from .llm_policy import quantile
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Slowest (best) first; degrading moves one step to the right
+TIERS = ("quality", "balanced", "fast")
+MODELS = {
+    "quality": os.getenv('LLM_MODEL_QUALITY', 'gpt-4-1106-preview'),
+    "balanced": os.getenv('LLM_MODEL_BALANCED', 'gpt-4o'),
+    "fast": os.getenv('LLM_MODEL_FAST', 'gpt-4o-mini'),
+}
+ROUTE_RECOVERY_SECONDS = float(os.getenv('LLM_ROUTE_RECOVERY_SECONDS', 600))
+# Don't degrade to a tier that recently answered worse than this
+MIN_VALID_RATE = 0.9
+ROUTE_WINDOW = 100
+MIN_ROUTE_SAMPLES = 20
+
+LLM_ROUTE_REQUESTS = REGISTRY.counter(
+    "daybyday_llm_route_requests_total",
+    "LLM requests per task and model, by outcome: valid, invalid or timeout.",
+    labelnames=("task", "model", "outcome"),
+)
+LLM_ROUTE_P95 = REGISTRY.gauge(
+    "daybyday_llm_route_latency_p95_seconds",
+    "Recent p95 request latency per task and model.",
+    labelnames=("task", "model"),
+)
+LLM_ROUTE_VALID_RATE = REGISTRY.gauge(
+    "daybyday_llm_route_valid_ratio",
+    "Recent share of valid answers per task and model.",
+    labelnames=("task", "model"),
+)
+LLM_ROUTE_TIER = REGISTRY.gauge(
+    "daybyday_llm_route_tier",
+    "Tier each task is routed to: 0 quality, 1 balanced, 2 fast.",
+    labelnames=("task",),
+)
+LLM_ROUTE_CHANGES = REGISTRY.counter(
+    "daybyday_llm_route_changes_total",
+    "Tier changes per task, by direction: degrade or recover.",
+    labelnames=("task", "direction"),
+)
+
+
+class ModelRoute:
+    def __init__(self, task: str, tier: str, max_tokens: int, slo: float,
+                 recovery: float = ROUTE_RECOVERY_SECONDS, models: Dict[str, str] = MODELS):
+        """
+        Args:
+            task (str): Metric label, e.g. "daily_plan".
+            tier (str): Configured tier: quality, balanced or fast.
+            max_tokens (int): Completion token limit of the task.
+            slo (float): p95 latency in seconds above which the route degrades.
+            recovery (float): Seconds after a degrade before the slower tier is tried again.
+            models (dict): Tier -> model name.
+        """
+        if tier not in TIERS:
+            raise ValueError(f"Unknown model tier for {task}: {tier}")
+        self.task = task
+        self.tier = tier
+        self.max_tokens = max_tokens
+        self.slo = slo
+        self.recovery = recovery
+        self.models = models
+        self._tier = TIERS.index(tier)
+        self._changed_at = 0.0
+        # model -> (seconds, valid) of its recent requests
+        self._samples: Dict[str, Deque[Tuple[float, bool]]] = {}
+        self._lock = threading.Lock()
+        LLM_ROUTE_TIER.set(self._tier, task=task)
+
+    def choose(self) -> Tuple[str, int]:
+        """Model and max_tokens for the next request."""
+        with self._lock:
+            now = time.monotonic()
+            if self._tier > TIERS.index(self.tier) and now - self._changed_at >= self.recovery:
+                self._tier -= 1
+                self._changed_at = now
+                # Its old samples are what made the route degrade; judge it afresh
+                self._samples.pop(self.models[TIERS[self._tier]], None)
+                LLM_ROUTE_CHANGES.inc(task=self.task, direction="recover")
+                LLM_ROUTE_TIER.set(self._tier, task=self.task)
+            return self.models[TIERS[self._tier]], self.max_tokens
+
+    def record(self, model: str, seconds: float, outcome: str) -> None:
+        """Record one request.
+
+        Args:
+            model (str): The model that served it.
+            seconds (float): Its latency (the deadline for a timeout).
+            outcome (str): valid, invalid or timeout.
+        """
+        LLM_ROUTE_REQUESTS.inc(task=self.task, model=model, outcome=outcome)
+        with self._lock:
+            samples = self._samples.setdefault(model, deque(maxlen=ROUTE_WINDOW))
+            samples.append((seconds, outcome == "valid"))
+            p95, valid_rate = self._stats(model)
+            degrade = (model == self.models[TIERS[self._tier]] and self._tier < len(TIERS) - 1
+                       and p95 is not None and p95 > self.slo)
+            if degrade:
+                _, faster_valid_rate = self._stats(self.models[TIERS[self._tier + 1]])
+                degrade = faster_valid_rate is None or faster_valid_rate >= MIN_VALID_RATE
+            if degrade:
+                self._tier += 1
+                self._changed_at = time.monotonic()
+                LLM_ROUTE_CHANGES.inc(task=self.task, direction="degrade")
+                LLM_ROUTE_TIER.set(self._tier, task=self.task)
+        if p95 is not None:
+            LLM_ROUTE_P95.set(p95, task=self.task, model=model)
+            LLM_ROUTE_VALID_RATE.set(valid_rate, task=self.task, model=model)
+        if degrade:
+            logger.warning("%s: p95 of %s is %.1fs (SLO %gs), routing to %s",
+                           self.task, model, p95, self.slo, self.models[TIERS[self._tier]])
+
+    def _stats(self, model: str) -> Tuple[Optional[float], Optional[float]]:
+        """p95 latency and valid rate of the model's recent requests, None until MIN_ROUTE_SAMPLES."""
+        samples = self._samples.get(model)
+        if samples is None or len(samples) < MIN_ROUTE_SAMPLES:
+            return None, None
+        p95 = quantile(sorted(seconds for seconds, _ in samples), 0.95)
+        return p95, sum(valid for _, valid in samples) / len(samples)
+
+
+def _from_env(task: str, tier: str, max_tokens: int, slo: float) -> ModelRoute:
+    prefix = f"LLM_{task.upper()}"
+    return ModelRoute(
+        task,
+        tier=os.getenv(f'{prefix}_TIER', tier),
+        max_tokens=int(os.getenv(f'{prefix}_MAX_TOKENS', max_tokens)),
+        slo=float(os.getenv(f'{prefix}_SLO_SECONDS', slo)),
+    )
+
+
+# The category is a one-word answer and gets the fast tier. The other tasks keep the
+# model and token limits they had before routing; only the SLO can move them off it.
+CATEGORY_SELECTION = _from_env("category_selection", tier="fast", max_tokens=50, slo=3)
+DAILY_PLAN = _from_env("daily_plan", tier="quality", max_tokens=1000, slo=20)
+ACTIVITY_PLAN = _from_env("activity_plan", tier="quality", max_tokens=1000, slo=10)
+ACTIVITY_DETAILS = _from_env("activity_details", tier="quality", max_tokens=500, slo=10)
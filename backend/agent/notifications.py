@@ -0,0 +1,217 @@
+"""
+Web-push delivery for plan reminders.
+
+`PushDispatcher` fans a notification out to many subscriptions through a
+bounded worker pool, retrying transient failures with exponential backoff
+and pruning subscriptions the push service reports as gone (404/410).
+`PeriodNotifier` watches every subscribed user's local clock and sends a
+reminder when their Morning/Afternoon/Evening period starts.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from pywebpush import webpush, WebPushException
+
+from .metrics import REGISTRY, timed
+from .sessions import DAY_START_HOUR, PERIODS, period_index, resolve_timezone
+from .user_store import UserStore
+
+logger = logging.getLogger(__name__)
+
+PUSH_RESULTS = REGISTRY.counter(
+    "daybyday_push_notifications_total",
+    "Web-push deliveries, by outcome.",
+    labelnames=("outcome",),
+)
+
+# Push services answer 404/410 for subscriptions that will never work again.
+EXPIRED_STATUSES = {404, 410}
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+PERIOD_MESSAGES = {
+    "Morning": ("Good morning!", "Anty has your morning plan ready."),
+    "Afternoon": ("Good afternoon!", "Time for your afternoon plan."),
+    "Evening": ("Good evening!", "Your evening plan is waiting."),
+}
+
+
+class PushDispatcher:
+    def __init__(
+        self,
+        user_store: UserStore,
+        vapid_private_key: Optional[str],
+        vapid_claims: Dict[str, Any],
+        max_workers: int = 16,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        ttl: int = 3600,
+        timeout: float = 10.0,
+        send: Optional[Callable[..., Any]] = None,
+    ):
+        """Create a dispatcher.
+
+        Args:
+            user_store (UserStore): Where subscriptions are read from and pruned.
+            vapid_private_key (str): VAPID private key, or None to send unsigned.
+            vapid_claims (dict): VAPID claims; copied for every send because webpush mutates it.
+            max_workers (int): Maximum number of deliveries in flight.
+            max_retries (int): Retries per subscription for 429/5xx and network errors.
+            backoff_base (float): First backoff delay in seconds, doubled on every retry.
+            ttl (int): How long the push service should keep an undelivered message.
+            timeout (float): Per-request timeout in seconds.
+            send (callable, optional): Replacement for pywebpush.webpush.
+        """
+        self.user_store = user_store
+        self.vapid_private_key = vapid_private_key
+        self.vapid_claims = vapid_claims
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.ttl = ttl
+        self.timeout = timeout
+        self._send = send or webpush
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="webpush")
+        # One pooled session keeps connections to the push services alive across sends.
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def send_to_user(self, user_id: str, payload: Dict[str, Any]) -> Dict[str, int]:
+        """Send a notification to every subscription of one user."""
+        return self.dispatch(self.user_store.get_subscriptions(user_id), payload)
+
+    def broadcast(self, payload: Dict[str, Any]) -> Dict[str, int]:
+        """Send a notification to every stored subscription."""
+        return self.dispatch(self.user_store.get_subscriptions(), payload)
+
+    def dispatch(self, subscriptions: List[Dict[str, Any]], payload: Dict[str, Any]) -> Dict[str, int]:
+        """Deliver a payload to the given subscriptions concurrently.
+
+        Returns:
+            dict: Number of subscriptions per outcome (sent, expired, failed).
+        """
+        data = json.dumps(payload)
+        counts = {"sent": 0, "expired": 0, "failed": 0}
+        if not subscriptions:
+            return counts
+
+        with timed("push_dispatch"):
+            outcomes = list(self._executor.map(lambda s: self._send_one(s, data), subscriptions))
+
+        expired = []
+        for subscription, outcome in zip(subscriptions, outcomes):
+            counts[outcome] += 1
+            PUSH_RESULTS.inc(outcome=outcome)
+            if outcome == "expired":
+                expired.append(subscription["endpoint"])
+        if expired:
+            # One commit for the whole batch of dead endpoints.
+            self.user_store.remove_subscriptions(expired)
+        return counts
+
+    def _send_one(self, subscription: Dict[str, Any], data: str) -> str:
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                self._send(
+                    subscription_info=subscription,
+                    data=data,
+                    vapid_private_key=self.vapid_private_key,
+                    vapid_claims=dict(self.vapid_claims) if self.vapid_private_key else None,
+                    ttl=self.ttl,
+                    timeout=self.timeout,
+                    requests_session=self._session,
+                )
+                return "sent"
+            except WebPushException as e:
+                status = e.response.status_code if e.response is not None else None
+                if status in EXPIRED_STATUSES:
+                    return "expired"
+                if status is not None and status not in RETRYABLE_STATUSES:
+                    logger.warning("Push to %s rejected: %s", subscription.get('endpoint'), e)
+                    return "failed"
+                if e.response is not None:
+                    retry_after = e.response.headers.get("Retry-After")
+            except requests.RequestException as e:
+                logger.warning("Push to %s failed: %s", subscription.get('endpoint'), e)
+
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt, retry_after))
+        return "failed"
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        # Full jitter keeps retries from many workers from lining up.
+        return random.uniform(0, self.backoff_base * (2 ** attempt))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._session.close()
+
+
+class PeriodNotifier:
+    """Background thread that sends a reminder when a user's period starts."""
+
+    def __init__(self, dispatcher: PushDispatcher, user_store: UserStore, interval: float = 60.0):
+        self.dispatcher = dispatcher
+        self.user_store = user_store
+        self.interval = interval
+        # user_id -> (plan date, period index) last seen, so each period fires once
+        self._last_period: Dict[str, Tuple[Any, int]] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="period-notifier", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Error checking period transitions")
+
+    def check(self) -> Dict[str, str]:
+        """Notify every subscribed user whose period changed since the last check.
+
+        Returns:
+            dict: user_id -> period that was announced.
+        """
+        timezones = {user_id: prefs.get('timezone') for user_id, prefs in self.user_store.iter_preferences()}
+        announced = {}
+        last_period = {}
+        for user_id in self.user_store.subscribed_user_ids():
+            now = datetime.now(resolve_timezone(timezones.get(user_id)))
+            current = ((now - timedelta(hours=DAY_START_HOUR)).date(), period_index(now.hour))
+            previous = self._last_period.get(user_id)
+            last_period[user_id] = current
+            # The first sighting only records the period; a restart must not re-announce it.
+            if previous is not None and previous != current:
+                announced[user_id] = PERIODS[current[1]]
+
+        # One concurrent batch per period instead of one batch per user.
+        for period in set(announced.values()):
+            subscriptions = []
+            for user_id, user_period in announced.items():
+                if user_period == period:
+                    subscriptions.extend(self.user_store.get_subscriptions(user_id))
+            title, body = PERIOD_MESSAGES[period]
+            self.dispatcher.dispatch(subscriptions, {"title": title, "body": body, "url": "/"})
+        # Rebuilt every pass so users who unsubscribed drop out.
+        self._last_period = last_period
+        return announced
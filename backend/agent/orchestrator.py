@@ -1,14 +1,30 @@
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Callable, Optional, Tuple
 from enum import Enum
 from .daily_planner import AntyAIPlanner
 from .activity_planner import AntyAIActivityPlanner
 import asyncio
+import json
 import logging
-from datetime import datetime
+import os
+import time
+from .activity_history import history_for_user
+from .admission import Overloaded
+from .fallback_planner import FALLBACK_PLANS, RuleBasedPlanner
+from .itinerary import optimize_itinerary
+from .tools.geosorting import DEFAULT_LOCATION
+from .tools.weather import CITY_LOCATION, get_weather, get_weather_category
+from .metrics import TASK_SECONDS
+from .plan_cache import PlanCache
+from .sessions import PERIODS, SessionManager, UserSession
+from .user_store import DEFAULT_USER_ID
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Seconds the LLM planners get before the rule-based plan is served instead (0: always wait for the LLM)
+DAILY_PLAN_BUDGET_SECONDS = float(os.getenv('DAILY_PLAN_BUDGET_SECONDS', 8))
+ACTIVITY_PLAN_BUDGET_SECONDS = float(os.getenv('ACTIVITY_PLAN_BUDGET_SECONDS', 8))
+
 class TaskType(Enum):
     DAILY_PLANNER = "daily_planner"
     ACTIVITY_PLANNER = "activity_planner"
@@ -28,52 +44,49 @@ class OrchestratorAgent:
             # TaskType.WEATHER_CHECK: WeatherAgent(),
         }
         
-        self.current_step = self._determine_current_step()
-        # Initialize completed activities tracking
-        self.completed_activities = {
-            0: [],  # Morning completed activities
-            1: [],  # Afternoon completed activities
-            2: []   # Evening completed activities
-        }
+        # Per-user plan progress, bounded by LRU/TTL eviction
+        self.sessions = SessionManager()
+        # Daily and activity plans generated ahead of time or earlier today
+        self.plan_cache = PlanCache()
+        # Local plans served when the LLM misses its latency budget or fails
+        self.fallback_planner = RuleBasedPlanner()
+        
+    def _session(self, user_id: Optional[str] = None, timezone: Optional[str] = None) -> UserSession:
+        return self.sessions.get(user_id or DEFAULT_USER_ID, timezone)
         
-    def _determine_current_step(self) -> int:
+    def _determine_current_step(self, user_id: Optional[str] = None, timezone: Optional[str] = None) -> int:
         """
-        Determine the current step based on time of day:
+        Determine the current step based on the time of day in the user's timezone:
         0: Morning (5:00 - 11:59)
         1: Afternoon (12:00 - 17:59)
         2: Evening (18:00 - 4:59)
         """
-        current_hour = datetime.now().hour
-        
-        if 5 <= current_hour < 12:
-            return 0  # Morning
-        elif 12 <= current_hour < 18:
-            return 1  # Afternoon
-        else:
-            return 2  # Evening
+        return self._session(user_id, timezone).current_step()
             
-    def get_current_time_period(self) -> str:
+    def get_current_time_period(self, user_id: Optional[str] = None, timezone: Optional[str] = None) -> str:
         """Get the current time period as a string."""
-        periods = ["Morning", "Afternoon", "Evening"]
-        return periods[self.current_step]
+        return PERIODS[self._determine_current_step(user_id, timezone)]
         
-    def mark_activity_completed(self, activity: str) -> None:
+    def mark_activity_completed(self, activity: str, user_id: Optional[str] = None) -> None:
         """Mark an activity as completed for the current step."""
-        if activity not in self.completed_activities[self.current_step]:
-            self.completed_activities[self.current_step].append(activity)
-            logger.info(f"Marked activity as completed for {self.get_current_time_period()}: {activity}")
+        session = self._session(user_id)
+        step = session.current_step()
+        if session.mark_completed(activity, step):
+            logger.info(f"Marked activity as completed for {PERIODS[step]}: {activity}")
             
-    def get_completed_activities(self, step: Optional[int] = None) -> List[str]:
+    def get_completed_activities(self, step: Optional[int] = None, user_id: Optional[str] = None) -> List[str]:
         """Get completed activities for a specific step or current step if none specified."""
+        session = self._session(user_id)
+        current_step = session.current_step()
         if step is None:
-            step = self.current_step
-        return self.completed_activities[step]
+            step = current_step
+        return session.completed_for(step)
         
-    def get_remaining_activities(self, daily_plan: Dict) -> List[str]:
+    def get_remaining_activities(self, daily_plan: Dict, user_id: Optional[str] = None) -> List[str]:
         """Get remaining activities for the current step."""
-        current_period = self.get_current_time_period()
+        current_period = self.get_current_time_period(user_id)
         all_activities = daily_plan.get(current_period, [])
-        completed = self.get_completed_activities()
+        completed = self.get_completed_activities(user_id=user_id)
         return [activity for activity in all_activities if activity not in completed]
         
     async def delegate_task(self, task_type: TaskType, **kwargs) -> Dict[str, Any]:
@@ -87,6 +100,7 @@ class OrchestratorAgent:
         Returns:
             Dict containing the task results and metadata
         """
+        start = time.perf_counter()
         try:
             if task_type not in self.agents:
                 raise ValueError(f"No agent available for task type: {task_type}")
@@ -98,7 +112,13 @@ class OrchestratorAgent:
             if task_type == TaskType.DAILY_PLANNER:
                 result = await agent.generate_recommendations(kwargs.get('user_preferences', {}))
             elif task_type == TaskType.ACTIVITY_PLANNER:
-                result = await agent.generate_recommendations(kwargs.get('activity_description', ''))
+                result = await agent.generate_recommendations(
+                    kwargs.get('activity_description', ''),
+                    user_id=kwargs.get('user_id'),
+                    user_location=kwargs.get('user_location'),
+                    place_filter=kwargs.get('place_filter'),
+                    weather=kwargs.get('weather')
+                )
             else:
                 raise NotImplementedError(f"Task type {task_type} not implemented yet")
             
@@ -108,10 +128,14 @@ class OrchestratorAgent:
                 "result": result,
                 "metadata": {
                     "agent": agent.__class__.__name__,
-                    "timestamp": asyncio.get_event_loop().time()
+                    "timestamp": asyncio.get_event_loop().time(),
+                    "duration_s": round(time.perf_counter() - start, 4)
                 }
             }
             
+        except Overloaded:
+            # Shed load is answered with 503 by the API, not reported as a failed task.
+            raise
         except Exception as e:
             logger.error(f"Error in task delegation: {str(e)}")
             return {
@@ -119,9 +143,12 @@ class OrchestratorAgent:
                 "task_type": task_type.value,
                 "error": str(e),
                 "metadata": {
-                    "timestamp": asyncio.get_event_loop().time()
+                    "timestamp": asyncio.get_event_loop().time(),
+                    "duration_s": round(time.perf_counter() - start, 4)
                 }
             }
+        finally:
+            TASK_SECONDS.observe(time.perf_counter() - start, task_type=task_type.value)
     
     async def process_complex_task(self, tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
@@ -151,13 +178,176 @@ class OrchestratorAgent:
             }
         }
         
-    async def plan_next_activity(self, daily_planner_result: dict, current_period: str) -> dict:
+    def _parse_daily_plan(self, daily_planner_result: dict) -> Dict:
+        if isinstance(daily_planner_result['result'], str):
+            return json.loads(daily_planner_result['result'])
+        return daily_planner_result['result']
+        
+    def has_periods(self, daily_planner_result: dict) -> bool:
+        """Whether the result is a real plan rather than the planner's empty error fallback."""
+        try:
+            daily_plan = self._parse_daily_plan(daily_planner_result)
+        except Exception:
+            return False
+        return isinstance(daily_plan, dict) and any(period in daily_plan for period in PERIODS)
+        
+    async def _within_budget(self, task: asyncio.Future, budget: float) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        The task's result if it finishes within the budget, else None and why
+        (slow or overloaded). A slow task is never cancelled: it may be the
+        single-flight leader other requests are waiting on.
+        """
+        done, _ = await asyncio.wait({task}, timeout=budget)
+        if not done:
+            # Nobody awaits it any more; retrieve a late Overloaded so it isn't logged as unhandled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            return None, "slow"
+        try:
+            return task.result(), None
+        except Overloaded:
+            return None, "overloaded"
+        
+    async def _fallback_result(self, task_type: TaskType, plan: Callable[[], Any], reason: str,
+                               start: float, llm_result: Optional[Dict] = None) -> Dict[str, Any]:
+        """
+        The rule-based plan in the same shape as delegate_task's results, or the
+        LLM's result (an error when there is none) if the rule-based planner failed too.
+        
+        Args:
+            plan: Makes the rule-based plan; only called once the LLM has lost.
+        """
+        try:
+            result = await asyncio.to_thread(plan)
+        except Exception as e:
+            logger.error(f"Rule-based {task_type.value} planning failed: {e}")
+            return llm_result or {
+                "status": "error",
+                "task_type": task_type.value,
+                "error": f"No plan within the latency budget ({reason})",
+                "metadata": {"duration_s": round(time.perf_counter() - start, 4)}
+            }
+        FALLBACK_PLANS.inc(task_type=task_type.value, reason=reason)
+        logger.info(f"Serving the rule-based {task_type.value} plan ({reason})")
+        return {
+            "status": "success",
+            "task_type": task_type.value,
+            "result": result,
+            "metadata": {
+                "agent": self.fallback_planner.__class__.__name__,
+                "fallback": reason,
+                "timestamp": asyncio.get_event_loop().time(),
+                "duration_s": round(time.perf_counter() - start, 4)
+            }
+        }
+        
+    def _cache_late_daily_plan(self, task: asyncio.Future, user_id: str, plan_date, user_preferences: Dict) -> None:
+        """Keep an LLM plan that lost the race, so the user's next request gets it."""
+        if task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        if result['status'] == 'success' and self.has_periods(result):
+            self.plan_cache.put_daily_plan(user_id, plan_date, user_preferences, result)
+        
+    async def get_daily_plan(self, user_preferences: Dict, user_id: Optional[str] = None,
+                             timezone: Optional[str] = None,
+                             budget: Optional[float] = DAILY_PLAN_BUDGET_SECONDS) -> Dict[str, Any]:
+        """
+        Get the user's daily plan for their current plan day, generating it at most
+        once per day (or again after the preferences change).
+        
+        The LLM planner races the rule-based planner: when it has no valid plan
+        within the budget, the rule-based plan is returned instead (and not cached),
+        while a slow LLM plan is still cached for the next request once it arrives.
+        
+        Args:
+            budget (float, optional): Seconds to wait for the LLM; None or 0 waits for
+                it without a fallback, as pre-generation does.
+        
+        Returns:
+            Dict in the same shape as delegate_task(TaskType.DAILY_PLANNER, ...)
+        """
+        session = self._session(user_id, timezone)
+        session.current_step()
+        cached = self.plan_cache.get_daily_plan(session.user_id, session.plan_date, user_preferences)
+        if cached is not None:
+            return cached
+        
+        start = time.perf_counter()
+        llm = asyncio.ensure_future(self.delegate_task(TaskType.DAILY_PLANNER, user_preferences=user_preferences))
+        if not budget:
+            result, reason = await llm, None
+        else:
+            result, reason = await self._within_budget(llm, budget)
+        if result is not None and result['status'] == 'success' and self.has_periods(result):
+            self.plan_cache.put_daily_plan(session.user_id, session.plan_date, user_preferences, result)
+            return result
+        if not budget:
+            return result
+        if reason == "slow":
+            llm.add_done_callback(lambda task: self._cache_late_daily_plan(
+                task, session.user_id, session.plan_date, user_preferences))
+        return await self._fallback_result(
+            TaskType.DAILY_PLANNER,
+            lambda: self.fallback_planner.daily_plan(
+                user_preferences, weather_category=get_weather_category(get_weather(*CITY_LOCATION))
+            ),
+            reason or "failed", start, result
+        )
+        
+    async def prewarm(self, user_preferences: Dict, user_id: str, timezone: Optional[str] = None,
+                      period: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate and cache the user's daily plan and the plan for the first activity
+        of the given period, so their first request of the day is a cache hit.
+        
+        Returns:
+            Dict with a status and, on failure, the error of the step that failed
+        """
+        try:
+            return await self._prewarm(user_preferences, user_id, timezone, period)
+        except Overloaded as e:
+            return {"status": "error", "error": str(e)}
+        
+    async def _prewarm(self, user_preferences: Dict, user_id: str, timezone: Optional[str],
+                       period: Optional[str]) -> Dict[str, Any]:
+        daily_planner_result = await self.get_daily_plan(user_preferences, user_id, timezone, budget=None)
+        if daily_planner_result['status'] != 'success' or not self.has_periods(daily_planner_result):
+            error = daily_planner_result.get('error')
+            if error is None and isinstance(daily_planner_result.get('result'), dict):
+                error = daily_planner_result['result'].get('error')
+            return {"status": "error", "error": error or "Daily planner returned no plan"}
+        
+        daily_plan = self._parse_daily_plan(daily_planner_result)
+        activities = daily_plan.get(period or self.get_current_time_period(user_id, timezone), [])
+        session = self._session(user_id)
+        if not activities or self.plan_cache.has_activity_plan(session.user_id, session.plan_date, activities[0]):
+            return {"status": "success"}
+        
+        activity_planner_result = await self.delegate_task(
+            TaskType.ACTIVITY_PLANNER,
+            activity_description=activities[0],
+            user_id=user_id
+        )
+        if activity_planner_result['status'] != 'success':
+            return {"status": "error", "error": activity_planner_result['error']}
+        if activity_planner_result['result'].get('status') != 'success':
+            return {"status": "error", "error": activity_planner_result['result'].get('error')}
+        self.plan_cache.put_activity_plan(session.user_id, session.plan_date, activities[0], activity_planner_result)
+        return {"status": "success"}
+        
+    async def plan_next_activity(self, daily_planner_result: dict, current_period: str,
+                                 user_id: Optional[str] = None,
+                                 user_location: Optional[Tuple[float, float]] = None,
+                                 place_filter: Optional[str] = None) -> dict:
         """
         Plans the next activity from the daily plan.
         
         Args:
             daily_planner_result (dict): The result from the daily planner
             current_period (str): The current time period (morning/afternoon/evening)
+            user_id (str, optional): The user the activity is planned for
+            user_location (tuple, optional): (lat, lon) of the user, places are ranked from there
+            place_filter (str, optional): Tag filter expression the places must match
             
         Returns:
             dict: A dictionary containing:
@@ -165,14 +355,18 @@ class OrchestratorAgent:
                 - details: The detailed plan for the activity
                 - remaining: List of remaining activities
         """
-        # Parse daily plan
-        if isinstance(daily_planner_result['result'], str):
-            daily_plan = eval(daily_planner_result['result'])
-        else:
-            daily_plan = daily_planner_result['result']
+        if not self.has_periods(daily_planner_result):
+            # The LLM planner's error result, or a failed task without a result at all
+            return {
+                'activity': None,
+                'details': None,
+                'remaining': [],
+                'error': daily_planner_result.get('error') or "No daily plan available"
+            }
+        daily_plan = self._parse_daily_plan(daily_planner_result)
         
         # Get remaining activities for current period
-        remaining_activities = self.get_remaining_activities(daily_plan)
+        remaining_activities = self.get_remaining_activities(daily_plan, user_id=user_id)
         print(f"\nRemaining activities for {current_period}:")
         for i, activity in enumerate(remaining_activities, 1):
             print(f"{i}. {activity}")
@@ -180,25 +374,32 @@ class OrchestratorAgent:
         if remaining_activities:
             # Plan the first remaining activity
             activity_description = remaining_activities[0]
-            activity_planner_result = await self.delegate_task(
-                TaskType.ACTIVITY_PLANNER,
-                activity_description=activity_description
-            )
-            print("\nActivity planner result:", activity_planner_result['result'])
+            session = self._session(user_id)
+            activity_planner_result = None
+            if user_location is None and place_filter is None:
+                # Pre-generated plans are ranked from the default location, unfiltered.
+                activity_planner_result = self.plan_cache.pop_activity_plan(
+                    session.user_id, session.plan_date, activity_description
+                )
+            if activity_planner_result is None:
+                activity_planner_result = await self._plan_activity(
+                    activity_description, user_id, user_location, place_filter
+                )
+            print("\nActivity planner result:", activity_planner_result.get('result'))
             
             # Mark the activity as completed
-            self.mark_activity_completed(activity_description)
+            self.mark_activity_completed(activity_description, user_id=user_id)
             print(f"\nMarked '{activity_description}' as completed")
             
             # Get updated remaining activities
-            updated_remaining = self.get_remaining_activities(daily_plan)
+            updated_remaining = self.get_remaining_activities(daily_plan, user_id=user_id)
             print(f"\nUpdated remaining activities for {current_period}:")
             for i, activity in enumerate(updated_remaining, 1):
                 print(f"{i}. {activity}")
             
             return {
                 'activity': activity_description,
-                'details': activity_planner_result['result'],
+                'details': activity_planner_result.get('result'),
                 'remaining': updated_remaining
             }
         else:
@@ -209,17 +410,86 @@ class OrchestratorAgent:
                 'remaining': []
             }
 
-    async def handle_activity_planning(self, daily_planner_result: dict):
+    async def _plan_activity(self, activity_description: str, user_id: Optional[str],
+                             user_location: Optional[Tuple[float, float]], place_filter: Optional[str],
+                             budget: float = ACTIVITY_PLAN_BUDGET_SECONDS) -> Dict[str, Any]:
+        """
+        Plan one activity with the LLM planner, or with the rule-based planner when
+        the LLM has no plan within the budget. A slow LLM request runs on for any
+        identical requests sharing it; its answer is not used here.
+        """
+        start = time.perf_counter()
+        # Resolved once per request (cached for a few minutes), for the LLM and the fallback alike
+        weather = await asyncio.to_thread(get_weather, *CITY_LOCATION)
+        llm = asyncio.ensure_future(self.delegate_task(
+            TaskType.ACTIVITY_PLANNER,
+            activity_description=activity_description,
+            user_id=user_id,
+            user_location=user_location,
+            place_filter=place_filter,
+            weather=weather
+        ))
+        if not budget:
+            return await llm
+        
+        def fallback_plan():
+            visited = history_for_user(user_id).visited_index()
+            return self.fallback_planner.activity_plan(activity_description, visited, user_location, place_filter,
+                                                       get_weather_category(weather))
+        
+        result, reason = await self._within_budget(llm, budget)
+        if (result is not None and result['status'] == 'success'
+                and result['result'].get('status') == 'success'):
+            return result
+        return await self._fallback_result(TaskType.ACTIVITY_PLANNER, fallback_plan, reason or "failed", start, result)
+
+    async def handle_activity_planning(self, daily_planner_result: dict, user_id: Optional[str] = None,
+                                       timezone: Optional[str] = None,
+                                       user_location: Optional[Tuple[float, float]] = None,
+                                       place_filter: Optional[str] = None):
         """
         Handles the activity planning process for the current period.
         
         Args:
             daily_planner_result (dict): The result from the daily planner
-            current_period (str): The current time period (morning/afternoon/evening)
+            user_id (str, optional): The user the activity is planned for
+            timezone (str, optional): IANA timezone used to work out the user's current period
+            user_location (tuple, optional): (lat, lon) of the user
+            place_filter (str, optional): Tag filter expression, e.g. "wheelchair"
         """
-        result = await self.plan_next_activity(daily_planner_result, self.get_current_time_period())
+        current_period = self.get_current_time_period(user_id, timezone)
+        result = await self.plan_next_activity(daily_planner_result, current_period, user_id=user_id,
+                                               user_location=user_location, place_filter=place_filter)
         return result
 
+    async def plan_itinerary(self, daily_planner_result: dict, pace: str = "moderate",
+                             user_location: Optional[Tuple[float, float]] = None,
+                             user_id: Optional[str] = None, place_filter: Optional[str] = None) -> dict:
+        """
+        Picks one place per activity of the whole day so the total walking is minimal.
+        
+        Args:
+            daily_planner_result (dict): The result from the daily planner
+            pace (str): The user's pace preference, sets the time spent per activity
+            user_location (tuple, optional): (lat, lon) where the day starts
+            user_id (str, optional): Whose recently visited places are ranked lower
+            place_filter (str, optional): Tag filter expression, e.g. "wheelchair"
+            
+        Returns:
+            dict: The ordered route with arrive/depart times and the total travel minutes
+        """
+        daily_plan = self._parse_daily_plan(daily_planner_result)
+        weather = await asyncio.to_thread(get_weather, *CITY_LOCATION)
+        # Loads datasets and runs graph searches, keep it off the event loop.
+        start = user_location or DEFAULT_LOCATION
+        
+        def optimize():
+            visited = history_for_user(user_id).visited_index()
+            return optimize_itinerary(daily_plan, start=start, pace=pace, visited=visited,
+                                      place_filter=place_filter, weather_category=get_weather_category(weather))
+        
+        return await asyncio.to_thread(optimize)
+
 
 
 # Example usage
@@ -251,10 +521,7 @@ async def main():
     print("Daily planner result:", daily_planner_result['result'])
 
     # Get the activity for the current time period
-    if isinstance(daily_planner_result['result'], str):
-        daily_plan = eval(daily_planner_result['result'])
-    else:
-        daily_plan = daily_planner_result['result']
+    daily_plan = orchestrator._parse_daily_plan(daily_planner_result)
         
     # Get remaining activities for current period
     remaining_activities = orchestrator.get_remaining_activities(daily_plan)
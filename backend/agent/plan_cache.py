@@ -0,0 +1,75 @@
+"""
+Cache of generated daily plans and activity plans.
+
+Entries are keyed by user and plan day, so a plan generated before the user
+wakes up (see `PlanPrewarmer`) is served on their first request and
+naturally goes stale the next day. The cache is an LRU capped in entries.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from .metrics import REGISTRY
+
+MAX_CACHED_PLANS = int(os.getenv('MAX_CACHED_PLANS', 20000))
+
+PLAN_CACHE_REQUESTS = REGISTRY.counter(
+    "daybyday_plan_cache_requests_total",
+    "Plan cache lookups, by kind of plan and result.",
+    labelnames=("kind", "result"),
+)
+
+
+def preferences_fingerprint(preferences: Dict[str, Any]) -> str:
+    """Stable hash of the preferences, so edited preferences never hit an old plan."""
+    return hashlib.sha1(json.dumps(preferences, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class PlanCache:
+    def __init__(self, max_entries: int = MAX_CACHED_PLANS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, key: Hashable, pop: bool = False) -> Optional[Any]:
+        with self._lock:
+            if pop:
+                value = self._entries.pop((kind, key), None)
+            else:
+                value = self._entries.get((kind, key))
+                if value is not None:
+                    self._entries.move_to_end((kind, key))
+        PLAN_CACHE_REQUESTS.inc(kind=kind, result="hit" if value is not None else "miss")
+        return value
+
+    def _put(self, kind: str, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[(kind, key)] = value
+            self._entries.move_to_end((kind, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_daily_plan(self, user_id: str, plan_date, preferences: Dict[str, Any]) -> Optional[Dict]:
+        return self._get("daily_plan", (user_id, plan_date, preferences_fingerprint(preferences)))
+
+    def put_daily_plan(self, user_id: str, plan_date, preferences: Dict[str, Any], result: Dict) -> None:
+        self._put("daily_plan", (user_id, plan_date, preferences_fingerprint(preferences)), result)
+
+    def pop_activity_plan(self, user_id: str, plan_date, activity: str) -> Optional[Dict]:
+        """Take a pre-generated activity plan; it is used once, when the activity is handed out."""
+        return self._get("activity_plan", (user_id, plan_date, activity), pop=True)
+
+    def has_activity_plan(self, user_id: str, plan_date, activity: str) -> bool:
+        with self._lock:
+            return ("activity_plan", (user_id, plan_date, activity)) in self._entries
+
+    def put_activity_plan(self, user_id: str, plan_date, activity: str, result: Dict) -> None:
+        self._put("activity_plan", (user_id, plan_date, activity), result)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,139 @@
+"""
+Opt-in sampling profiler for API requests.
+
+A `SamplingProfiler` runs a sampler thread that records the Python stack of
+the threads it was given every PROFILE_INTERVAL_MS: for a request, the
+request thread and, for async views, the event-loop thread running the view
+and all of its tasks. When it stops, the samples are written as a speedscope
+file (https://www.speedscope.app) to PROFILE_DIR, one profile per thread.
+
+Which requests are profiled (see request_profiling.py, which hooks it into
+the Flask app):
+- PROFILE_SAMPLE_RATE: fraction of all requests (0 disables, 0.01 is 1%),
+  cheap enough to leave on in production;
+- the X-Profile: 1 request header, honoured only when PROFILE_ALLOW_HEADER=1.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from .metrics import REGISTRY
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_ALLOW_HEADER = os.getenv('PROFILE_ALLOW_HEADER') == '1'
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(__file__), '..', 'data', 'profiles'))
+# Deepest stack kept per sample
+MAX_STACK_DEPTH = 128
+
+PROFILES_WRITTEN = REGISTRY.counter(
+    "daybyday_profiles_written_total",
+    "Request profiles written to PROFILE_DIR.",
+)
+
+
+class SamplingProfiler:
+    def __init__(self, name: str, interval: float = PROFILE_INTERVAL_MS / 1000):
+        """
+        Args:
+            name (str): Profile name, e.g. "GET /api/agent/get-activity".
+            interval (float): Seconds between samples.
+        """
+        self.name = name
+        self.interval = interval
+        self._threads: Dict[int, str] = {}
+        self._frames: List[Dict] = []
+        self._frame_index: Dict[Tuple[str, str, int], int] = {}
+        # thread id -> (samples, weights in ms)
+        self._samples: Dict[int, Tuple[List[List[int]], List[float]]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = 0.0
+        self._elapsed = 0.0
+
+    def add_current_thread(self) -> None:
+        """Sample the calling thread too (e.g. the event loop running an async view)."""
+        current = threading.current_thread()
+        with self._lock:
+            self._threads.setdefault(current.ident, current.name)
+
+    def start(self) -> None:
+        self.add_current_thread()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._elapsed = time.perf_counter() - self._started
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample((now - last) * 1000)
+            last = now
+
+    def _sample(self, weight_ms: float) -> None:
+        frames = sys._current_frames()
+        with self._lock:
+            threads = list(self._threads)
+        for ident in threads:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._frame_id(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            samples, weights = self._samples.setdefault(ident, ([], []))
+            samples.append(stack)
+            weights.append(weight_ms)
+
+    def _frame_id(self, code) -> int:
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self._frames)
+            self._frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+        return index
+
+    def to_speedscope(self) -> Dict:
+        profiles = []
+        for ident, (samples, weights) in self._samples.items():
+            profiles.append({
+                "type": "sampled",
+                "name": f"{self.name} [{self._threads.get(ident, ident)}]",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.name} ({self._elapsed * 1000:.0f} ms)",
+            "exporter": "daybyday sampling profiler",
+            "shared": {"frames": self._frames},
+            "profiles": profiles,
+        }
+
+    def write(self, directory: str = PROFILE_DIR) -> str:
+        """Write the speedscope file and return its path."""
+        os.makedirs(directory, exist_ok=True)
+        slug = "".join(c if c.isalnum() else "_" for c in self.name).strip("_")
+        filename = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}_{slug}.speedscope.json"
+        path = os.path.join(directory, filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_speedscope(), f)
+        PROFILES_WRITTEN.inc()
+        return path
@@ -0,0 +1,158 @@
+"""
+Pre-generation of daily plans before users wake up.
+
+`PlanPrewarmer` runs in a background thread with its own event loop. Once a
+minute it looks for users whose pre-generation time has passed in their own
+timezone and asks the orchestrator to generate and cache their daily plan
+and first activity plan, so the first request of the day is a cache hit.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, time as dt_time, timedelta
+from typing import Dict, Optional
+
+from .metrics import REGISTRY
+from .sessions import DAY_START_HOUR, PERIODS, period_index, resolve_timezone
+from .user_store import UserStore
+
+logger = logging.getLogger(__name__)
+
+# Local time at which plans are generated for everyone...
+PREWARM_TIME = os.getenv('PREWARM_TIME', '05:30')
+# ...unless a lead time is set, then it is this many minutes before each user's preferredStartTime.
+PREWARM_LEAD_MINUTES = os.getenv('PREWARM_LEAD_MINUTES')
+PREWARM_CONCURRENCY = int(os.getenv('PREWARM_CONCURRENCY', 4))
+
+# Pause after an upstream rate limit, doubled on every consecutive one.
+RATE_LIMIT_BACKOFF_SECONDS = 30
+MAX_RATE_LIMIT_BACKOFF_SECONDS = 900
+# Wait before retrying a user whose pre-generation failed for another reason.
+FAILED_RETRY_SECONDS = 600
+
+PREWARM_RESULTS = REGISTRY.counter(
+    "daybyday_prewarm_total",
+    "Plan pre-generation attempts, by outcome.",
+    labelnames=("outcome",),
+)
+
+
+def _parse_time(value: str) -> dt_time:
+    return datetime.strptime(value, '%H:%M').time()
+
+
+def _is_rate_limited(error: Optional[str]) -> bool:
+    error = (error or '').lower()
+    return '429' in error or 'rate limit' in error or 'rate_limit' in error
+
+
+class PlanPrewarmer:
+    def __init__(self, orchestrator, user_store: UserStore, interval: float = 60.0,
+                 concurrency: int = PREWARM_CONCURRENCY, prewarm_time: str = PREWARM_TIME,
+                 lead_minutes: Optional[str] = PREWARM_LEAD_MINUTES):
+        """
+        Args:
+            orchestrator (OrchestratorAgent): Generates and caches the plans.
+            user_store (UserStore): Source of every user's preferences.
+            interval (float): Seconds between scans for due users.
+            concurrency (int): Maximum number of users pre-generated at once.
+            prewarm_time (str): Local HH:MM at which plans are generated.
+            lead_minutes (str, optional): If set, generate this many minutes before
+                the user's preferredStartTime instead.
+        """
+        self.orchestrator = orchestrator
+        self.user_store = user_store
+        self.interval = interval
+        self.concurrency = concurrency
+        self.prewarm_time = _parse_time(prewarm_time)
+        self.lead = timedelta(minutes=int(lead_minutes)) if lead_minutes else None
+        # user_id -> plan date whose plans are already cached
+        self._done: Dict[str, object] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._paused_until = 0.0
+        self._backoff = RATE_LIMIT_BACKOFF_SECONDS
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=lambda: asyncio.run(self._run()),
+                                            name="plan-prewarmer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Error pre-generating plans")
+            await asyncio.sleep(self.interval)
+
+    def _target(self, preferences: Dict, plan_date, tz) -> datetime:
+        """Local time the plan should be ready for: the prewarm time or the user's start time."""
+        if self.lead is not None and preferences.get('preferredStartTime'):
+            target = _parse_time(preferences['preferredStartTime'])
+        else:
+            target = self.prewarm_time
+        day = plan_date + timedelta(days=1) if target.hour < DAY_START_HOUR else plan_date
+        return datetime.combine(day, target, tz)
+
+    async def run_once(self) -> Dict[str, str]:
+        """Pre-generate plans for every user who is due and not done yet today.
+
+        Returns:
+            dict: user_id -> outcome for the users attempted in this pass.
+        """
+        if time.monotonic() < self._paused_until:
+            return {}
+
+        due = []
+        for user_id, preferences in self.user_store.iter_preferences():
+            tz = resolve_timezone(preferences.get('timezone'))
+            now = datetime.now(tz)
+            plan_date = (now - timedelta(hours=DAY_START_HOUR)).date()
+            if self._done.get(user_id) == plan_date or time.monotonic() < self._retry_at.get(user_id, 0):
+                continue
+            target = self._target(preferences, plan_date, tz)
+            run_at = target - self.lead if self.lead is not None else target
+            if now < run_at:
+                continue
+            # Plan for the period the user will be in when they show up.
+            period = PERIODS[period_index(max(now, target).hour)]
+            due.append((user_id, preferences, period, plan_date))
+
+        if not due:
+            return {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        outcomes = await asyncio.gather(*(self._prewarm(semaphore, *item) for item in due))
+        return {item[0]: outcome for item, outcome in zip(due, outcomes)}
+
+    async def _prewarm(self, semaphore: asyncio.Semaphore, user_id: str, preferences: Dict,
+                       period: str, plan_date) -> str:
+        async with semaphore:
+            # Another task may have hit a rate limit while this one was queued.
+            if time.monotonic() < self._paused_until:
+                outcome = "deferred"
+            else:
+                result = await self.orchestrator.prewarm(preferences, user_id, preferences.get('timezone'), period)
+                if result['status'] == 'success':
+                    self._done[user_id] = plan_date
+                    self._retry_at.pop(user_id, None)
+                    self._backoff = RATE_LIMIT_BACKOFF_SECONDS
+                    outcome = "done"
+                elif _is_rate_limited(result.get('error')):
+                    self._paused_until = time.monotonic() + self._backoff
+                    self._backoff = min(self._backoff * 2, MAX_RATE_LIMIT_BACKOFF_SECONDS)
+                    outcome = "rate_limited"
+                else:
+                    logger.warning("Pre-generating plans for %s failed: %s", user_id, result.get('error'))
+                    self._retry_at[user_id] = time.monotonic() + FAILED_RETRY_SECONDS
+                    outcome = "failed"
+        PREWARM_RESULTS.inc(outcome=outcome)
+        return outcome
@@ -0,0 +1,128 @@
+"""
+Per-user plan progress for the orchestrator.
+
+Each user gets a small `UserSession` holding the activities completed in
+each period of their current plan day. Sessions live in an LRU map that is
+capped in size and drops sessions idle for longer than a TTL, so memory
+stays bounded no matter how many users pass through the process.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from .metrics import REGISTRY
+
+PERIODS = ["Morning", "Afternoon", "Evening"]
+
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', 'Europe/Brussels')
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', 10000))
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', 6 * 3600))
+
+# The plan day starts at 05:00, so the small hours still belong to the previous Evening.
+DAY_START_HOUR = 5
+
+SESSION_EVICTIONS = REGISTRY.counter(
+    "daybyday_session_evictions_total",
+    "Orchestrator sessions evicted, by reason.",
+    labelnames=("reason",),
+)
+
+
+def resolve_timezone(name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def period_index(hour: int) -> int:
+    """
+    Map an hour of the day to a period:
+    0: Morning (5:00 - 11:59)
+    1: Afternoon (12:00 - 17:59)
+    2: Evening (18:00 - 4:59)
+    """
+    if 5 <= hour < 12:
+        return 0
+    elif 12 <= hour < 18:
+        return 1
+    else:
+        return 2
+
+
+class UserSession:
+    """Plan progress of one user for their current plan day."""
+
+    __slots__ = ('user_id', 'timezone', 'plan_date', 'completed', 'last_seen')
+
+    def __init__(self, user_id: str, timezone: Optional[str] = None):
+        self.user_id = user_id
+        self.timezone = resolve_timezone(timezone)
+        self.plan_date = None
+        self.completed = ([], [], [])
+        self.last_seen = time.monotonic()
+
+    def now(self) -> datetime:
+        return datetime.now(self.timezone)
+
+    def current_step(self) -> int:
+        """Current period in the user's timezone, resetting progress when a new plan day starts."""
+        now = self.now()
+        plan_date = (now - timedelta(hours=DAY_START_HOUR)).date()
+        if plan_date != self.plan_date:
+            self.plan_date = plan_date
+            self.completed = ([], [], [])
+        return period_index(now.hour)
+
+    def mark_completed(self, activity: str, step: int) -> bool:
+        if activity in self.completed[step]:
+            return False
+        self.completed[step].append(activity)
+        return True
+
+    def completed_for(self, step: int) -> List[str]:
+        return self.completed[step]
+
+
+class SessionManager:
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, timezone: Optional[str] = None) -> UserSession:
+        """Get (or create) the user's session and mark it as recently used."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = self._sessions[user_id] = UserSession(user_id, timezone)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    SESSION_EVICTIONS.inc(reason="capacity")
+            else:
+                self._sessions.move_to_end(user_id)
+                if timezone:
+                    session.timezone = resolve_timezone(timezone)
+            session.last_seen = now
+            return session
+
+    def _evict_expired(self, now: float) -> None:
+        # The map is kept in last-use order, so idle sessions sit at the front.
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_seen < self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            SESSION_EVICTIONS.inc(reason="idle")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,93 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+While a call for a key is running, further calls with the same key don't
+start their own upstream request: they wait for the running one and get a
+copy of its result (or its exception). Once the call finishes the key is
+forgotten, so this is not a cache, only deduplication of concurrent work.
+
+The shared result lives in a `concurrent.futures.Future`, so callers can be
+on different threads or different event loops (Flask runs every async view
+in its own loop).
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from .metrics import REGISTRY
+
+COALESCED_CALLS = REGISTRY.counter(
+    "daybyday_coalesced_calls_total",
+    "Calls that shared an identical in-flight call instead of making their own.",
+    labelnames=("flight",),
+)
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable key for call arguments (dicts are compared by content)."""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        """
+        Args:
+            name (str): Label of the coalesced-calls metric, e.g. "tts".
+        """
+        self.name = name
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        """The in-flight future for the key and whether the caller has to run the call."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                COALESCED_CALLS.inc(flight=self.name)
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _finish(self, key: str, future: Future, result: Any = None, error: BaseException = None) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs), or wait for the identical call already running."""
+        future, leader = self._join(key)
+        if not leader:
+            return copy.deepcopy(future.result())
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key: str, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Await fn(*args, **kwargs), or wait for the identical call already running."""
+        future, leader = self._join(key)
+        if not leader:
+            return copy.deepcopy(await asyncio.wrap_future(future))
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            # Only the caller that ran the call went away; don't cancel the others.
+            self._finish(key, future, error=RuntimeError(f"{self.name}: shared call was cancelled"))
+            raise
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
@@ -1,7 +1,91 @@
 import requests
 import os
-from typing import Optional
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
 from pathlib import Path
+from ..admission import ELEVENLABS
+from ..metrics import REGISTRY, timed
+from ..singleflight import SingleFlight, fingerprint
+from .mp3 import audio_frames
+
+# Sentences of one text synthesized at the same time
+TTS_MAX_PARALLEL = int(os.getenv('TTS_MAX_PARALLEL', 3))
+# Synthesized sentences kept in memory, in bytes of MP3
+TTS_CACHE_MAX_BYTES = int(os.getenv('TTS_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# ElevenLabs output formats by requested quality; low suits mobile data (~4x smaller than high)
+OUTPUT_FORMATS = {
+    "high": "mp3_44100_128",
+    "medium": "mp3_44100_64",
+    "low": "mp3_22050_32",
+}
+DEFAULT_OUTPUT_FORMAT = OUTPUT_FORMATS["high"]
+DEFAULT_VOICE_ID = "pNInz6obpgDQGcFmaJgB"  # Adam (more energetic voice)
+DEFAULT_MODEL_ID = "eleven_monolingual_v1"
+VOICE_SETTINGS = {
+    "stability": 0.35,  # Lower stability for more expressiveness
+    "similarity_boost": 0.75,  # Higher similarity boost for more character
+    "style": 0.85,  # Added style parameter for more excitement
+    "use_speaker_boost": True  # Enable speaker boost for clearer voice
+}
+
+# Identical sentences requested at the same time are synthesized once
+TTS_FLIGHT = SingleFlight("tts")
+
+TTS_SENTENCE_CACHE = REGISTRY.counter(
+    "daybyday_tts_sentence_cache_requests_total",
+    "Sentence audio cache lookups, by result.",
+    labelnames=("result",),
+)
+
+# A sentence ends at . ! ? or an ellipsis followed by whitespace and not a lowercase word, or at a line break
+_SENTENCE_END = re.compile(r"(?<=[.!?\u2026])[ \t]+(?![a-z])|\s*\n+\s*")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences; fragments without letters (e.g. emoji) stay with the previous one."""
+    sentences = []
+    for part in _SENTENCE_END.split(text.strip()):
+        part = part.strip()
+        if not part:
+            continue
+        if sentences and not any(c.isalnum() for c in part):
+            sentences[-1] += " " + part
+        else:
+            sentences.append(part)
+    return sentences
+
+
+class SentenceCache:
+    """LRU of synthesized sentence audio keyed by content hash, capped in bytes."""
+
+    def __init__(self, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+        TTS_SENTENCE_CACHE.inc(result="hit" if audio is not None else "miss")
+        return audio
+
+    def put(self, key: str, audio: bytes) -> None:
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = audio
+            self._size += len(audio)
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
 
 class ElevenLabsAPI:
     def __init__(self, api_key: Optional[str] = None):
@@ -21,13 +105,16 @@ class ElevenLabsAPI:
             "xi-api-key": self.api_key,
             "Content-Type": "application/json"
         }
+        self.sentence_cache = SentenceCache()
+        self._executor = ThreadPoolExecutor(max_workers=TTS_MAX_PARALLEL, thread_name_prefix="tts")
 
     def text_to_speech(
         self,
         text: str,
-        voice_id: str = "pNInz6obpgDQGcFmaJgB",  # Changed to Adam (more energetic voice)
-        model_id: str = "eleven_monolingual_v1",
-        output_path: Optional[str] = None
+        voice_id: str = DEFAULT_VOICE_ID,
+        model_id: str = DEFAULT_MODEL_ID,
+        output_path: Optional[str] = None,
+        output_format: str = DEFAULT_OUTPUT_FORMAT
     ) -> bytes:
         """Convert text to speech using the specified voice.
         
@@ -36,30 +123,74 @@ class ElevenLabsAPI:
             voice_id (str): The ID of the voice to use
             model_id (str): The ID of the model to use
             output_path (str, optional): Path to save the audio file. If not provided, returns bytes.
+            output_format (str): ElevenLabs output format, one of OUTPUT_FORMATS
         
         Returns:
             bytes: The audio data if output_path is not provided
         """
-        url = f"{self.base_url}/text-to-speech/{voice_id}"
-        
-        data = {
-            "text": text,
-            "model_id": model_id,
-            "voice_settings": {
-                "stability": 0.35,  # Lower stability for more expressiveness
-                "similarity_boost": 0.75,  # Higher similarity boost for more character
-                "style": 0.85,  # Added style parameter for more excitement
-                "use_speaker_boost": True  # Enable speaker boost for clearer voice
-            }
-        }
-
-        response = requests.post(url, json=data, headers=self.headers)
-        response.raise_for_status()
+        audio = b"".join(self.stream_speech(text, voice_id, model_id, output_format))
 
         if output_path:
-            Path(output_path).write_bytes(response.content)
+            Path(output_path).write_bytes(audio)
             return None
         
+        return audio
+
+    def stream_speech(
+        self,
+        text: str,
+        voice_id: str = DEFAULT_VOICE_ID,
+        model_id: str = DEFAULT_MODEL_ID,
+        output_format: str = DEFAULT_OUTPUT_FORMAT
+    ) -> Iterator[bytes]:
+        """Synthesize text sentence by sentence and yield the MP3 audio in order.
+
+        Up to TTS_MAX_PARALLEL sentences are synthesized at once, each sentence
+        is cached by content hash, and the first sentence is yielded as soon as
+        it is ready, so playback can start before the rest is done. The chunks
+        concatenate into a single MP3 stream.
+        """
+        futures = [self._executor.submit(self._sentence_audio, sentence, voice_id, model_id, output_format)
+                   for sentence in split_sentences(text)]
+        try:
+            for future in futures:
+                yield audio_frames(future.result())
+        finally:
+            # The client went away or a sentence failed, don't synthesize the rest
+            for future in futures:
+                future.cancel()
+
+    def speech_key(
+        self,
+        text: str,
+        voice_id: str = DEFAULT_VOICE_ID,
+        model_id: str = DEFAULT_MODEL_ID,
+        output_format: str = DEFAULT_OUTPUT_FORMAT
+    ) -> str:
+        """Content hash of the audio stream_speech() produces, known before synthesizing it."""
+        return fingerprint(*(self._sentence_key(sentence, voice_id, model_id, output_format)
+                             for sentence in split_sentences(text)))
+
+    @staticmethod
+    def _sentence_request(sentence: str, model_id: str) -> dict:
+        return {"text": sentence, "model_id": model_id, "voice_settings": VOICE_SETTINGS}
+
+    def _sentence_key(self, sentence: str, voice_id: str, model_id: str, output_format: str) -> str:
+        return fingerprint(voice_id, output_format, self._sentence_request(sentence, model_id))
+
+    def _sentence_audio(self, sentence: str, voice_id: str, model_id: str, output_format: str) -> bytes:
+        key = self._sentence_key(sentence, voice_id, model_id, output_format)
+        audio = self.sentence_cache.get(key)
+        if audio is None:
+            url = f"{self.base_url}/text-to-speech/{voice_id}?output_format={output_format}"
+            audio = TTS_FLIGHT.do(key, self._synthesize, url, self._sentence_request(sentence, model_id))
+            self.sentence_cache.put(key, audio)
+        return audio
+
+    def _synthesize(self, url: str, data: dict) -> bytes:
+        with ELEVENLABS.admit(), timed("tts_synthesis"):
+            response = requests.post(url, json=data, headers=self.headers)
+            response.raise_for_status()
         return response.content
 
     def get_voice_settings(self, voice_id: str) -> dict:
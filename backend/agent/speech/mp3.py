@@ -0,0 +1,62 @@
+"""
+Just enough MP3 parsing to stitch separately synthesized clips together.
+
+Each ElevenLabs clip is a complete file: an optional ID3v2 tag, an optional
+Xing/Info frame describing the length of that clip only, the audio frames,
+and an optional ID3v1 tag. Concatenating the plain audio frames of every
+clip gives one valid stream that players read front to back.
+"""
+
+from typing import Optional
+
+# Bitrates in kbps by (MPEG-1?, index) for Layer III
+_BITRATES = {
+    True: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    False: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by version bits (0 = MPEG-2.5, 2 = MPEG-2, 3 = MPEG-1)
+_SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+
+
+def _skip_id3v2(data: bytes) -> int:
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def frame_length(header: bytes) -> Optional[int]:
+    """Length in bytes of the Layer III frame starting with this 4-byte header, None if it isn't one."""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _BITRATES[mpeg1][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 0x01
+    return (144 if mpeg1 else 72) * bitrate // sample_rate + padding
+
+
+def audio_frames(data: bytes) -> bytes:
+    """The audio frames of an MP3 file, without ID3 tags and Xing/Info frame.
+
+    Data that doesn't parse as Layer III is returned unchanged.
+    """
+    start = _skip_id3v2(data)
+    end = len(data) - 128 if data[-128:-125] == b"TAG" else len(data)
+    # Skip to the first frame sync
+    while start < end - 4 and frame_length(data[start:start + 4]) is None:
+        start += 1
+    length = frame_length(data[start:start + 4])
+    if length is None:
+        return data
+    first = data[start:start + length]
+    if b"Xing" in first[:64] or b"Info" in first[:64] or b"VBRI" in first[:64]:
+        start += length
+    return data[start:end]
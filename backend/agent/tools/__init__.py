@@ -2,6 +2,17 @@
 Tools package for various utility functions used by the agents.
 """
 
-from .weather import get_weather
+from importlib import import_module
 
-__all__ = ['get_weather'] 
\ No newline at end of file
+_LAZY_ATTRIBUTES = {'get_weather': '.weather'}
+
+__all__ = ['get_weather']
+
+
+def __getattr__(name):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
@@ -1,18 +1,13 @@
 import os
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-
-# Load environment variables
-load_dotenv()
 
 # OAuth 2.0 Scopes (calendar read or read/write)
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 
 
 def authenticate_calendar():
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
 
     # Create the flow using client ID/secret from .env
@@ -36,6 +31,8 @@ def authenticate_calendar():
 
 
 def get_today_events():
+    from googleapiclient.discovery import build
+
     creds = authenticate_calendar()
     service = build('calendar', 'v3', credentials=creds)
 
@@ -0,0 +1,41 @@
+"""
+Minimal geohash encoding, used to quantize user locations into cache cells.
+
+At precision 6 a cell is about 1.2 x 0.6 km, at 7 about 150 x 150 m.
+"""
+
+from typing import Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode(latitude: float, longitude: float, precision: int = 7) -> Tuple[str, Tuple[float, float], Tuple[float, float]]:
+    """Geohash of a coordinate.
+
+    Returns:
+        (geohash, (centre lat, centre lon), (half height, half width) in degrees) of the cell.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    centre = ((lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2)
+    half = ((lat_range[1] - lat_range[0]) / 2, (lon_range[1] - lon_range[0]) / 2)
+    return "".join(chars), centre, half
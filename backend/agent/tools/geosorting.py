@@ -1,15 +1,189 @@
 import json
 import os
-from geopy.distance import geodesic
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+from ..metrics import REGISTRY, timed
+from . import geohash, poi_store
+from .poi_filters import TagIndex
+from .geo import haversine_m
+from .walking_graph import WALKING_SPEED_M_PER_MIN, get_walking_graph
+
+DATASET_DIR = "data/maps_dataset"
+# Written by datasets/data_loader.py after every refresh:
+# {"version": ..., "updated": ..., "categories": {category: content hash}}
+DATASET_VERSION_PATH = "data/maps_dataset_version.json"
+
+# Groenplaats, used when the user's location is unknown
+DEFAULT_LOCATION = (51.2206, 4.4024)
+
+# Rankings are cached per (category, geohash cell); precision 7 cells are about 150 x 150 m
+GEOHASH_PRECISION = int(os.getenv('GEOHASH_PRECISION', 7))
+MAX_CACHED_RANKINGS = 2048
+# How many of a cell's nearest places are re-ranked exactly for the user's own position
+RERANK_TOP_N = 50
+
+# How many of the nearest places (by straight line) get re-ranked by walking time
+WALKING_RANK_TOP_N = 10
+
+# Places whose visit weight (see agent/visited_places.py) reaches this are left out...
+VISITED_EXCLUDE_WEIGHT = 0.5
+# ...lighter ones count as this much further away per unit of weight.
+VISITED_PENALTY_KM = 1.0
+
+RANKING_CACHE_REQUESTS = REGISTRY.counter(
+    "daybyday_geosort_cache_requests_total",
+    "Lookups of cached per-cell rankings, by result (hit or miss).",
+    labelnames=("result",),
+)
+
+_rankings = OrderedDict()
+_rankings_lock = threading.Lock()
+
+_version_stamp = (None, {})  # (mtime of the version file, its contents)
+_version_lock = threading.Lock()
+
+def dataset_version(category=None):
+    """Version stamp of one category's data, or of all datasets when category is None.
+
+    Caches keyed by it are invalidated by a dataset refresh without a restart;
+    None until data_loader.py has stamped the datasets.
+    """
+    global _version_stamp
+    try:
+        mtime = os.stat(DATASET_VERSION_PATH).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime != _version_stamp[0]:
+        with _version_lock:
+            if mtime != _version_stamp[0]:
+                stamp = {}
+                if mtime is not None:
+                    try:
+                        with open(DATASET_VERSION_PATH, "r", encoding="utf-8") as f:
+                            stamp = json.load(f)
+                    except (OSError, ValueError) as e:
+                        print(f"Error reading dataset version: {e}")
+                _version_stamp = (mtime, stamp)
+    stamp = _version_stamp[1]
+    if category is None:
+        return stamp.get('version')
+    return stamp.get('categories', {}).get(category)
 
 def load_dataset(category):
-    path = f"data/maps_dataset/{category}.json"
+    path = os.path.join(DATASET_DIR, f"{category}.json")
     if not os.path.exists(path):
         raise FileNotFoundError(f"No dataset found for category: {category}")
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
+def _category_arrays(category):
+    """A category's places, their coordinates as arrays and their tag bitmaps, loaded once per version.
+
+    With POI_INDEX_SHARED=1 they come from the shared memory-mapped segment when it is up to date.
+    """
+    version = dataset_version(category)
+    if poi_store.POI_INDEX_SHARED:
+        shared = poi_store.category_arrays(category, version)
+        if shared is not None:
+            return shared
+    return _load_category_arrays(category, version)
+
+@lru_cache(maxsize=128)
+def _load_category_arrays(category, version):
+    locations = []
+    tags = []
+    for loc in load_dataset(category):
+        try:
+            loc['lat'], loc['lon'] = float(loc['lat']), float(loc['lon'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        locations.append(loc)
+        try:
+            tags.append(json.loads(loc.get('tags', '{}')))
+        except ValueError:
+            tags.append({})
+    lat = np.array([loc['lat'] for loc in locations], dtype=float)
+    lon = np.array([loc['lon'] for loc in locations], dtype=float)
+    return locations, lat, lon, TagIndex(tags, len(locations))
+
+def _cell_ranking(category, cell, centre):
+    """Place indices of a category sorted by distance from a cell centre, and those distances in km."""
+    key = (category, dataset_version(category), cell)
+    with _rankings_lock:
+        ranking = _rankings.get(key)
+        if ranking is not None:
+            _rankings.move_to_end(key)
+            RANKING_CACHE_REQUESTS.inc(result="hit")
+            return ranking
+    RANKING_CACHE_REQUESTS.inc(result="miss")
+    _, lat, lon, _ = _category_arrays(category)
+    distances = haversine_m(centre[0], centre[1], lat, lon) / 1000
+    order = np.argsort(distances, kind='stable')
+    ranking = (order, distances[order])
+    with _rankings_lock:
+        _rankings[key] = ranking
+        while len(_rankings) > MAX_CACHED_RANKINGS:
+            _rankings.popitem(last=False)
+    return ranking
+
+def rank_places(category, user_location, limit=None, mask=None, precision=GEOHASH_PRECISION):
+    """Places of a category nearest first, as copies carrying distance_km from the user.
+
+    The full sort is done once per geohash cell (from its centre) and shared by
+    everyone in the cell; each call only re-ranks the head of that order for
+    the user's exact position. The user is at most `radius` from the centre,
+    so every place of the true top RERANK_TOP_N lies within the N-th centre
+    distance + 2 * radius. Places past that cut keep the cell order.
+
+    Args:
+        category (str): Dataset name.
+        user_location (tuple): (lat, lon) of the user.
+        limit (int, optional): Only return this many places.
+        mask (np.ndarray, optional): Boolean mask over the category (see place_mask);
+            only matching places are ranked.
+        precision (int): Geohash precision of the cache cells.
+    """
+    locations, lat, lon, _ = _category_arrays(category)
+    if not locations:
+        return []
+    cell, centre, half = geohash.encode(user_location[0], user_location[1], precision)
+    order, centre_km = _cell_ranking(category, cell, centre)
+    if mask is not None:
+        keep = mask[order]
+        order, centre_km = order[keep], centre_km[keep]
+        if len(order) == 0:
+            return []
+
+    radius = haversine_m(centre[0], centre[1], centre[0] + half[0], centre[1] + half[1]) / 1000
+    k = min(RERANK_TOP_N, len(order))
+    cut = int(np.searchsorted(centre_km, centre_km[k - 1] + 2 * radius, side='right'))
+    head = order[:cut]
+    head_km = haversine_m(user_location[0], user_location[1], lat[head], lon[head]) / 1000
+    head_order = np.argsort(head_km, kind='stable')
+    indices = list(head[head_order])
+    distances = list(head_km[head_order])
+    if limit is None or limit > len(indices):
+        tail = order[cut:] if limit is None else order[cut:cut + limit - len(indices)]
+        indices.extend(tail)
+        distances.extend(haversine_m(user_location[0], user_location[1], lat[tail], lon[tail]) / 1000)
+    return [{**locations[i], 'distance_km': float(km)} for i, km in zip(indices[:limit], distances[:limit])]
+
+def place_mask(category, place_filter=None, weather_category=None):
+    """Bitmap of the category's places that pass the filter expression and the weather rule.
+
+    Returns:
+        np.ndarray or None: None when nothing is filtered out.
+
+    Raises:
+        ValueError: If the filter expression is invalid.
+    """
+    return _category_arrays(category)[3].mask(place_filter, weather_category)
+
 def sort_locations_by_distance(locations, user_location):
+    from geopy.distance import geodesic
+
     result = []
     for loc in locations:
         try:
@@ -21,6 +195,45 @@ def sort_locations_by_distance(locations, user_location):
             continue
     return sorted(result, key=lambda x: x['distance_km'])
 
+def filter_visited(sorted_locations, visited):
+    """Drop places the user has just been to and push down the ones visited a while ago.
+
+    Args:
+        sorted_locations (list): Places sorted by distance.
+        visited (VisitedIndex): The user's visited-place index.
+    """
+    weights = visited.location_weights()
+    if not weights:
+        return sorted_locations
+    kept = []
+    for loc in sorted_locations:
+        weight = weights.get(str(loc.get('id')), 0.0)
+        if weight >= VISITED_EXCLUDE_WEIGHT:
+            continue
+        if weight > 0:
+            loc['visited_weight'] = weight
+        kept.append(loc)
+    if not kept:
+        # Every place has been visited lately; a repeat beats no suggestion.
+        return sorted_locations
+    kept.sort(key=lambda x: x['distance_km'] + VISITED_PENALTY_KM * x.get('visited_weight', 0.0))
+    return kept
+
+def rank_by_walking_time(sorted_locations, user_location, top_n=WALKING_RANK_TOP_N):
+    """Re-rank the nearest places by walking minutes over the street network, if the graph is built."""
+    graph = get_walking_graph()
+    if graph is None or not sorted_locations:
+        return sorted_locations
+    head = sorted_locations[:top_n]
+    minutes = graph.walking_minutes(user_location, [(loc['lat'], loc['lon']) for loc in head])
+    for loc, walking_minutes in zip(head, minutes):
+        loc['walking_minutes'] = walking_minutes
+    penalty_minutes = VISITED_PENALTY_KM * 1000 / WALKING_SPEED_M_PER_MIN
+    head.sort(key=lambda x: (x['walking_minutes'] is None,
+                             (x['walking_minutes'] or 0) + penalty_minutes * x.get('visited_weight', 0.0),
+                             x['distance_km']))
+    return head + sorted_locations[top_n:]
+
 def yes_no(tag_value):
     if not tag_value:
         return "Unknown"
@@ -41,7 +254,7 @@ def get_place_info(loc):
         opening_hours = "Opening hours not listed"
         internet = outdoor_seating = indoor_seating = wheelchair = "Unknown"
 
-    return {
+    info = {
         'id': loc.get('id'),
         'name': name,
         'distance_km': round(loc.get('distance_km', 0.0), 3),
@@ -51,19 +264,44 @@ def get_place_info(loc):
         'indoor_seating': indoor_seating,
         'wheelchair_accessible': wheelchair
     }
+    if 'walking_minutes' in loc:
+        info['walking_minutes'] = loc['walking_minutes']
+    return info
+
 
+def main(category, visited=None, user_location=None, limit=None, place_filter=None, weather_category=None):
+    """Places of a category around the user, nearest first.
 
-def main(category):
-    long = 51.2206
-    lat = 4.4024
-    user_location = (long, lat)
+    Args:
+        category (str): Dataset name, e.g. "cafe".
+        visited (VisitedIndex, optional): If given, recently visited places are
+            left out or ranked lower.
+        user_location (tuple, optional): (lat, lon) of the user, Groenplaats if unknown.
+        limit (int, optional): Only return the nearest this many places.
+        place_filter (str, optional): Tag filter expression, see agent/tools/poi_filters.py.
+        weather_category (str, optional): sunny/raining/cloudy, for weather conditions
+            in the filter and the rainy-day rule.
+    """
+    user_location = tuple(user_location) if user_location else DEFAULT_LOCATION
 
     try:
-        locations = load_dataset(category)
-        sorted_places = sort_locations_by_distance(locations, user_location)
+        with timed("dataset_load"):
+            _category_arrays(category)
+        with timed("place_filter"):
+            mask = place_mask(category, place_filter, weather_category)
+        with timed("geosort"):
+            fetch = limit
+            if visited is not None and limit is not None:
+                # Leave room for the visited places filter_visited may drop.
+                fetch = limit + len(visited.location_weights())
+            sorted_places = rank_places(category, user_location, limit=fetch, mask=mask)
+            if visited is not None:
+                sorted_places = filter_visited(sorted_places, visited)
+        with timed("walking_route"):
+            sorted_places = rank_by_walking_time(sorted_places, user_location)
         structured_results = []
 
-        for place in sorted_places:
+        for place in sorted_places[:limit]:
             info = get_place_info(place)
             structured_results.append(info)
 
@@ -73,5 +311,5 @@ def main(category):
         return []
 
 if __name__ == "__main__":
-    results = main()
+    results = main("cafe", limit=10)
     print(json.dumps(results, indent=2, ensure_ascii=False))
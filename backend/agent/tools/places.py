@@ -0,0 +1,211 @@
+"""
+In-memory search index over every POI dataset, behind /api/places.
+
+All categories are loaded once into flat numpy arrays (coordinates, category
+code, OSM id) plus a lowercased search text per place, so a query is a few
+vectorized passes over ~3000 places. Results are sorted by distance from the
+user and paginated with a keyset cursor (distance, category, id of the last
+place returned), which stays valid when places are added or removed between
+pages.
+"""
+
+import base64
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..metrics import timed
+from . import poi_store
+from .geo import haversine_m
+from .geosorting import DATASET_DIR, _category_arrays, dataset_version
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 1000
+# Tags whose values are searched by the text query
+SEARCH_TAGS = ("name", "name:en", "name:nl", "brand", "cuisine", "historic")
+
+
+def dataset_categories() -> List[str]:
+    """Every category with a dataset file."""
+    return sorted(name[:-len(".json")] for name in os.listdir(DATASET_DIR) if name.endswith(".json"))
+
+
+def encode_cursor(distance_m: float, category: str, place_id: int) -> str:
+    payload = json.dumps([distance_m, category, place_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str, int]:
+    """Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        distance_m, category, place_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(distance_m), str(category), int(place_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+class PlaceIndex:
+    def __init__(self, categories: Sequence[str]):
+        """
+        Args:
+            categories (list): Dataset names to index.
+        """
+        self.categories = list(categories)
+        self.version = dataset_version()
+        # The shared segment the arrays are mapped from, None when loaded in this process
+        self.store = None
+        self._code = {category: code for code, category in enumerate(self.categories)}
+        self._places: List[Dict] = []
+        self._tag_indexes = []
+        lat, lon, codes, ids, search_text = [], [], [], [], []
+        for code, category in enumerate(self.categories):
+            locations, category_lat, category_lon, tag_index = _category_arrays(category)
+            self._tag_indexes.append(tag_index)
+            self._places.extend(locations)
+            lat.append(category_lat)
+            lon.append(category_lon)
+            codes.append(np.full(len(locations), code, dtype=np.int32))
+            for loc in locations:
+                ids.append(int(loc.get('id', 0)))
+                search_text.append(self._search_text(loc))
+        self.lat = np.concatenate(lat) if lat else np.zeros(0)
+        self.lon = np.concatenate(lon) if lon else np.zeros(0)
+        self.codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.int32)
+        self.ids = np.array(ids, dtype=np.int64)
+        self.search_text = np.array(search_text, dtype=str)
+
+    @classmethod
+    def from_store(cls, store: poi_store.PoiStore) -> 'PlaceIndex':
+        """An index whose arrays are views into the shared POI segment, nothing is copied."""
+        index = cls.__new__(cls)
+        index.categories = list(store.categories)
+        index.version = store.version
+        index.store = store
+        index._code = {category: code for code, category in enumerate(index.categories)}
+        index._places = poi_store.SharedLocations(store, 0, store.size)
+        index._tag_indexes = [store.category_arrays(category)[3] for category in index.categories]
+        index.lat, index.lon, index.codes, index.ids = store.lat, store.lon, store.codes, store.ids
+        index.search_text = store.search_text
+        return index
+
+    @staticmethod
+    def _search_text(loc: Dict) -> str:
+        try:
+            tags = json.loads(loc.get('tags', '{}'))
+        except ValueError:
+            tags = {}
+        return " ".join(str(tags[tag]) for tag in SEARCH_TAGS if tag in tags).lower()
+
+    def _selection(self, categories: Optional[Iterable[str]], text: Optional[str],
+                   place_filter: Optional[str]) -> np.ndarray:
+        keep = np.ones(len(self.ids), dtype=bool)
+        if categories is not None:
+            wanted = []
+            for category in categories:
+                if category not in self._code:
+                    raise ValueError(f"Unknown category: {category}")
+                wanted.append(self._code[category])
+            keep &= np.isin(self.codes, wanted)
+        if text:
+            keep &= np.char.find(self.search_text, text.lower()) >= 0
+        if place_filter:
+            masks = []
+            for tag_index in self._tag_indexes:
+                mask = tag_index.mask(place_filter)
+                masks.append(mask if mask is not None else np.ones(tag_index.size, dtype=bool))
+            keep &= np.concatenate(masks)
+        return keep
+
+    def search(self, user_location: Tuple[float, float], categories: Optional[Iterable[str]] = None,
+               radius_m: Optional[float] = None, text: Optional[str] = None,
+               place_filter: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+               cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of matching places, nearest first.
+
+        Args:
+            user_location (tuple): (lat, lon) distances are measured from.
+            categories (list, optional): Only these datasets; all by default.
+            radius_m (float, optional): Only places within this many metres.
+            text (str, optional): Case-insensitive substring of the name, brand or cuisine.
+            place_filter (str, optional): Tag filter expression (see poi_filters).
+            limit (int): Page size.
+            cursor (str, optional): next_cursor of the previous page.
+
+        Returns:
+            (places, next_cursor): next_cursor is None on the last page.
+
+        Raises:
+            ValueError: On an unknown category, an invalid filter or cursor.
+        """
+        with timed("places_search"):
+            keep = self._selection(categories, text, place_filter)
+            candidates = np.flatnonzero(keep)
+            distances = haversine_m(user_location[0], user_location[1],
+                                     self.lat[candidates], self.lon[candidates])
+            after = np.ones(len(candidates), dtype=bool)
+            if radius_m is not None:
+                after &= distances <= radius_m
+            if cursor:
+                last_m, last_category, last_id = decode_cursor(cursor)
+                last_code = self._code.get(last_category, -1)
+                codes, ids = self.codes[candidates], self.ids[candidates]
+                after &= ((distances > last_m)
+                          | ((distances == last_m)
+                             & ((codes > last_code) | ((codes == last_code) & (ids > last_id)))))
+            candidates, distances = candidates[after], distances[after]
+            # Only the page (plus one, to know if there is a next page) has to be in order;
+            # keep every tie at the cut so the (category, id) tiebreak stays exact
+            if len(candidates) > limit + 1:
+                cutoff = np.partition(distances, limit)[limit]
+                nearest = distances <= cutoff
+                candidates, distances = candidates[nearest], distances[nearest]
+            order = np.lexsort((self.ids[candidates], self.codes[candidates], distances))
+            page = order[:limit]
+            places = [self._place(candidates[i], distances[i]) for i in page]
+            next_cursor = None
+            if len(order) > limit and places:
+                last = places[-1]
+                next_cursor = encode_cursor(float(distances[page[-1]]), last['category'], last['id'])
+        return places, next_cursor
+
+    def _place(self, index: int, distance_m: float) -> Dict:
+        loc = self._places[index]
+        try:
+            tags = json.loads(loc.get('tags', '{}'))
+        except ValueError:
+            tags = {}
+        return {
+            'id': int(loc.get('id', 0)),
+            'category': self.categories[self.codes[index]],
+            'name': tags.get('name'),
+            'lat': loc['lat'],
+            'lon': loc['lon'],
+            'distance_m': round(float(distance_m), 1),
+            'tags': tags,
+        }
+
+
+_index: Optional[PlaceIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_place_index() -> PlaceIndex:
+    """The shared index over all datasets, built on first use and rebuilt when the datasets change."""
+    global _index
+    store = poi_store.current_store() if poi_store.POI_INDEX_SHARED else None
+    if store is not None and store.version == dataset_version():
+        if _index is None or _index.store is not store:
+            with _index_lock:
+                if _index is None or _index.store is not store:
+                    _index = PlaceIndex.from_store(store)
+        return _index
+    if _index is None or _index.store is not None or _index.version != dataset_version():
+        with _index_lock:
+            if _index is None or _index.store is not None or _index.version != dataset_version():
+                _index = PlaceIndex(dataset_categories())
+    return _index
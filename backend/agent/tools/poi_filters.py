@@ -0,0 +1,188 @@
+"""
+Bitmap tag indexes and filter expressions over the POI datasets.
+
+When a category is loaded, one boolean bitmap per (tag, value) is built for
+the amenity tags the planner cares about, e.g. wheelchair=yes or
+outdoor_seating=no. A filter expression is evaluated with bitwise
+operations on those bitmaps, and the resulting mask is applied before the
+distance ranking, so only matching places are ever ranked.
+
+Expression syntax (keywords are case-insensitive):
+    wheelchair                      tag is "yes"
+    wheelchair=limited              tag has that value
+    a AND b, a OR b, NOT a, ( ... )
+    a WHEN b                        a is required when b holds
+    a ONLY WHEN b                   places matching a are kept only when b holds
+    outdoor_only                    outdoor seating and no indoor seating
+    sunny, raining, cloudy          the current weather (get_weather_category)
+
+Examples: "indoor_seating AND wheelchair", "outdoor ONLY WHEN sunny".
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+INDEXED_TAGS = ("internet_access", "outdoor_seating", "indoor_seating", "wheelchair")
+ALIASES = {"outdoor": "outdoor_seating", "indoor": "indoor_seating", "wifi": "internet_access"}
+WEATHER_TERMS = ("sunny", "raining", "cloudy")
+# Values that also count as "yes" for the plain tag term
+YES_VALUES = {"internet_access": ("wlan", "wifi", "wired")}
+
+# Applied on top of every query: on rainy days, skip places that only have outdoor seating.
+# It is a preference, so it is dropped when nothing would be left.
+WEATHER_RULE = "NOT outdoor_only WHEN raining"
+
+_TOKEN = re.compile(r"\(|\)|[A-Za-z_:]+(?:=[A-Za-z0-9_:-]+)?")
+_KEYWORDS = {"AND", "OR", "NOT", "WHEN", "ONLY"}
+
+
+class TagIndex:
+    def __init__(self, tags: List[Dict], size: int):
+        """
+        Args:
+            tags (list): Parsed tag dict of every place, in dataset order.
+            size (int): Number of places.
+        """
+        self.size = size
+        self._bitmaps: Dict[Tuple[str, str], np.ndarray] = {}
+        for i, place_tags in enumerate(tags):
+            for tag in INDEXED_TAGS:
+                value = str(place_tags.get(tag, '')).lower()
+                if not value:
+                    continue
+                self._set(tag, value, i)
+                if value in YES_VALUES.get(tag, ()):
+                    self._set(tag, "yes", i)
+        self._bitmaps[("outdoor_only", "yes")] = (self.bitmap("outdoor_seating", "yes")
+                                                  & self.bitmap("indoor_seating", "no"))
+
+    @classmethod
+    def from_bitmaps(cls, bitmaps: Dict[Tuple[str, str], np.ndarray], size: int) -> 'TagIndex':
+        """An index over prebuilt bitmaps, e.g. views into the shared POI segment."""
+        index = cls.__new__(cls)
+        index.size = size
+        index._bitmaps = dict(bitmaps)
+        return index
+
+    def keys(self) -> List[Tuple[str, str]]:
+        """The (tag, value) pairs that have a bitmap."""
+        return list(self._bitmaps)
+
+    def _set(self, tag: str, value: str, i: int) -> None:
+        bitmap = self._bitmaps.get((tag, value))
+        if bitmap is None:
+            bitmap = self._bitmaps[(tag, value)] = np.zeros(self.size, dtype=bool)
+        bitmap[i] = True
+
+    def bitmap(self, tag: str, value: str = "yes") -> np.ndarray:
+        found = self._bitmaps.get((tag, value))
+        return found if found is not None else np.zeros(self.size, dtype=bool)
+
+    def mask(self, expression: Optional[str], weather_category: Optional[str] = None) -> Optional[np.ndarray]:
+        """Places matching the expression plus the weather rule, None if nothing filters anything."""
+        weather = self._evaluate(parse(WEATHER_RULE), weather_category)
+        if expression:
+            requested = self._evaluate(parse(expression), weather_category)
+            combined = requested & weather
+            return combined if combined.any() else requested
+        return weather if weather.any() and not weather.all() else None
+
+    def _evaluate(self, node, weather_category: Optional[str]) -> np.ndarray:
+        kind = node[0]
+        if kind == "term":
+            _, tag, value = node
+            if tag in WEATHER_TERMS:
+                return np.full(self.size, weather_category == tag)
+            return self.bitmap(tag, value)
+        if kind == "not":
+            return ~self._evaluate(node[1], weather_category)
+        left = self._evaluate(node[1], weather_category)
+        right = self._evaluate(node[2], weather_category)
+        if kind == "and":
+            return left & right
+        if kind == "or":
+            return left | right
+        if kind == "when":
+            return left | ~right
+        return ~left | right  # only_when
+
+
+@lru_cache(maxsize=256)
+def parse(expression: str):
+    """Parse a filter expression into a small tuple tree.
+
+    Raises:
+        ValueError: On a syntax error or an unknown tag.
+    """
+    tokens = _TOKEN.findall(expression)
+    if "".join(tokens).replace(" ", "") != re.sub(r"\s+", "", expression):
+        raise ValueError(f"Invalid characters in filter: {expression!r}")
+    position = 0
+
+    def peek():
+        return tokens[position].upper() if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def conditional():
+        node = disjunction()
+        if peek() == "ONLY":
+            take()
+            if peek() != "WHEN":
+                raise ValueError("Expected WHEN after ONLY")
+            take()
+            return ("only_when", node, disjunction())
+        if peek() == "WHEN":
+            take()
+            return ("when", node, disjunction())
+        return node
+
+    def disjunction():
+        node = conjunction()
+        while peek() == "OR":
+            take()
+            node = ("or", node, conjunction())
+        return node
+
+    def conjunction():
+        node = negation()
+        while peek() == "AND":
+            take()
+            node = ("and", node, negation())
+        return node
+
+    def negation():
+        if peek() == "NOT":
+            take()
+            return ("not", negation())
+        return atom()
+
+    def atom():
+        token = peek()
+        if token is None:
+            raise ValueError("Unexpected end of filter")
+        if token == "(":
+            take()
+            node = conditional()
+            if peek() != ")":
+                raise ValueError("Missing closing parenthesis")
+            take()
+            return node
+        if token == ")" or token in _KEYWORDS:
+            raise ValueError(f"Unexpected {take()!r} in filter")
+        tag, _, value = take().lower().partition("=")
+        tag = ALIASES.get(tag, tag)
+        if tag not in INDEXED_TAGS and tag not in WEATHER_TERMS and tag != "outdoor_only":
+            raise ValueError(f"Unknown filter tag: {tag}")
+        return ("term", tag, value or "yes")
+
+    node = conditional()
+    if position != len(tokens):
+        raise ValueError(f"Unexpected {tokens[position]!r} in filter")
+    return node
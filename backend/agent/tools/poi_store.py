@@ -0,0 +1,217 @@
+"""
+Shared, memory-mapped POI index for multi-worker deployments.
+
+Normally every worker process parses data/maps_dataset into its own Python
+objects. With POI_INDEX_SHARED=1, one builder process writes the parsed
+index once as plain .npy files (coordinates, ids, category offsets, tag
+bitmaps, search text, and the raw records as one byte blob), and every
+worker maps them read-only with np.load(mmap_mode='r'). The pages are shared
+through the OS page cache, so the data is held once no matter how many
+workers run, and a place is only decoded into a dict when a result needs it.
+
+Build (from backend/, after every dataset refresh):
+    python -m agent.tools.poi_store
+
+Each build goes to a new segment directory and the `current` symlink is
+swapped to it atomically. Workers notice the new target on their next
+lookup and re-attach; mappings of the old segment stay valid until dropped.
+A category whose dataset version stamp (see geosorting.dataset_version) no
+longer matches the segment is loaded privately until the next build.
+"""
+
+import json
+import logging
+import operator
+import os
+import shutil
+import threading
+import time
+from collections.abc import Sequence
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .poi_filters import TagIndex
+
+logger = logging.getLogger(__name__)
+
+POI_INDEX_SHARED = os.getenv('POI_INDEX_SHARED') == '1'
+POI_INDEX_DIR = os.getenv('POI_INDEX_DIR', 'data/poi_index')
+CURRENT_LINK = 'current'
+# Segments kept on disk, so workers still mapping the previous one aren't cut off
+KEEP_SEGMENTS = 2
+
+_ARRAYS = ('lat', 'lon', 'ids', 'codes', 'offsets', 'records', 'record_offsets', 'bitmaps', 'search_text')
+
+
+class SharedLocations(Sequence):
+    """Read-only list of place dicts, decoded from the segment on access."""
+
+    def __init__(self, store: 'PoiStore', start: int, end: int):
+        self._store = store
+        self._start = start
+        self._end = end
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = operator.index(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._store.record(self._start + i)
+
+
+class PoiStore:
+    def __init__(self, path: str):
+        """Attach to a built segment read-only.
+
+        Args:
+            path (str): Segment directory written by build().
+        """
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, 'manifest.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.version = manifest['version']
+        self.categories = manifest['categories']
+        self.category_versions = manifest['category_versions']
+        self.bitmap_keys = [tuple(key) for key in manifest['bitmap_keys']]
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r'))
+        self.size = len(self.ids)
+        self._code = {category: code for code, category in enumerate(self.categories)}
+        self._category_arrays: Dict[str, Tuple] = {}
+
+    def record(self, row: int) -> Dict:
+        start, end = self.record_offsets[row], self.record_offsets[row + 1]
+        return json.loads(self.records[start:end].tobytes())
+
+    def category_arrays(self, category: str) -> Tuple:
+        """Same shape as geosorting._category_arrays(), as views into the segment."""
+        arrays = self._category_arrays.get(category)
+        if arrays is None:
+            code = self._code[category]
+            start, end = int(self.offsets[code]), int(self.offsets[code + 1])
+            bitmaps = {key: self.bitmaps[k, start:end] for k, key in enumerate(self.bitmap_keys)}
+            arrays = self._category_arrays[category] = (
+                SharedLocations(self, start, end),
+                self.lat[start:end],
+                self.lon[start:end],
+                TagIndex.from_bitmaps(bitmaps, end - start),
+            )
+        return arrays
+
+
+_store: Optional[PoiStore] = None
+_store_lock = threading.Lock()
+
+
+def current_store(directory: str = POI_INDEX_DIR) -> Optional[PoiStore]:
+    """The segment `current` points at, re-attached after a swap; None if none was built."""
+    global _store
+    try:
+        target = os.readlink(os.path.join(directory, CURRENT_LINK))
+    except OSError:
+        return None
+    store = _store
+    if store is None or store.name != target:
+        with _store_lock:
+            if _store is None or _store.name != target:
+                try:
+                    _store = PoiStore(os.path.join(directory, target))
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning("Error attaching POI index %s: %s", target, e)
+                    return None
+            store = _store
+    return store
+
+
+def category_arrays(category: str, version: Optional[str]) -> Optional[Tuple]:
+    """A category's arrays from the shared segment, None if it is missing or out of date."""
+    store = current_store()
+    if store is None or category not in store.category_versions:
+        return None
+    if store.category_versions[category] != version:
+        return None
+    return store.category_arrays(category)
+
+
+def build(directory: str = POI_INDEX_DIR, keep: int = KEEP_SEGMENTS) -> str:
+    """Build a segment from data/maps_dataset and atomically point `current` at it.
+
+    Returns:
+        str: The new segment directory.
+    """
+    from .geosorting import _load_category_arrays, dataset_version
+    from .places import PlaceIndex, dataset_categories
+
+    categories = dataset_categories()
+    category_versions = {category: dataset_version(category) for category in categories}
+    lat, lon, ids, codes, offsets = [], [], [], [], [0]
+    records, record_offsets, search_text = [], [0], []
+    tag_indexes = []
+    for code, category in enumerate(categories):
+        locations, category_lat, category_lon, tag_index = _load_category_arrays(category, category_versions[category])
+        tag_indexes.append(tag_index)
+        lat.append(category_lat)
+        lon.append(category_lon)
+        codes.append(np.full(len(locations), code, dtype=np.int32))
+        for loc in locations:
+            ids.append(int(loc.get('id', 0)))
+            encoded = json.dumps(loc, ensure_ascii=False).encode('utf-8')
+            records.append(encoded)
+            record_offsets.append(record_offsets[-1] + len(encoded))
+            search_text.append(PlaceIndex._search_text(loc))
+        offsets.append(offsets[-1] + len(locations))
+
+    bitmap_keys = sorted({key for tag_index in tag_indexes for key in tag_index.keys()})
+    bitmaps = np.zeros((len(bitmap_keys), offsets[-1]), dtype=bool)
+    for k, key in enumerate(bitmap_keys):
+        bitmaps[k] = np.concatenate([tag_index.bitmap(*key) for tag_index in tag_indexes])
+
+    arrays = {
+        'lat': np.concatenate(lat), 'lon': np.concatenate(lon),
+        'ids': np.array(ids, dtype=np.int64), 'codes': np.concatenate(codes),
+        'offsets': np.array(offsets, dtype=np.int64),
+        'records': np.frombuffer(b''.join(records), dtype=np.uint8),
+        'record_offsets': np.array(record_offsets, dtype=np.int64),
+        'bitmaps': bitmaps,
+        'search_text': np.array(search_text, dtype=str),
+    }
+    version = dataset_version() or 'unstamped'
+    name = f"{version[:12]}-{time.time_ns()}"
+    path = os.path.join(directory, name)
+    os.makedirs(path)
+    for key, array in arrays.items():
+        np.save(os.path.join(path, f'{key}.npy'), array)
+    with open(os.path.join(path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': dataset_version(), 'categories': categories,
+                   'category_versions': category_versions,
+                   'bitmap_keys': [list(key) for key in bitmap_keys]}, f)
+
+    link = os.path.join(directory, f'.{CURRENT_LINK}-{os.getpid()}')
+    os.symlink(name, link)
+    os.replace(link, os.path.join(directory, CURRENT_LINK))
+    _prune(directory, keep)
+    return path
+
+
+def _prune(directory: str, keep: int) -> None:
+    current = os.readlink(os.path.join(directory, CURRENT_LINK))
+    segments = sorted((entry for entry in os.scandir(directory)
+                       if entry.is_dir(follow_symlinks=False)), key=lambda entry: entry.stat().st_mtime)
+    for entry in segments[:-keep]:
+        if entry.name != current:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    segment = build()
+    size = sum(entry.stat().st_size for entry in os.scandir(segment))
+    print(f"Built POI index {segment} ({size / 1e6:.1f} MB) in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,168 @@
+"""
+Offline walking-time engine over the OSM street network.
+
+The graph is built by `datasets/data_loader.py --walking-graph` into
+data/walking_graph.npz: junctions connected by contracted street segments,
+stored as CSR arrays, plus every original way node as a snap point. A
+one-to-many query snaps the user and the candidates onto the network and
+runs a single Dijkstra search from the user that stops as soon as every
+candidate is settled (or the walking-time limit is reached).
+"""
+
+import heapq
+import math
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .geo import haversine_m
+
+GRAPH_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'walking_graph.npz')
+
+WALKING_SPEED_M_PER_MIN = 5000 / 60  # 5 km/h
+
+# Snap grid cell size in degrees (roughly 110 m north-south in Antwerp)
+_CELL_DEG = 0.001
+
+
+class WalkingGraph:
+    def __init__(self, arrays):
+        self.lat = arrays['lat']
+        self.lon = arrays['lon']
+        self.snap_lat = arrays['snap_lat']
+        self.snap_lon = arrays['snap_lon']
+        self.snap_u = arrays['snap_u']
+        self.snap_v = arrays['snap_v']
+        self.snap_du = arrays['snap_du']
+        self.snap_dv = arrays['snap_dv']
+        # Plain lists are much faster than numpy scalars inside the Dijkstra loop.
+        self._indptr = arrays['indptr'].tolist()
+        self._indices = arrays['indices'].tolist()
+        self._weights = arrays['weights'].tolist()
+        self._build_snap_grid()
+
+    @classmethod
+    def load(cls, path: str = GRAPH_PATH) -> 'WalkingGraph':
+        with np.load(path) as data:
+            return cls({key: data[key] for key in data.files})
+
+    @property
+    def node_count(self) -> int:
+        return len(self._indptr) - 1
+
+    def _build_snap_grid(self) -> None:
+        """Bucket snap points by grid cell (sorted keys + offsets) for nearest-point lookups."""
+        keys = self._cell_keys(self.snap_lat, self.snap_lon)
+        self._snap_order = np.argsort(keys, kind='stable')
+        self._snap_keys = keys[self._snap_order]
+
+    @staticmethod
+    def _cell_keys(lat, lon):
+        rows = np.floor(np.asarray(lat) / _CELL_DEG).astype(np.int64)
+        cols = np.floor(np.asarray(lon) / _CELL_DEG).astype(np.int64)
+        return rows * 1_000_000 + cols
+
+    def snap(self, lat: float, lon: float, max_rings: int = 10) -> Optional[Tuple[int, int, float, float, float]]:
+        """Nearest snap point to a coordinate.
+
+        Returns:
+            (u, v, metres to u, metres to v, metres from the coordinate to the snap point),
+            or None if nothing is within max_rings grid cells.
+        """
+        row = math.floor(lat / _CELL_DEG)
+        col = math.floor(lon / _CELL_DEG)
+        for ring in range(max_rings + 1):
+            candidates = self._ring(row, col, ring)
+            if candidates:
+                # The next ring can still hold a closer point than the ones found so far.
+                candidates.extend(self._ring(row, col, ring + 1))
+                idx = np.concatenate(candidates)
+                distances = haversine_m(lat, lon, self.snap_lat[idx], self.snap_lon[idx])
+                nearest = int(np.argmin(distances))
+                best = idx[nearest]
+                return (int(self.snap_u[best]), int(self.snap_v[best]),
+                        float(self.snap_du[best]), float(self.snap_dv[best]), float(distances[nearest]))
+        return None
+
+    def _ring(self, row: int, col: int, ring: int) -> List[np.ndarray]:
+        """Snap point indices in the square ring of cells `ring` steps around (row, col)."""
+        found = []
+        for r in range(row - ring, row + ring + 1):
+            for c in range(col - ring, col + ring + 1):
+                if abs(r - row) != ring and abs(c - col) != ring:
+                    continue
+                key = r * 1_000_000 + c
+                lo = np.searchsorted(self._snap_keys, key, side='left')
+                hi = np.searchsorted(self._snap_keys, key, side='right')
+                if hi > lo:
+                    found.append(self._snap_order[lo:hi])
+        return found
+
+    def walking_minutes(self, origin: Tuple[float, float], destinations: Sequence[Tuple[float, float]],
+                        max_minutes: float = 60) -> List[Optional[float]]:
+        """Walking minutes from the origin to each destination (None if unreachable within max_minutes)."""
+        source = self.snap(*origin)
+        if source is None:
+            return [None] * len(destinations)
+        src_u, src_v, src_du, src_dv, src_off = source
+
+        best = [math.inf] * len(destinations)
+        # junction -> [(destination index, metres from the junction to the destination)]
+        targets = {}
+        for i, destination in enumerate(destinations):
+            snapped = self.snap(*destination)
+            if snapped is None:
+                continue
+            u, v, du, dv, off = snapped
+            if (u, v) == (src_u, src_v):
+                # Same street segment: walk straight along it.
+                best[i] = abs(du - src_du) + off
+            targets.setdefault(u, []).append((i, du + off))
+            targets.setdefault(v, []).append((i, dv + off))
+
+        limit = max_minutes * WALKING_SPEED_M_PER_MIN
+        dist = {src_u: src_du}
+        dist[src_v] = min(dist.get(src_v, math.inf), src_dv)
+        heap = [(d, node) for node, d in dist.items()]
+        heapq.heapify(heap)
+        pending = set(targets)
+        settled = set()
+        indptr, indices, weights = self._indptr, self._indices, self._weights
+        while heap and pending:
+            d, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            if d > limit:
+                break
+            settled.add(node)
+            if node in pending:
+                pending.discard(node)
+                for i, tail in targets[node]:
+                    best[i] = min(best[i], d + tail)
+            for k in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[k]
+                nd = d + weights[k]
+                if nd < dist.get(neighbour, math.inf):
+                    dist[neighbour] = nd
+                    heapq.heappush(heap, (nd, neighbour))
+
+        minutes = []
+        for metres in best:
+            total = metres + src_off
+            minutes.append(round(total / WALKING_SPEED_M_PER_MIN, 1) if total <= limit else None)
+        return minutes
+
+
+_graph = None
+_graph_loaded = False
+
+
+def get_walking_graph() -> Optional[WalkingGraph]:
+    """The process-wide walking graph, or None if data/walking_graph.npz has not been built."""
+    global _graph, _graph_loaded
+    if not _graph_loaded:
+        _graph_loaded = True
+        if os.path.exists(GRAPH_PATH):
+            _graph = WalkingGraph.load(GRAPH_PATH)
+    return _graph
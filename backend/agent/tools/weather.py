@@ -1,11 +1,24 @@
 import requests
-from dotenv import load_dotenv
 import os
-
-load_dotenv()
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from ..admission import OPENWEATHER, Overloaded
+from ..metrics import timed
+from ..singleflight import SingleFlight, fingerprint
 
 api_key = os.getenv('OPEN_WEATHER_API_KEY')
 
+# Antwerp; the planners use the weather of the city as a whole
+CITY_LOCATION = (51.2194, 4.4025)
+# Weather changes slowly, a fetched answer is reused for this long
+WEATHER_TTL_SECONDS = float(os.getenv('WEATHER_TTL_SECONDS', 600))
+
+WEATHER_FLIGHT = SingleFlight("weather")
+# fingerprint(lat, lon) -> (fetched at, weather); only a few fixed locations are asked for
+_weather_cache: Dict[str, Tuple[float, Dict]] = {}
+_weather_cache_lock = threading.Lock()
+
 #don't forget to pip install requests in terminal
 def get_city_name(latitude, longitude):
     # Reverse geocoding API URL to also get the name of the city you are in, thought it could be handy
@@ -16,7 +29,8 @@ def get_city_name(latitude, longitude):
         'appid': api_key
     }
 
-    response = requests.get(geocode_url, params=params)
+    with OPENWEATHER.admit():
+        response = requests.get(geocode_url, params=params)
     data = response.json()
 
     if response.status_code == 200:
@@ -28,7 +42,28 @@ def get_city_name(latitude, longitude):
         return None
 
 def get_weather(latitude, longitude):
-    
+    """Current weather, cached for WEATHER_TTL_SECONDS; concurrent misses share one fetch."""
+    key = fingerprint(latitude, longitude)
+    with _weather_cache_lock:
+        cached = _weather_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < WEATHER_TTL_SECONDS:
+        return dict(cached[1])
+    try:
+        weather = WEATHER_FLIGHT.do(key, _timed_fetch_weather, latitude, longitude)
+    except (requests.RequestException, Overloaded) as e:
+        # Plans are still made without the weather
+        print(f"Error fetching weather: {e}")
+        return {"error": str(e)}
+    if 'error' not in weather:
+        with _weather_cache_lock:
+            _weather_cache[key] = (time.monotonic(), dict(weather))
+    return weather
+
+def _timed_fetch_weather(latitude, longitude):
+    with timed("weather_fetch"):
+        return _fetch_weather(latitude, longitude)
+
+def _fetch_weather(latitude, longitude):
     base_url = "http://api.openweathermap.org/data/2.5/weather"
     params = {
         'lat': latitude,
@@ -37,7 +72,8 @@ def get_weather(latitude, longitude):
         'units': 'metric'  # metric means in Celsius
     }
 
-    response = requests.get(base_url, params=params)
+    with OPENWEATHER.admit():
+        response = requests.get(base_url, params=params)
     data = response.json()
 
     if response.status_code == 200:
@@ -55,7 +91,10 @@ def get_weather(latitude, longitude):
     else:
         print("Full API response:", data)
         return {"error": data.get("message", "Something went wrong, please try again.")}
-def get_weather_category(weather_json):
+def get_weather_category(weather_json) -> Optional[str]:
+    """sunny/raining/cloudy, None if the weather couldn't be fetched."""
+    if 'description' not in weather_json:
+        return None
     desc = weather_json['description'].lower()
 
     if any(word in desc for word in ['sun', 'clear']):
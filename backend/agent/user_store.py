@@ -0,0 +1,166 @@
+"""
+Per-user state store for preferences and push subscriptions.
+
+State lives in a single SQLite database in WAL mode, indexed by user id, so
+every change touches only that user's rows instead of rewriting a shared
+JSON file, and readers never block the writer. Activity history is kept in
+per-user JSON-lines shards (see `ActivityHistory`).
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+DEFAULT_USER_ID = "default"
+# What the API accepts as a user id
+USER_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS preferences (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    endpoint TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS subscriptions_user_id ON subscriptions (user_id);
+"""
+
+
+class UserStore:
+    def __init__(self, db_path: Optional[str] = None):
+        """Open (and if needed create) the user state database.
+
+        Args:
+            db_path (str, optional): Path of the SQLite file. Defaults to data/users.db.
+        """
+        self.db_path = db_path or os.path.join(DATA_DIR, 'users.db')
+        self._local = threading.local()
+        # executescript manages its own commit, so it runs outside transaction().
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Group writes into one atomic commit.
+
+        Nested calls join the outermost transaction, so callers can batch
+        several store operations into a single commit.
+        """
+        conn = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    # Preferences
+
+    def get_preferences(self, user_id: str) -> Dict[str, Any]:
+        row = self._connection().execute(
+            "SELECT data FROM preferences WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save_preferences(self, user_id: str, preferences: Dict[str, Any]) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO preferences (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = datetime('now')",
+                (user_id, json.dumps(preferences))
+            )
+
+    def iter_preferences(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (user_id, preferences) for every user with saved preferences."""
+        rows = self._connection().execute("SELECT user_id, data FROM preferences ORDER BY user_id").fetchall()
+        for user_id, data in rows:
+            yield user_id, json.loads(data)
+
+    # Push subscriptions
+
+    def add_subscription(self, user_id: str, subscription: Dict[str, Any]) -> None:
+        """Store a push subscription, re-assigning it if the endpoint is already known."""
+        endpoint = subscription.get('endpoint')
+        if not endpoint:
+            raise ValueError("Subscription has no endpoint")
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO subscriptions (endpoint, user_id, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(endpoint) DO UPDATE SET user_id = excluded.user_id, data = excluded.data",
+                (endpoint, user_id, json.dumps(subscription))
+            )
+
+    def remove_subscriptions(self, endpoints: List[str]) -> int:
+        """Remove subscriptions by endpoint in one commit. Returns the number removed."""
+        with self.transaction() as conn:
+            cursor = conn.executemany("DELETE FROM subscriptions WHERE endpoint = ?", [(e,) for e in endpoints])
+            return cursor.rowcount
+
+    def get_subscriptions(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get the subscriptions of one user, or of every user if none is given."""
+        conn = self._connection()
+        if user_id is None:
+            rows = conn.execute("SELECT data FROM subscriptions").fetchall()
+        else:
+            rows = conn.execute("SELECT data FROM subscriptions WHERE user_id = ?", (user_id,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def subscribed_user_ids(self) -> List[str]:
+        rows = self._connection().execute("SELECT DISTINCT user_id FROM subscriptions").fetchall()
+        return [row[0] for row in rows]
+
+    # Migration
+
+    def import_legacy_files(self, preferences_file: str, subscriptions_file: str,
+                            user_id: str = DEFAULT_USER_ID) -> None:
+        """Import the old single-user JSON files once, if the store has nothing for the user yet."""
+        with self.transaction():
+            try:
+                if os.path.exists(preferences_file) and not self.get_preferences(user_id):
+                    with open(preferences_file, 'r') as f:
+                        preferences = json.load(f)
+                    if preferences:
+                        self.save_preferences(user_id, preferences)
+                if os.path.exists(subscriptions_file) and not self.get_subscriptions(user_id):
+                    with open(subscriptions_file, 'r') as f:
+                        for subscription in json.load(f):
+                            self.add_subscription(user_id, subscription)
+            except (OSError, ValueError) as e:
+                logger.warning("Error importing legacy user state: %s", e)
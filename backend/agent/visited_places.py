@@ -0,0 +1,114 @@
+"""
+Index of the places and categories a user has visited, with decaying weights.
+
+Every visit adds 1 to the weight of its location_id and category, and
+weights halve every VISIT_HALF_LIFE_HOURS, so a place visited this morning
+weighs close to 1, one visited last week close to 0. The index is built once
+from the activity history and then updated on every new entry, and the
+geosorting query uses it to drop or push down places the user has just been to.
+"""
+
+import math
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+VISIT_HALF_LIFE_HOURS = float(os.getenv('VISIT_HALF_LIFE_HOURS', 72))
+
+# Weights below this are dropped from the index.
+_MIN_WEIGHT = 0.01
+
+
+def visit_of(entry: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """(location_id, category) of an activity history entry, either may be None.
+
+    `details` is the activity plan, or the planner result wrapping it in "result".
+    """
+    details = entry.get('details')
+    if isinstance(details, dict) and isinstance(details.get('result'), dict):
+        details = details['result']
+    if not isinstance(details, dict):
+        return None, None
+    location_id = details.get('location_id')
+    category = details.get('category')
+    return (str(location_id) if location_id not in (None, '') else None,
+            str(category) if category else None)
+
+
+def _timestamp(entry: Dict[str, Any]) -> float:
+    try:
+        return datetime.fromisoformat(entry['timestamp']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return datetime.now().timestamp()
+
+
+class _DecayedCounts:
+    """Per-key exponentially decayed counts, stored as (weight, as-of time)."""
+
+    def __init__(self, half_life_seconds: float):
+        self._rate = math.log(2) / half_life_seconds
+        self._counts: Dict[str, Tuple[float, float]] = {}
+
+    def _decayed(self, weight: float, as_of: float, now: float) -> float:
+        return weight * math.exp(-self._rate * max(now - as_of, 0.0))
+
+    def add(self, key: str, at: float) -> None:
+        weight, as_of = self._counts.get(key, (0.0, at))
+        if at >= as_of:
+            self._counts[key] = (self._decayed(weight, as_of, at) + 1.0, at)
+        else:
+            # Older than the stored state (out-of-order history): decay the visit instead.
+            self._counts[key] = (weight + self._decayed(1.0, at, as_of), as_of)
+
+    def weights(self, now: float) -> Dict[str, float]:
+        result = {}
+        for key, (weight, as_of) in list(self._counts.items()):
+            decayed = self._decayed(weight, as_of, now)
+            if decayed < _MIN_WEIGHT:
+                del self._counts[key]
+            else:
+                result[key] = decayed
+        return result
+
+
+class VisitedIndex:
+    def __init__(self, half_life_hours: float = VISIT_HALF_LIFE_HOURS):
+        self._locations = _DecayedCounts(half_life_hours * 3600)
+        self._categories = _DecayedCounts(half_life_hours * 3600)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Dict[str, Any]], **kwargs) -> 'VisitedIndex':
+        index = cls(**kwargs)
+        for entry in entries:
+            index.add(entry)
+        return index
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        """Record one activity history entry."""
+        location_id, category = visit_of(entry)
+        if location_id is None and category is None:
+            return
+        at = _timestamp(entry)
+        with self._lock:
+            if location_id is not None:
+                self._locations.add(location_id, at)
+            if category is not None:
+                self._categories.add(category, at)
+
+    def location_weights(self, now: Optional[float] = None) -> Dict[str, float]:
+        """location_id -> current visit weight, for places with a noticeable weight."""
+        with self._lock:
+            return self._locations.weights(now or datetime.now().timestamp())
+
+    def category_weights(self, now: Optional[float] = None) -> Dict[str, float]:
+        """category -> current visit weight."""
+        with self._lock:
+            return self._categories.weights(now or datetime.now().timestamp())
+
+    def frequent_categories(self, limit: int = 3, min_weight: float = 1.0) -> List[str]:
+        """The categories visited most lately, heaviest first."""
+        weights = self.category_weights()
+        ranked = sorted((c for c, w in weights.items() if w >= min_weight), key=weights.get, reverse=True)
+        return ranked[:limit]
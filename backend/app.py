@@ -1,25 +1,34 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request, send_file
 from flask_cors import CORS
+import hashlib
+import hmac
 import os
 import json
-from dotenv import load_dotenv
-from pywebpush import webpush, WebPushException
-from agent.speech.ElevenLabs import ElevenLabsAPI
+from agent.speech.ElevenLabs import ElevenLabsAPI, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
 from agent.orchestrator import OrchestratorAgent, TaskType
 from io import BytesIO
+from itertools import chain
 from asgiref.wsgi import WsgiToAsgi
-from agent.activity_history import ActivityHistory
-
-# Load environment variables
-load_dotenv()
+from agent.activity_history import history_for_user
+from agent.user_store import UserStore, DEFAULT_USER_ID, USER_ID_PATTERN
+from agent.notifications import PushDispatcher, PeriodNotifier
+from agent.scheduler import PlanPrewarmer
+from agent.metrics import render_prometheus
+from agent.admission import Overloaded
+from agent.tools.poi_filters import parse as parse_place_filter
+from agent.tools.geosorting import DEFAULT_LOCATION
+from agent.tools.places import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, get_place_index
+import request_profiling
+from agent.asgi_middleware import CompressionMiddleware, StaticResponses
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+request_profiling.init_app(app)  # Opt-in request profiling (PROFILE_SAMPLE_RATE / X-Profile header)
 
 # Initialize the orchestrator
 orchestrator = OrchestratorAgent()
 
-# These paths would be for persistent storage in production
+# Legacy single-user files, imported into the user store on first start
 SUBSCRIPTION_FILE = 'subscriptions.json'
 PREFERENCES_FILE = 'user_preferences.json'
 VAPID_PRIVATE_KEY_FILE = 'private_key.pem'
@@ -32,71 +41,39 @@ VAPID_CLAIMS = {
     "sub": "mailto:your-email@example.com"
 }
 
-# Simple in-memory storage for demo purposes
-subscriptions = []
+# User ids are taken as sent unless this is set; then each one needs its HMAC-SHA256 signature
+USER_ID_SECRET = os.getenv('USER_ID_SECRET')
 
-# Load existing subscriptions if file exists
-def load_subscriptions():
-    global subscriptions
-    try:
-        if os.path.exists(SUBSCRIPTION_FILE):
-            with open(SUBSCRIPTION_FILE, 'r') as f:
-                subscriptions = json.load(f)
-    except Exception as e:
-        print(f"Error loading subscriptions: {e}")
-
-# Save subscriptions to file
-def save_subscriptions():
-    try:
-        with open(SUBSCRIPTION_FILE, 'w') as f:
-            json.dump(subscriptions, f)
-    except Exception as e:
-        print(f"Error saving subscriptions: {e}")
+# Per-user preferences and push subscriptions
+user_store = UserStore()
+user_store.import_legacy_files(PREFERENCES_FILE, SUBSCRIPTION_FILE)
 
-# Load existing preferences if file exists
-def load_preferences():
-    try:
-        if os.path.exists(PREFERENCES_FILE):
-            with open(PREFERENCES_FILE, 'r') as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        print(f"Error loading preferences: {e}")
-        return {}
+# Web-push delivery; period reminders only run once real VAPID keys are configured
+push_dispatcher = PushDispatcher(
+    user_store,
+    VAPID_PRIVATE_KEY,
+    VAPID_CLAIMS,
+    max_workers=int(os.getenv('PUSH_MAX_WORKERS', 16))
+)
+period_notifier = PeriodNotifier(push_dispatcher, user_store)
+if os.getenv('VAPID_PRIVATE_KEY'):
+    period_notifier.start()
 
-# Save preferences to file
-def save_preferences(preferences):
-    try:
-        with open(PREFERENCES_FILE, 'w') as f:
-            json.dump(preferences, f)
-    except Exception as e:
-        print(f"Error saving preferences: {e}")
+# Generate each user's plans before they wake up (opt-in, it spends OpenAI quota)
+plan_prewarmer = PlanPrewarmer(orchestrator, user_store)
+if os.getenv('PREWARM_PLANS') == '1':
+    plan_prewarmer.start()
 
-# Load subscriptions and preferences on startup
-load_subscriptions()
-user_preferences = load_preferences()
+# Load every POI dataset now rather than on the first /api/places request
+get_place_index()
 
 # Initialize ElevenLabs API with development mode
 tts = ElevenLabsAPI()
 
-activity_history = ActivityHistory()
+# Audio is addressed by the hash of what was synthesized, so clients may keep it for a day
+AUDIO_MAX_AGE = int(os.getenv('AUDIO_MAX_AGE', 86400))
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    return jsonify({"status": "ok", "message": "API is running"})
-
-@app.route('/api/info', methods=['GET'])
-def get_info():
-    return jsonify({
-        "app": "Vue PWA with Flask Backend",
-        "version": "1.0.0",
-        "description": "A boilerplate for building Progressive Web Apps with Vue and Flask"
-    })
-
-@app.route('/api/welcome-audio', methods=['GET'])
-def get_welcome_audio():
-    try:
-        welcome_text = """
+WELCOME_TEXT = """
 Hey there, I'm Anty!
 your personal daily planner for the magical city of Antwerp! ✨
 
@@ -106,20 +83,161 @@ But first tell me a bit about your typical day, and I'll take care of the rest.
 
 Let's make your everyday... a little more interesting. 🚲✨
         """
-        
-        # Generate audio
-        audio_data = tts.text_to_speech(text=welcome_text)
-        
-        # Create a BytesIO object
-        audio_buffer = BytesIO(audio_data)
-        audio_buffer.seek(0)
-        
-        return send_file(
-            audio_buffer,
+
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    """Shed load with 503 + Retry-After when an upstream API has no capacity left."""
+    response = jsonify({"error": str(e), "provider": e.provider})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(e.retry_after + 0.5))
+    return response
+
+
+class InvalidUserId(Exception):
+    pass
+
+
+@app.errorhandler(InvalidUserId)
+def handle_invalid_user_id(e):
+    return jsonify({"error": str(e)}), 400
+
+
+def current_user_id() -> str:
+    """Identify the caller from the X-User-Id header or user_id query parameter.
+
+    There is no login: without USER_ID_SECRET any caller can act as any user id
+    it knows. With it, the id must come with X-User-Signature (or user_sig), the
+    hex HMAC-SHA256 of the id under that secret, as issued by whatever
+    authenticates the users in front of this API.
+
+    Raises:
+        InvalidUserId: If the id is malformed or its signature doesn't match.
+    """
+    user_id = request.headers.get('X-User-Id') or request.args.get('user_id')
+    if user_id is None:
+        return DEFAULT_USER_ID
+    if not USER_ID_PATTERN.match(user_id):
+        raise InvalidUserId("user_id must be 1-64 letters, digits, '-' or '_'")
+    if USER_ID_SECRET:
+        signature = request.headers.get('X-User-Signature') or request.args.get('user_sig') or ''
+        expected = hmac.new(USER_ID_SECRET.encode(), user_id.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(signature, expected):
+            raise InvalidUserId("user_id signature is missing or invalid")
+    return user_id
+
+
+def current_user_location():
+    """The caller's (lat, lon) from the lat/lon query parameters, None if not sent.
+
+    Raises:
+        ValueError: If they are not valid coordinates.
+    """
+    lat = request.args.get('lat')
+    lon = request.args.get('lon')
+    if lat is None and lon is None:
+        return None
+    location = (float(lat), float(lon))
+    if not (-90 <= location[0] <= 90 and -180 <= location[1] <= 180):
+        raise ValueError("lat/lon out of range")
+    return location
+
+
+# Fixed payloads, answered by the ASGI app from precomputed bytes without reaching Flask (see StaticResponses)
+STATIC_ROUTES = {
+    '/api/health': {"status": "ok", "message": "API is running"},
+    '/api/info': {
+        "app": "Vue PWA with Flask Backend",
+        "version": "1.0.0",
+        "description": "A boilerplate for building Progressive Web Apps with Vue and Flask"
+    },
+}
+
+
+@app.after_request
+def add_json_validators(response):
+    """ETag JSON reads and answer a matching If-None-Match with 304, so unchanged data isn't resent."""
+    if (request.method == 'GET' and response.status_code == 200 and response.is_json
+            and not response.is_streamed):
+        response.add_etag()
+        # Per-user data: the browser may keep it, but has to revalidate
+        if not response.cache_control.max_age:
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+        response.make_conditional(request)
+    return response
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def audio_output_format() -> str:
+    """ElevenLabs output format from the quality parameter, or low quality for Save-Data clients.
+
+    Raises:
+        ValueError: If quality is not one of OUTPUT_FORMATS.
+    """
+    quality = request.args.get('quality')
+    if quality is None:
+        return OUTPUT_FORMATS["low"] if request.headers.get('Save-Data') == 'on' else DEFAULT_OUTPUT_FORMAT
+    if quality not in OUTPUT_FORMATS:
+        raise ValueError(f"quality must be one of {', '.join(OUTPUT_FORMATS)}")
+    return OUTPUT_FORMATS[quality]
+
+
+def speech_response(text: str, filename: str, output_format: str):
+    """MP3 of the text with an ETag, 304 for a matching If-None-Match and 206 for Range requests.
+
+    The streamed answer is sent before synthesis finishes, so a failure halfway
+    would leave a truncated file; it is never cached. Only the complete file of
+    a Range request gets the ETag and the long max-age.
+    """
+    etag = tts.speech_key(text, output_format=output_format)
+    if request.range is None and not request.if_none_match.contains(etag):
+        # Stream the audio sentence by sentence, the first one plays while the rest is synthesized
+        chunks = tts.stream_speech(text, output_format=output_format)
+        # Synthesize the first sentence before answering, so errors still get a proper status
+        first = next(chunks, b"")
+        response = Response(
+            chain([first], chunks),
             mimetype='audio/mpeg',
-            as_attachment=False,
-            download_name='welcome.mp3'
+            headers={'Content-Disposition': f'inline; filename={filename}'}
         )
+        response.cache_control.no_store = True
+    else:
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            # Seeking needs the whole file; the sentences are cached by then, so this is cheap
+            audio_data = tts.text_to_speech(text=text, output_format=output_format)
+            response = send_file(
+                BytesIO(audio_data),
+                mimetype='audio/mpeg',
+                as_attachment=False,
+                download_name=filename,
+                etag=etag,
+                max_age=AUDIO_MAX_AGE,
+                conditional=True
+            )
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = AUDIO_MAX_AGE
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.vary.add('Save-Data')
+    return response
+
+
+@app.route('/api/welcome-audio', methods=['GET'])
+def get_welcome_audio():
+    try:
+        output_format = audio_output_format()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        return speech_response(WELCOME_TEXT, 'welcome.mp3', output_format)
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -127,22 +245,17 @@ Let's make your everyday... a little more interesting. 🚲✨
 @app.route('/api/read-text', methods=['GET'])
 def read_text():
     text = request.args.get('text')
-    # Generate audio
-    audio_data = tts.text_to_speech(text=text)
-        
-        # Create a BytesIO object
-    audio_buffer = BytesIO(audio_data)
-    audio_buffer.seek(0)
-        
-    return send_file(
-        audio_buffer,
-        mimetype='audio/mpeg',
-        as_attachment=False,
-        download_name='welcome.mp3'
-    )
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    try:
+        output_format = audio_output_format()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return speech_response(text, 'welcome.mp3', output_format)
 
 @app.route('/api/preferences', methods=['POST'])
 async def save_user_preferences():
+    user_id = current_user_id()
     try:
         preferences = request.json
         if not preferences:
@@ -161,12 +274,13 @@ async def save_user_preferences():
                 return jsonify({"error": f"Missing required schedule field: {field}"}), 400
             
         # Save preferences
-        save_preferences(preferences)
+        user_store.save_preferences(user_id, preferences)
         
         # Get daily plan using the orchestrator
-        daily_planner_result = await orchestrator.delegate_task(
-            TaskType.DAILY_PLANNER,
-            user_preferences=preferences
+        daily_planner_result = await orchestrator.get_daily_plan(
+            preferences,
+            user_id=user_id,
+            timezone=request.headers.get('X-Timezone') or preferences.get('timezone')
         )
         
         if daily_planner_result['status'] == 'error':
@@ -177,27 +291,140 @@ async def save_user_preferences():
             "daily_plan": daily_planner_result['result']
         })
         
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/preferences', methods=['GET'])
 def get_user_preferences():
-    return jsonify(user_preferences)
+    return jsonify(user_store.get_preferences(current_user_id()))
+
+@app.route('/api/vapid-public-key', methods=['GET'])
+def get_vapid_public_key():
+    return jsonify({"publicKey": VAPID_PUBLIC_KEY})
+
+@app.route('/api/notifications/subscribe', methods=['POST'])
+def subscribe():
+    subscription = (request.json or {}).get('subscription')
+    if not subscription or not subscription.get('endpoint'):
+        return jsonify({"error": "Missing subscription"}), 400
+    user_store.add_subscription(current_user_id(), subscription)
+    return jsonify({"success": True})
+
+@app.route('/api/notifications/unsubscribe', methods=['POST'])
+def unsubscribe():
+    subscription = (request.json or {}).get('subscription')
+    if not subscription or not subscription.get('endpoint'):
+        return jsonify({"error": "Missing subscription"}), 400
+    user_store.remove_subscriptions([subscription['endpoint']])
+    return jsonify({"success": True})
+
+@app.route('/api/notifications/send', methods=['POST'])
+def send_notification():
+    data = request.json or {}
+    if not data.get('title'):
+        return jsonify({"error": "Missing title"}), 400
+    payload = {"title": data['title'], "body": data.get('body', ''), "url": data.get('url', '/')}
+    counts = push_dispatcher.send_to_user(current_user_id(), payload)
+    return jsonify({"success": counts['sent'] > 0, **counts})
 
 
 @app.route('/api/agent/get-activity', methods=['GET'])
 async def get_activity():
-    daily_planner_result = await orchestrator.delegate_task(
-            TaskType.DAILY_PLANNER,
-            user_preferences=user_preferences
-        )
+    try:
+        user_location = current_user_location()
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid lat/lon"}), 400
+    user_id = current_user_id()
+    preferences = user_store.get_preferences(user_id)
+    # e.g. ?filter=wheelchair AND indoor_seating, or a standing placeFilter preference
+    place_filter = request.args.get('filter') or preferences.get('placeFilter')
+    if place_filter:
+        try:
+            parse_place_filter(place_filter)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid filter: {e}"}), 400
+    timezone = request.headers.get('X-Timezone') or preferences.get('timezone')
+    daily_planner_result = await orchestrator.get_daily_plan(preferences, user_id=user_id, timezone=timezone)
     print(daily_planner_result)
-    activity_planner_result = await orchestrator.handle_activity_planning(daily_planner_result)
+    activity_planner_result = await orchestrator.handle_activity_planning(
+        daily_planner_result,
+        user_id=user_id,
+        timezone=timezone,
+        user_location=user_location,
+        place_filter=place_filter
+    )
 
     return jsonify(activity_planner_result)
 
+@app.route('/api/agent/itinerary', methods=['GET'])
+async def get_itinerary():
+    try:
+        user_location = current_user_location()
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid lat/lon"}), 400
+    user_id = current_user_id()
+    preferences = user_store.get_preferences(user_id)
+    place_filter = request.args.get('filter') or preferences.get('placeFilter')
+    if place_filter:
+        try:
+            parse_place_filter(place_filter)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid filter: {e}"}), 400
+    timezone = request.headers.get('X-Timezone') or preferences.get('timezone')
+    daily_planner_result = await orchestrator.get_daily_plan(preferences, user_id=user_id, timezone=timezone)
+    if not orchestrator.has_periods(daily_planner_result):
+        return jsonify({"error": "No daily plan available"}), 503
+    itinerary = await orchestrator.plan_itinerary(daily_planner_result, pace=preferences.get('pace', 'moderate'),
+                                                  user_location=user_location, user_id=user_id,
+                                                  place_filter=place_filter)
+    return jsonify(itinerary)
+
+@app.route('/api/places', methods=['GET'])
+def get_places():
+    """Places nearest the user, filtered by category, radius, text and tags, one page at a time.
+
+    Query parameters: lat, lon, category (comma separated), radius (metres), q, filter,
+    limit and cursor (next_cursor of the previous page). With format=ndjson or
+    Accept: application/x-ndjson the page is streamed one place per line, followed
+    by a {"next_cursor": ...} line.
+    """
+    try:
+        user_location = current_user_location() or DEFAULT_LOCATION
+        radius = request.args.get('radius')
+        radius = float(radius) if radius is not None else None
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        categories = request.args.get('category')
+        places, next_cursor = get_place_index().search(
+            user_location,
+            categories=categories.split(',') if categories else None,
+            radius_m=radius,
+            text=request.args.get('q'),
+            place_filter=request.args.get('filter'),
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    ndjson = (request.args.get('format') == 'ndjson'
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+    if not ndjson:
+        return jsonify({"places": places, "next_cursor": next_cursor})
+
+    def lines():
+        for place in places:
+            yield json.dumps(place) + "\n"
+        yield json.dumps({"next_cursor": next_cursor}) + "\n"
+
+    return Response(lines(), mimetype='application/x-ndjson')
+
 @app.route('/api/agent/store-activity', methods=['POST'])
 async def store_activity():
+    user_id = current_user_id()
     try:
         data = request.json
         activity = data.get('activity')
@@ -206,13 +433,16 @@ async def store_activity():
         if not activity or not details:
             return jsonify({"error": "Missing activity or details"}), 400
             
-        activity_history.add_activity(activity, details)
+        history_for_user(user_id).add_activity(activity, details)
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # Convert Flask app to ASGI
 app = WsgiToAsgi(app)
+app = StaticResponses(app, STATIC_ROUTES,
+                      headers=[('Access-Control-Allow-Origin', '*')])
+app = CompressionMiddleware(app)
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
@@ -0,0 +1,101 @@
+"""
+Compare two-call and fused activity planning.
+
+Both modes plan the same activities; the report shows wall time per plan
+and how many completions each mode needed. With --simulate the OpenAI and
+weather calls are replaced by a fake client that sleeps for the given
+latency per completion, which isolates the saved round trip; without it
+the real APIs are called (OPENAI_API_KEY and OPEN_WEATHER_API_KEY needed).
+
+Usage (from backend/):
+    python -m benchmarks.activity_planning --simulate 1500
+    python -m benchmarks.activity_planning --runs 3
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+ACTIVITIES = [
+    "breakfast at a cozy cafe",
+    "study session somewhere quiet",
+    "grab a beer with friends",
+    "watch a movie",
+]
+
+
+class FakeCompletions:
+    """Answers like gpt-4 would, after a fixed delay per completion."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        plan = {
+            "activity_name": "coffee",
+            "activity_description": "coffee nearby",
+            "text_to_speech": "Good morning! Anty here!",
+            "location_id": "0",
+        }
+        if kwargs.get("tools"):
+            arguments = json.dumps({**plan, "category": "cafe"})
+            tool_call = SimpleNamespace(function=SimpleNamespace(name="plan_activity", arguments=arguments))
+            message = SimpleNamespace(content=None, tool_calls=[tool_call])
+        elif "possible datasets" in kwargs["messages"][-1]["content"]:
+            message = SimpleNamespace(content=json.dumps({"dataset": "cafe"}), tool_calls=None)
+        else:
+            message = SimpleNamespace(content=json.dumps(plan), tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+async def bench(planner, mode: str, runs: int):
+    timings = []
+    for _ in range(runs):
+        for activity in ACTIVITIES:
+            start = time.perf_counter()
+            result = await planner.generate_recommendations(activity, mode=mode)
+            timings.append(time.perf_counter() - start)
+            if result["status"] != "success":
+                print(f"  {mode} failed for {activity!r}: {result.get('error')}")
+    return timings
+
+
+async def run(runs: int, simulate_ms):
+    if simulate_ms is not None:
+        # Planners fetch the weather on every plan
+        mock.patch("agent.activity_planner.get_weather", return_value={"description": "clear sky"}).start()
+    from agent.activity_planner import AntyAIActivityPlanner
+    planner = AntyAIActivityPlanner()
+
+    fake = None
+    if simulate_ms is not None:
+        fake = FakeCompletions(simulate_ms / 1000)
+        planner.client = SimpleNamespace(chat=SimpleNamespace(completions=fake))
+
+    start = time.perf_counter()
+    planner.category_candidates()
+    print(f"candidate precompute (once per process): {time.perf_counter() - start:.3f}s")
+
+    print(f"{'mode':>9} {'plans':>6} {'mean s':>8} {'p50 s':>8} {'max s':>8} {'calls/plan':>11}")
+    for mode in ("two_call", "fused"):
+        calls_before = fake.calls if fake else 0
+        timings = await bench(planner, mode, runs)
+        calls = f"{(fake.calls - calls_before) / len(timings):.1f}" if fake else "-"
+        print(f"{mode:>9} {len(timings):>6} {statistics.mean(timings):>8.3f} "
+              f"{statistics.median(timings):>8.3f} {max(timings):>8.3f} {calls:>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=1, help="passes over the sample activities")
+    parser.add_argument("--simulate", type=float, metavar="MS", default=None,
+                        help="use a fake OpenAI client with this latency per completion")
+    args = parser.parse_args()
+    asyncio.run(run(args.runs, args.simulate))
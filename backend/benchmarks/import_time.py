@@ -0,0 +1,67 @@
+"""
+Cold import time of the agent package against a budget.
+
+Each module is imported in a fresh interpreter with `python -X importtime`
+and its cumulative import time is compared with its budget. Light entry
+points must also not load the heavy client libraries at all (openai, the
+Google API clients, geopy), which catches an eager import sneaking back in
+even on a fast machine. Exits with status 1 when any check fails, so it
+can run in CI.
+
+Usage (from backend/):
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --scale 2    # slower machine, double the budgets
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+# module -> (budget in ms, top-level packages it must not import)
+BUDGETS = {
+    "agent": (100, ("openai", "googleapiclient", "google_auth_oauthlib", "numpy", "geopy")),
+    "agent.tools.geosorting": (400, ("openai", "googleapiclient", "google_auth_oauthlib", "geopy")),
+    "agent.metrics": (100, ("openai", "numpy")),
+    "agent.orchestrator": (1000, ("openai", "googleapiclient", "google_auth_oauthlib")),
+}
+
+_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(module: str):
+    """Cumulative import time in ms and the set of imported module names."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    imported = {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            imported[match.group(3)] = int(match.group(1))
+    return imported[module] / 1000, set(imported)
+
+
+def run(scale: float, repeat: int) -> bool:
+    ok = True
+    for module, (budget, forbidden) in BUDGETS.items():
+        # Best of a few runs, the first one may still be warming the OS file cache
+        runs = [measure(module) for _ in range(repeat)]
+        elapsed = min(ms for ms, _ in runs)
+        loaded = sorted(name for name in forbidden
+                        if any(m == name or m.startswith(name + ".") for m in runs[0][1]))
+        limit = budget * scale
+        status = "ok" if elapsed <= limit and not loaded else "FAIL"
+        ok = ok and status == "ok"
+        print(f"{status:4} {module:28} {elapsed:7.1f} ms (budget {limit:.0f} ms)"
+              + (f", imports {', '.join(loaded)}" if loaded else ""))
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.scale, args.repeat) else 1)
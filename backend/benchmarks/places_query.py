@@ -0,0 +1,98 @@
+"""
+Latency of /api/places queries against the in-memory place index.
+
+Runs a mix of queries (nearest of everything, one category within a radius,
+text search, tag filter, following a cursor) from random origins around the
+city centre, both on the index directly and through the Flask endpoint, and
+checks the p95 of each against its target. Exits with status 1 when a
+target is missed.
+
+Usage (from backend/):
+    python -m benchmarks.places_query --queries 500
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from agent.tools.geosorting import DEFAULT_LOCATION
+from agent.tools.places import get_place_index
+
+# p95 target in ms of a full HTTP round trip through Flask (JSON page of 20)
+ENDPOINT_P95_TARGET_MS = 20.0
+
+# name -> (search arguments, p95 target in ms of the index query)
+QUERIES = {
+    "nearest": ({}, 5.0),
+    "category_radius": ({"categories": ["cafe", "bar"], "radius_m": 1000}, 5.0),
+    "text": ({"text": "pizza"}, 5.0),
+    "tag_filter": ({"place_filter": "wheelchair AND outdoor"}, 5.0),
+    "next_page": ({}, 5.0),
+    # Mostly building the 500 result dicts
+    "large_page": ({"limit": 500}, 25.0),
+}
+
+
+def percentile(timings, q):
+    return sorted(timings)[max(int(len(timings) * q) - 1, 0)]
+
+
+def random_origin():
+    return (DEFAULT_LOCATION[0] + random.uniform(-0.02, 0.02), DEFAULT_LOCATION[1] + random.uniform(-0.03, 0.03))
+
+
+def bench_index(queries: int) -> bool:
+    start = time.perf_counter()
+    index = get_place_index()
+    print(f"index build: {(time.perf_counter() - start) * 1000:.0f} ms, {len(index.ids)} places")
+    ok = True
+    for name, (params, target) in QUERIES.items():
+        timings = []
+        for _ in range(queries):
+            origin = random_origin()
+            cursor = index.search(origin)[1] if name == "next_page" else None
+            start = time.perf_counter()
+            index.search(origin, cursor=cursor, **params)
+            timings.append((time.perf_counter() - start) * 1000)
+        p95 = percentile(timings, 0.95)
+        passed = p95 <= target
+        ok = ok and passed
+        print(f"{'ok' if passed else 'FAIL':4} index {name:16} p50 {statistics.median(timings):6.2f} ms, "
+              f"p95 {p95:6.2f} ms (target {target} ms)")
+    return ok
+
+
+def bench_endpoint(queries: int) -> bool:
+    from app import app as asgi_app
+
+    flask_app = asgi_app
+    while not hasattr(flask_app, "wsgi_application"):
+        flask_app = flask_app.app
+    client = flask_app.wsgi_application.test_client()
+    timings = []
+    for _ in range(queries):
+        lat, lon = random_origin()
+        start = time.perf_counter()
+        response = client.get(f"/api/places?lat={lat}&lon={lon}&category=cafe,restaurant&radius=2000")
+        timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            sys.exit(f"/api/places answered {response.status_code}: {response.get_data(as_text=True)}")
+    p95 = percentile(timings, 0.95)
+    passed = p95 <= ENDPOINT_P95_TARGET_MS
+    print(f"{'ok' if passed else 'FAIL':4} GET /api/places      p50 {statistics.median(timings):6.2f} ms, "
+          f"p95 {p95:6.2f} ms (target {ENDPOINT_P95_TARGET_MS} ms)")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--skip-endpoint", action="store_true",
+                        help="Only the index; importing the app needs its API keys and network access")
+    args = parser.parse_args()
+    ok = bench_index(args.queries)
+    if not args.skip_endpoint:
+        ok = bench_endpoint(args.queries) and ok
+    sys.exit(0 if ok else 1)
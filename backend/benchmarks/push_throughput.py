@@ -0,0 +1,92 @@
+"""
+Throughput benchmark for PushDispatcher against a local fake push service.
+
+The fake service accepts every POST after a fixed delay (to stand in for
+the network round trip to FCM/Mozilla/APNs) and answers 410 for a share of
+endpoints so pruning is exercised too. Payloads are really encrypted by
+pywebpush, so the numbers include the per-message crypto cost.
+
+Usage (from backend/):
+    python -m benchmarks.push_throughput --subscriptions 500 --latency-ms 50
+"""
+
+import argparse
+import base64
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives import serialization
+
+from agent.notifications import PushDispatcher
+from agent.user_store import UserStore
+
+
+def make_handler(latency: float):
+    class FakePushService(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            status = 410 if self.path.startswith("/gone/") else 201
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakePushService
+
+
+def make_subscription(base_url: str, index: int, gone: bool) -> dict:
+    public_key = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+    return {
+        "endpoint": f"{base_url}/{'gone' if gone else 'push'}/{index}",
+        "keys": {
+            "p256dh": base64.urlsafe_b64encode(public_key).decode().rstrip("="),
+            "auth": base64.urlsafe_b64encode(os.urandom(16)).decode().rstrip("="),
+        },
+    }
+
+
+def run(subscriptions: int, latency_ms: float, gone_ratio: float, workers_options):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(latency_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    gone_every = int(1 / gone_ratio) if gone_ratio else 0
+    subs = [make_subscription(base_url, i, bool(gone_every) and i % gone_every == 0) for i in range(subscriptions)]
+
+    print(f"{subscriptions} subscriptions, {latency_ms:.0f} ms simulated push latency")
+    print(f"{'workers':>8} {'seconds':>9} {'msg/s':>9} {'sent':>6} {'expired':>8} {'failed':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in workers_options:
+            store = UserStore(os.path.join(tmp, f"bench-{workers}.db"))
+            with store.transaction():
+                for sub in subs:
+                    store.add_subscription(f"user-{sub['endpoint'].rsplit('/', 1)[1]}", sub)
+            dispatcher = PushDispatcher(store, None, {}, max_workers=workers, max_retries=0)
+            start = time.perf_counter()
+            counts = dispatcher.broadcast({"title": "Benchmark", "body": "Hello", "url": "/"})
+            elapsed = time.perf_counter() - start
+            dispatcher.shutdown()
+            print(f"{workers:>8} {elapsed:>9.2f} {subscriptions / elapsed:>9.0f} "
+                  f"{counts['sent']:>6} {counts['expired']:>8} {counts['failed']:>7}")
+            assert len(store.get_subscriptions()) == counts["sent"], "expired subscriptions were not pruned"
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--subscriptions", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--gone-ratio", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+    run(args.subscriptions, args.latency_ms, args.gone_ratio, args.workers)
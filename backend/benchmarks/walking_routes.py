@@ -0,0 +1,53 @@
+"""
+Latency of one-to-many walking-time queries on the built walking graph.
+
+Each query snaps a random origin near the city centre and asks for the
+walking minutes to the nearest places of a category, the same query the
+geosorting ranking runs. Build the graph first with:
+    python datasets/data_loader.py --walking-graph
+
+Usage (from backend/):
+    python -m benchmarks.walking_routes --queries 200 --category cafe
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from agent.tools.geosorting import DEFAULT_LOCATION, load_dataset, sort_locations_by_distance
+from agent.tools.walking_graph import GRAPH_PATH, get_walking_graph
+
+
+def run(queries: int, category: str, top_n: int):
+    start = time.perf_counter()
+    graph = get_walking_graph()
+    if graph is None:
+        sys.exit(f"No walking graph at {GRAPH_PATH}; build it with data_loader.py --walking-graph")
+    print(f"graph load: {time.perf_counter() - start:.2f}s, {graph.node_count} junctions")
+
+    places = load_dataset(category)
+    timings = []
+    reachable = 0
+    for _ in range(queries):
+        origin = (DEFAULT_LOCATION[0] + random.uniform(-0.01, 0.01), DEFAULT_LOCATION[1] + random.uniform(-0.015, 0.015))
+        nearest = sort_locations_by_distance([dict(p) for p in places], origin)[:top_n]
+        start = time.perf_counter()
+        minutes = graph.walking_minutes(origin, [(p['lat'], p['lon']) for p in nearest])
+        timings.append((time.perf_counter() - start) * 1000)
+        reachable += sum(m is not None for m in minutes)
+
+    timings.sort()
+    print(f"{queries} queries to the {top_n} nearest '{category}' places")
+    print(f"p50 {statistics.median(timings):.2f} ms, p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, "
+          f"max {timings[-1]:.2f} ms, {reachable}/{queries * top_n} reachable")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--category", default="cafe")
+    parser.add_argument("--top-n", type=int, default=10)
+    args = parser.parse_args()
+    run(args.queries, args.category, args.top_n)
@@ -0,0 +1,78 @@
+"""
+Per-worker memory of the POI data, private vs. shared (POI_INDEX_SHARED=1).
+
+Starts N worker processes at once in each mode. Every worker imports the
+geosorting stack, builds the /api/places index and ranks every category
+from a few locations, then reports its memory from /proc/self/smaps_rollup
+while all workers are still alive: RSS, PSS (shared pages divided among the
+processes mapping them) and USS (pages private to the worker). A baseline
+run that only imports the modules shows what the data itself costs.
+The shared run builds the segment first. Linux only.
+
+Usage (from backend/):
+    python -m benchmarks.worker_memory --workers 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+WORKER = r"""
+import json, sys
+from agent.tools import geosorting
+from agent.tools.places import dataset_categories, get_place_index
+if sys.argv[1] != "baseline":
+    index = get_place_index()
+    for category in dataset_categories():
+        for lat, lon in ((51.2206, 4.4024), (51.2135, 4.4211), (51.2301, 4.4156)):
+            geosorting.rank_places(category, (lat, lon), limit=20)
+    index.search((51.2206, 4.4024), text="caf", limit=50)
+memory = {}
+with open("/proc/self/smaps_rollup") as f:
+    for line in f:
+        key, _, value = line.partition(":")
+        if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+            memory[key] = int(value.split()[0])
+print(json.dumps(memory), flush=True)
+sys.stdin.read()
+"""
+
+
+def run_workers(mode: str, workers: int):
+    env = dict(os.environ, POI_INDEX_SHARED="1" if mode == "shared" else "0")
+    processes = [subprocess.Popen([sys.executable, "-c", WORKER, mode], env=env, text=True,
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                 for _ in range(workers)]
+    # Every worker has reported (and is still alive) before any of them exits
+    reports = [json.loads(process.stdout.readline()) for process in processes]
+    for process in processes:
+        process.communicate("")
+    return reports
+
+
+def main(workers: int):
+    if not sys.platform.startswith("linux"):
+        sys.exit("Needs /proc/self/smaps_rollup (Linux)")
+    from agent.tools import poi_store
+    segment = poi_store.build()
+    print(f"built {segment}\n")
+    print(f"{workers} workers     RSS MB   PSS MB   USS MB   (per worker, mean)")
+    baseline = None
+    for mode in ("baseline", "private", "shared"):
+        reports = run_workers(mode, workers)
+        rss = sum(r["Rss"] for r in reports) / len(reports) / 1024
+        pss = sum(r["Pss"] for r in reports) / len(reports) / 1024
+        uss = sum(r["Private_Clean"] + r["Private_Dirty"] for r in reports) / len(reports) / 1024
+        extra = "" if baseline is None else f"   data: +{pss - baseline:.1f} MB PSS"
+        print(f"{mode:14} {rss:8.1f} {pss:8.1f} {uss:8.1f}{extra}")
+        if mode == "baseline":
+            baseline = pss
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    main(args.workers)
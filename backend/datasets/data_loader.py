@@ -1,22 +1,154 @@
 import os
+import sys
 import json
 import ast
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+import numpy as np
 from datasets import load_dataset
 from tqdm import tqdm
-from collections import defaultdict
+from collections import defaultdict, Counter
 
+# The agent package lives in backend/; appended so `datasets` above stays the Hugging Face package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agent.tools.geo import haversine_m
 
-def load_and_process_osm_data(dataset_name="ns2agi/antwerp-osm-navigator"):
+# Highway types a pedestrian can use; motorways and trunk roads are left out.
+WALKABLE_HIGHWAYS = {
+    "footway", "pedestrian", "path", "steps", "living_street", "residential",
+    "service", "unclassified", "track", "cycleway", "corridor", "crossing",
+    "tertiary", "tertiary_link", "secondary", "secondary_link",
+    "primary", "primary_link", "road",
+}
+
+# Read by agent/tools/geosorting.py, whose caches are keyed by these stamps
+VERSION_PATH = "data/maps_dataset_version.json"
+CHANGELOG_PATH = "data/maps_dataset_changelog.jsonl"
+
+
+def load_and_process_osm_data(dataset_name="ns2agi/antwerp-osm-navigator",
+                              element_types=("node",)):
     print(f"Loading dataset: {dataset_name}")
     dataset = load_dataset(dataset_name)
     train_split = dataset["train"]
     node_dataset = train_split.filter(lambda example:
-                                      example["type"] == "node")
+                                      example["type"] in element_types)
     return node_dataset
 
 
+def _parse_field(value):
+    # The dataset stores tags and way node lists as Python literals.
+    if isinstance(value, str):
+        return ast.literal_eval(value)
+    return value
+
+
+def _is_walkable(tags):
+    if tags.get("highway") not in WALKABLE_HIGHWAYS:
+        return False
+    if tags.get("foot") == "no" or tags.get("access") in ("private", "no"):
+        return tags.get("foot") in ("yes", "designated")
+    return True
+
+
+def build_walking_graph(dataset, output_path="data/walking_graph.npz"):
+    """Build a compact walking graph from OSM ways and their nodes.
+
+    Chains of shape points between junctions are contracted into single
+    edges, and the graph is stored in CSR arrays (indptr/indices/weights in
+    metres). Every original way node is kept as a snap point that knows the
+    edge it lies on and its distance to both ends, so origins and
+    destinations can be placed on the street network exactly.
+    """
+    print("\nCollecting walkable ways")
+    ways = []
+    for record in tqdm(dataset, total=len(dataset), desc="Ways", unit="record"):
+        if record["type"] != "way":
+            continue
+        try:
+            if not _is_walkable(_parse_field(record["tags"])):
+                continue
+            refs = _parse_field(record.get("nodes"))
+            if refs and len(refs) > 1:
+                ways.append([int(ref) for ref in refs])
+        except Exception as e:
+            print(f"Error processing way {record['id']}: {e}")
+
+    used = {ref for way in ways for ref in way}
+    coords = {}
+    for record in tqdm(dataset, total=len(dataset), desc="Nodes", unit="record"):
+        if record["type"] == "node" and record["id"] in used:
+            coords[record["id"]] = (record["lat"], record["lon"])
+    ways = [[ref for ref in way if ref in coords] for way in ways]
+    ways = [way for way in ways if len(way) > 1]
+
+    # Junctions: way ends and nodes shared by several ways (or visited twice by one)
+    occurrences = Counter(ref for way in ways for ref in way)
+    junctions = {ref for ref, count in occurrences.items() if count > 1}
+    junctions.update(way[0] for way in ways)
+    junctions.update(way[-1] for way in ways)
+    junction_index = {ref: i for i, ref in enumerate(sorted(junctions))}
+
+    edges = {}
+    snap_points = {}
+    for way in ways:
+        lats = np.array([coords[ref][0] for ref in way])
+        lons = np.array([coords[ref][1] for ref in way])
+        along = np.concatenate([[0.0], np.cumsum(haversine_m(lats[:-1], lons[:-1], lats[1:], lons[1:]))])
+        start = 0
+        for end in range(1, len(way)):
+            if way[end] not in junctions:
+                continue
+            u, v = junction_index[way[start]], junction_index[way[end]]
+            length = along[end] - along[start]
+            if u != v:
+                key = (min(u, v), max(u, v))
+                edges[key] = min(edges.get(key, length), length)
+            for i in range(start, end + 1):
+                snap_points.setdefault(way[i], (lats[i], lons[i], u, v,
+                                                along[i] - along[start], along[end] - along[i]))
+            start = end
+
+    node_count = len(junction_index)
+    adjacency = [[] for _ in range(node_count)]
+    for (u, v), length in edges.items():
+        adjacency[u].append((v, length))
+        adjacency[v].append((u, length))
+    indptr = np.zeros(node_count + 1, dtype=np.int32)
+    indptr[1:] = np.cumsum([len(neighbours) for neighbours in adjacency])
+    indices = np.array([v for neighbours in adjacency for v, _ in neighbours], dtype=np.int32)
+    weights = np.array([w for neighbours in adjacency for _, w in neighbours], dtype=np.float32)
+
+    junction_refs = sorted(junctions)
+    snaps = np.array(list(snap_points.values()), dtype=np.float64).reshape(-1, 6)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    np.savez_compressed(
+        output_path,
+        lat=np.array([coords[ref][0] for ref in junction_refs]),
+        lon=np.array([coords[ref][1] for ref in junction_refs]),
+        indptr=indptr,
+        indices=indices,
+        weights=weights,
+        snap_lat=snaps[:, 0],
+        snap_lon=snaps[:, 1],
+        snap_u=snaps[:, 2].astype(np.int32),
+        snap_v=snaps[:, 3].astype(np.int32),
+        snap_du=snaps[:, 4].astype(np.float32),
+        snap_dv=snaps[:, 5].astype(np.float32),
+    )
+    print(f"Saved walking graph with {node_count} junctions, {len(edges)} edges "
+          f"and {len(snaps)} snap points to {output_path}")
+
+
 def extract_data(dataset, amenity_categories, shop_categories,
-                 output_dir="data/maps_dataset"):
+                 output_dir="data/maps_dataset", incremental=False):
+    """Write one JSON file per category.
+
+    With incremental=True the extract is diffed against the existing files by
+    OSM id and content hash: only categories with changes are rewritten, and
+    the added/removed/changed ids are appended to the changelog.
+    """
     print("\nFiltering categories for amenities and shops")
     filtered_amenities = defaultdict(list)
     filtered_shops = defaultdict(list)
@@ -24,6 +156,9 @@ def extract_data(dataset, amenity_categories, shop_categories,
 
     for record in tqdm(dataset, total=total_records, desc="Filtering",
                        unit="record"):
+        if record['type'] != "node":
+            # Ways are only loaded for the walking graph
+            continue
         try:
             tags = ast.literal_eval(record['tags'])
 
@@ -40,29 +175,99 @@ def extract_data(dataset, amenity_categories, shop_categories,
 
     # Save results for amenities and shops
     os.makedirs(output_dir, exist_ok=True)
+    changes = {}
+    for kind, filtered in (("amenity", filtered_amenities), ("shop", filtered_shops)):
+        for category, records in filtered.items():
+            file_path = os.path.join(output_dir, f"{category}.json")
+            if incremental:
+                diff = diff_category(_read_records(file_path), records)
+                if not any(diff.values()):
+                    continue
+                changes[category] = diff
+                print(f"{kind} '{category}': {len(diff['added'])} added, "
+                      f"{len(diff['removed'])} removed, {len(diff['changed'])} changed")
+            _write_json_atomic(file_path, records, indent=2)
+            print(f"Saved {len(records)} entries for {kind} '{category}' "
+                  f"to {file_path}")
 
-    # Save amenities data
-    for category, records in filtered_amenities.items():
-        file_path = os.path.join(output_dir, f"{category}.json")
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(records, f, indent=2, ensure_ascii=False)
-        print(f"Saved {len(records)} entries for amenity '{category}' "
-              f"to {file_path}")
-
-    # Save shops data
-    for category, records in filtered_shops.items():
-        file_path = os.path.join(output_dir, f"{category}.json")
-        if os.path.exists(file_path):
-            print(f"Skipping existing file: {file_path}")
-            continue
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(records, f, indent=2, ensure_ascii=False)
-        print(f"Saved {len(records)} entries for shop '{category}' "
-              f"to {file_path}")
+    if incremental:
+        if changes:
+            _append_changelog(changes)
+        else:
+            print("No changes")
+    write_version_stamp(output_dir)
+
+
+def _record_hash(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True, ensure_ascii=False,
+                                   default=str).encode("utf-8")).hexdigest()
+
+
+def _read_records(file_path):
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def diff_category(old_records, new_records):
+    """OSM ids added, removed and changed (by content hash) between two extracts."""
+    old = {record['id']: _record_hash(record) for record in old_records}
+    new = {record['id']: _record_hash(record) for record in new_records}
+    return {
+        "added": sorted(set(new) - set(old)),
+        "removed": sorted(set(old) - set(new)),
+        "changed": sorted(i for i in set(old) & set(new) if old[i] != new[i]),
+    }
+
+
+def _write_json_atomic(file_path, data, indent=None):
+    """Write to a temporary file next to the target and rename it over, so readers never see half a file."""
+    directory = os.path.dirname(file_path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _append_changelog(changes):
+    entry = {"time": datetime.now(timezone.utc).isoformat(timespec="seconds"), "categories": changes}
+    with open(CHANGELOG_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+    print(f"Appended changes of {len(changes)} categories to {CHANGELOG_PATH}")
+
+
+def write_version_stamp(output_dir="data/maps_dataset"):
+    """Stamp every category file with its content hash; the app reloads the categories whose stamp changed."""
+    categories = {}
+    for name in sorted(os.listdir(output_dir)):
+        if name.endswith(".json"):
+            with open(os.path.join(output_dir, name), "rb") as f:
+                categories[name[:-len(".json")]] = hashlib.sha1(f.read()).hexdigest()
+    version = hashlib.sha1(json.dumps(categories, sort_keys=True).encode("utf-8")).hexdigest()
+    _write_json_atomic(VERSION_PATH, {
+        "version": version,
+        "updated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "categories": categories,
+    }, indent=2)
+    print(f"Dataset version {version[:12]} written to {VERSION_PATH}")
 
 
 if __name__ == "__main__":
-    dataset = load_and_process_osm_data()
+    # --stamp only re-stamps the current files (e.g. after editing one by hand)
+    if "--stamp" in sys.argv[1:]:
+        write_version_stamp()
+        sys.exit()
+    # Pass --walking-graph to also keep OSM ways and build data/walking_graph.npz
+    with_graph = "--walking-graph" in sys.argv[1:]
+    # Pass --incremental to only rewrite categories that changed, with a changelog
+    incremental = "--incremental" in sys.argv[1:]
+    element_types = ("node", "way") if with_graph else ("node",)
+    dataset = load_and_process_osm_data(element_types=element_types)
 
     # These categories were identified as student-relevant
     amenity_categories = {
@@ -80,6 +285,10 @@ if __name__ == "__main__":
     output_dir = "data/maps_dataset"
 
     # Run the optimized extraction process
-    extract_data(dataset, amenity_categories, shop_categories, output_dir)
+    extract_data(dataset, amenity_categories, shop_categories, output_dir,
+                 incremental=incremental)
+
+    if with_graph:
+        build_walking_graph(dataset)
 
     print("\nScript finished.")
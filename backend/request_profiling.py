@@ -0,0 +1,66 @@
+"""
+Per-request profiling hooks for the Flask app (see agent/profiler.py).
+
+Nothing is installed unless PROFILE_SAMPLE_RATE or PROFILE_ALLOW_HEADER is
+set, so by default requests don't pay for the hooks at all. A profiled
+request gets its profile written when it ends, and the file name is returned
+in the X-Profile-File response header.
+"""
+
+import logging
+import os
+import random
+from typing import Optional
+
+from flask import g, request
+
+from agent.profiler import PROFILE_ALLOW_HEADER, PROFILE_SAMPLE_RATE, SamplingProfiler
+
+logger = logging.getLogger(__name__)
+
+
+def _should_profile() -> bool:
+    if PROFILE_ALLOW_HEADER and request.headers.get('X-Profile') == '1':
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def current_profiler() -> Optional[SamplingProfiler]:
+    return g.get('profiler')
+
+
+def init_app(app) -> None:
+    """Install the per-request profiling hooks on a Flask app, if profiling is enabled."""
+    if PROFILE_SAMPLE_RATE <= 0 and not PROFILE_ALLOW_HEADER:
+        return
+
+    @app.before_request
+    def _start_profiler():
+        if _should_profile():
+            g.profiler = SamplingProfiler(f"{request.method} {request.path}")
+            g.profiler.start()
+
+    @app.after_request
+    def _finish_profiler(response):
+        profiler = current_profiler()
+        if profiler is not None:
+            profiler.stop()
+            try:
+                path = profiler.write()
+                response.headers['X-Profile-File'] = os.path.basename(path)
+            except OSError as e:
+                logger.warning("Error writing request profile: %s", e)
+        return response
+
+    # Flask runs async views in an event loop on another thread; sample that one as well.
+    async_to_sync = app.async_to_sync
+
+    def profiled_async_to_sync(func):
+        async def run(*args, **kwargs):
+            profiler = current_profiler()
+            if profiler is not None:
+                profiler.add_current_thread()
+            return await func(*args, **kwargs)
+        return async_to_sync(run)
+
+    app.async_to_sync = profiled_async_to_sync